@@ -0,0 +1,2 @@
+# 各次实践作业控制器共用的P4Runtime控制面组件。
+# 依赖tutorials中的utils/p4runtime_lib，使用前需先把utils目录加入sys.path。
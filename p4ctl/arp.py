@@ -0,0 +1,147 @@
+"""
+由拓扑的主机表生成arp_exact表项，让交换机直接应答主机的ARP请求(basic.p4的
+send_arp_reply)。每台交换机只需要应答直连主机：网关地址用/32表项，主机所在网段
+的其他地址用网段表项(代理ARP，跨交换机的同网段主机也经三层转发)，都回答网关MAC。
+
+已写入的表项缓存在ArpResponder里，拓扑变化后只写差异。
+"""
+import os
+
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.batch import DEFAULT_BATCH_SIZE, buildTableEntryFromSpec, buildUpdate, writeUpdates
+from p4ctl.runtime import Plugin
+from p4ctl.topo import Topology
+
+ARP_TABLE = 'MyIngress.arp_exact'
+ARP_OPER_REQUEST = 1
+
+
+def gatewayMac(info):
+    """
+    主机的网关MAC：topology.json里有arp -s命令时用它，否则沿用手写拓扑的约定，
+    即主机MAC最后一个字节置0(例如08:00:00:00:01:11的网关为08:00:00:00:01:00)。
+    """
+    if info['gw_mac']:
+        return info['gw_mac']
+    return info['mac'].rsplit(':', 1)[0] + ':00'
+
+
+def _network(ip, prefix_len):
+    value = 0
+    for octet in ip.split('.'):
+        value = (value << 8) | int(octet)
+    value &= (0xffffffff << (32 - prefix_len)) & 0xffffffff
+    return '.'.join(str((value >> shift) & 0xff) for shift in (24, 16, 8, 0))
+
+
+def arpEntries(topology):
+    """
+    :param topology: a Topology
+    :return: {switch name: {(ip, prefix_len): mac to answer with}}
+    """
+    entries = dict((name, {}) for name in topology.switches)
+    for info in topology.hosts.values():
+        if info['switch'] is None:
+            continue
+        answers = entries.setdefault(info['switch'], {})
+        mac = gatewayMac(info)
+        if info['gw'] is not None:
+            answers[(info['gw'], 32)] = mac
+        if info['prefix_len'] < 32:
+            # 同一网段的多台主机得到同一个表项
+            answers.setdefault((_network(info['ip'], info['prefix_len']),
+                                info['prefix_len']), mac)
+    return entries
+
+
+def _flow(key, mac):
+    ip, prefix_len = key
+    return {'table': ARP_TABLE,
+            'match': {'hdr.arp.oper': [ARP_OPER_REQUEST],
+                      'hdr.arp_ipv4.tpa': [ip, prefix_len]},
+            'action_name': 'MyIngress.send_arp_reply',
+            'action_params': {'dstAddr': mac}}
+
+
+class ArpResponder(Plugin):
+    """
+    安装时写入由拓扑推导出的全部arp_exact表项；之后每次sync只写与缓存的差异
+    (新主机INSERT、网关MAC变化MODIFY、主机移走DELETE)，按batch_size分批。
+    给出topo_file_path时周期检查该文件，修改后重新读取并sync。
+    """
+    name = 'arp'
+
+    def __init__(self, topology, topo_file_path=None, interval=1.0,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param topology: the Topology to derive the entries from
+        :param topo_file_path: topology.json to watch for added hosts
+        """
+        self.topology = topology
+        self.topo_file_path = topo_file_path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.installed = {}
+        self._mtime = None
+        if topo_file_path is not None:
+            self._mtime = os.stat(topo_file_path).st_mtime
+
+    def install(self, runtime):
+        counts = self.sync(runtime)
+        print("Installed %d ARP responder entries on %d switches" % (
+            sum(counts.values()), len(counts)))
+
+    def tasks(self, runtime):
+        if self.topo_file_path is None:
+            return []
+        return [('arp-topology', self.interval, self.reload)]
+
+    def addHost(self, runtime, name, params, switch_port):
+        """
+        增加一台主机并写入它带来的表项。
+
+        :param params: the host entry as written in topology.json
+        :param switch_port: where the host is attached, e.g. 's1-p3'
+        """
+        self.topology.addHost(name, params)
+        self.topology.addLink(name, switch_port)
+        return self.sync(runtime)
+
+    def reload(self, runtime):
+        mtime = os.stat(self.topo_file_path).st_mtime
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        self.topology = Topology.fromFile(self.topo_file_path)
+        counts = self.sync(runtime)
+        if any(counts.values()):
+            print("ARP responder updated: %s" % ', '.join(
+                "%s=%d" % (name, n) for name, n in sorted(counts.items()) if n))
+
+    def sync(self, runtime):
+        """
+        :return: {switch name: number of entries written}
+        """
+        counts = {}
+        for name, desired in arpEntries(self.topology).items():
+            if name not in runtime.switch_names:
+                continue
+            current = self.installed.setdefault(name, {})
+            updates = []
+            for key in [k for k in current if k not in desired]:
+                updates.append(self._update(runtime, key, current.pop(key),
+                                            p4runtime_pb2.Update.DELETE))
+            for key, mac in desired.items():
+                if key not in current:
+                    updates.append(self._update(runtime, key, mac, p4runtime_pb2.Update.INSERT))
+                elif current[key] != mac:
+                    updates.append(self._update(runtime, key, mac, p4runtime_pb2.Update.MODIFY))
+            counts[name] = writeUpdates(runtime.switch(name), updates, self.batch_size)
+            current.update(desired)
+        return counts
+
+    @staticmethod
+    def _update(runtime, key, mac, update_type):
+        return buildUpdate(buildTableEntryFromSpec(runtime.p4info_helper, _flow(key, mac)),
+                           update_type)
@@ -0,0 +1,74 @@
+from p4.v1 import p4runtime_pb2
+
+# 单个WriteRequest中携带的更新条数上限
+DEFAULT_BATCH_SIZE = 256
+
+
+def buildTableEntryFromSpec(p4info_helper, flow):
+    """
+    把sX-runtime.json中table_entries的一项转换为TableEntry，
+    字段含义与utils/p4runtime_lib/simple_controller.py相同。
+    """
+    return p4info_helper.buildTableEntry(
+        table_name=flow['table'],
+        match_fields=flow.get('match'),
+        default_action=flow.get('default_action', False),
+        action_name=flow['action_name'],
+        action_params=flow.get('action_params'),
+        priority=flow.get('priority'))
+
+
+def buildUpdate(table_entry, update_type=None):
+    """
+    :param table_entry: the TableEntry
+    :param update_type: p4runtime_pb2.Update.INSERT/MODIFY/DELETE; by default
+                        MODIFY for default actions and INSERT otherwise, as in
+                        SwitchConnection.WriteTableEntry
+    """
+    update = p4runtime_pb2.Update()
+    if update_type is None:
+        if table_entry.is_default_action:
+            update_type = p4runtime_pb2.Update.MODIFY
+        else:
+            update_type = p4runtime_pb2.Update.INSERT
+    update.type = update_type
+    update.entity.table_entry.CopyFrom(table_entry)
+    return update
+
+
+def writeUpdates(sw, updates, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    把一组Update按batch_size分批，每批用一个WriteRequest写入交换机。
+
+    :param sw: the switch connection
+    :param updates: an iterable of p4runtime_pb2.Update
+    :return: the number of updates written
+    """
+    count = 0
+    request = None
+    for update in updates:
+        if request is None:
+            request = p4runtime_pb2.WriteRequest()
+            request.device_id = sw.device_id
+            # arbitrate记录的election_id；用SwitchConnection自带的仲裁时为1
+            election_id = getattr(sw, 'election_id', 1)
+            request.election_id.high = election_id >> 64
+            request.election_id.low = election_id & 0xffffffffffffffff
+        request.updates.add().CopyFrom(update)
+        if len(request.updates) >= batch_size:
+            sw.client_stub.Write(request)
+            count += len(request.updates)
+            request = None
+    if request is not None:
+        sw.client_stub.Write(request)
+        count += len(request.updates)
+    return count
+
+
+def writeTableEntries(sw, table_entries, batch_size=DEFAULT_BATCH_SIZE,
+                      update_type=None):
+    """
+    批量版的SwitchConnection.WriteTableEntry。
+    """
+    return writeUpdates(sw, (buildUpdate(e, update_type) for e in table_entries),
+                        batch_size)
@@ -0,0 +1,125 @@
+"""
+大规模拓扑的运行剖析：对不同规模的fat-tree/leaf-spine，测量拓扑和表项生成、
+离线可达性验证的耗时和内存。默认只报告进程的最大RSS；tracemalloc会让Python代码
+慢好几倍，所以各步骤的内存峰值要加--trace-memory单独测。
+
+    python -m p4ctl.bench_scale --fattree 4 8 16 --leafspine 16x4x8 32x8x16
+
+加上--install时，额外把已生成并正在运行(make run)的拓扑的表项经ShardedController
+下发，测量安装耗时；此时需要tutorials/utils在PYTHONPATH中：
+    python -m p4ctl.bench_scale --install fattree-k4/topology.json --workers 4
+"""
+import argparse
+import resource
+import time
+import tracemalloc
+
+from p4ctl.topogen import buildRuntime, fatTree, leafSpine, verifyRuntime
+
+
+def _measure(trace_memory, fn, *args):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def profileTopology(label, make_topo, classes=1, trace_memory=False):
+    """
+    :return: dict with sizes, timings (s) and, with trace_memory, the peak
+             memory (bytes) of each step
+    """
+    topo, gen_time, gen_peak = _measure(trace_memory, make_topo)
+    runtimes, rt_time, rt_peak = _measure(trace_memory, buildRuntime, topo, classes)
+    (pairs, failures), verify_time, verify_peak = _measure(
+        trace_memory, verifyRuntime, topo, runtimes)
+    return {'label': label, 'switches': len(topo['switches']), 'hosts': len(topo['hosts']),
+            'entries': sum(len(r['table_entries']) for r in runtimes.values()),
+            'pairs': pairs, 'failures': len(failures),
+            'build_time': gen_time + rt_time,
+            'build_peak': max(gen_peak, rt_peak) if trace_memory else None,
+            'verify_time': verify_time, 'verify_peak': verify_peak}
+
+
+def _mb(n):
+    return '-' if n is None else '%.1fMB' % (n / 2 ** 20)
+
+
+def profileInstall(topo_file_path, p4info_file_path, bmv2_file_path, num_workers=None):
+    """
+    把topo_file_path中各交换机runtime_json的表项经ShardedController下发。
+    """
+    from p4ctl.sharding import ShardedController
+    from p4ctl.topo import loadRuntimeEntries, loadTopology
+
+    topo = loadTopology(topo_file_path)
+    rules = loadRuntimeEntries(topo, '.')
+    controller = ShardedController(p4info_file_path, bmv2_file_path,
+                                   list(topo['switches']), num_workers)
+    start = time.perf_counter()
+    controller.start()
+    start_time = time.perf_counter() - start
+    try:
+        start = time.perf_counter()
+        installed = controller.install(rules)
+        install_time = time.perf_counter() - start
+    finally:
+        controller.stop()
+    return {'shards': len(controller.shards), 'start_time': start_time,
+            'install_time': install_time, 'entries': sum(installed.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Large topology profile')
+    parser.add_argument('--fattree', help='fat-tree arities to profile',
+                        type=int, nargs='*', action="store", required=False, default=[4, 8, 16])
+    parser.add_argument('--leafspine', help='leaf-spine sizes as LEAVESxSPINESxHOSTS',
+                        type=str, nargs='*', action="store", required=False, default=[])
+    parser.add_argument('--classes', help='number of ipv4_lpm tables to fill (1-3)',
+                        type=int, choices=[1, 2, 3], action="store", required=False, default=1)
+    parser.add_argument('--trace-memory', help='measure the peak memory of each step',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--install', help='topology.json of a running network to install',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--workers', help='number of worker processes for --install',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/basic.p4.p4info.txt')
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/basic.json')
+    args = parser.parse_args()
+
+    cases = [('fattree k=%d' % k, lambda k=k: fatTree(k)) for k in args.fattree]
+    for size in args.leafspine:
+        leaves, spines, hosts = (int(x) for x in size.split('x'))
+        cases.append(('leafspine %s' % size,
+                      lambda l=leaves, s=spines, h=hosts: leafSpine(l, s, h)))
+
+    print("%-20s %8s %8s %9s %10s %10s %10s %10s %8s" % (
+        'topology', 'switches', 'hosts', 'entries', 'build', 'build mem',
+        'verify', 'verify mem', 'failed'))
+    for label, make_topo in cases:
+        r = profileTopology(label, make_topo, args.classes, args.trace_memory)
+        print("%-20s %8d %8d %9d %8.2fs %10s %8.2fs %10s %8d" % (
+            label, r['switches'], r['hosts'], r['entries'], r['build_time'],
+            _mb(r['build_peak']), r['verify_time'], _mb(r['verify_peak']), r['failures']))
+    # Linux上ru_maxrss以KB为单位
+    print("max RSS: %.1fMB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+    if args.install:
+        r = profileInstall(args.install, args.p4info, args.bmv2_json, args.workers)
+        print("Installed %d entries with %d shards: start %.2fs, install %.2fs (%.0f entries/s)" % (
+            r['entries'], r['shards'], r['start_time'], r['install_time'],
+            r['entries'] / r['install_time'] if r['install_time'] else 0))
+
+
+if __name__ == '__main__':
+    main()
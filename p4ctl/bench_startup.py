@@ -0,0 +1,83 @@
+"""
+控制器和主机脚本的冷启动基准：每个场景在新的Python进程里运行若干次，报告
+中位数和最小耗时。
+
+    python -m p4ctl.bench_startup --p4info 大作业/mrc/build/basic.p4.p4info.txt
+
+需要tutorials/utils在PYTHONPATH中(或用--utils指定)；未安装scapy时跳过scapy场景。
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = [
+    ('p4info: text parse (P4InfoHelper)',
+     'import p4runtime_lib.helper\n'
+     'p4runtime_lib.helper.P4InfoHelper(P4INFO)'),
+    ('p4info: binary cache (loadP4InfoHelper)',
+     'from p4ctl.p4info_cache import loadP4InfoHelper\n'
+     'loadP4InfoHelper(P4INFO)'),
+    ('controller imports (runtime + cached p4info)',
+     'from p4ctl.p4info_cache import loadP4InfoHelper\n'
+     'from p4ctl.runtime import ControllerRuntime\n'
+     'loadP4InfoHelper(P4INFO)'),
+    ('scapy: from scapy.all import ...',
+     'from scapy.all import sendp, get_if_list, get_if_hwaddr, Ether, IP, TCP'),
+    ('scapy: targeted imports (send.py)',
+     'from scapy.arch import get_if_list, get_if_hwaddr\n'
+     'from scapy.layers.inet import IP, TCP\n'
+     'from scapy.layers.l2 import Ether\n'
+     'from scapy.sendrecv import sendp'),
+]
+
+
+def timeScenario(code, env, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-c', code], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        elapsed = time.perf_counter() - start
+        if proc.returncode != 0:
+            return None, proc.stderr.decode('utf-8', 'replace').strip().splitlines()[-1]
+        times.append(elapsed)
+    return times, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=True)
+    parser.add_argument('--utils', help='the tutorials utils directory',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--runs', help='runs per scenario',
+                        type=int, action="store", required=False, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    paths = [REPO_ROOT] + ([os.path.abspath(args.utils)] if args.utils else [])
+    env['PYTHONPATH'] = os.pathsep.join(paths + [env.get('PYTHONPATH', '')])
+    p4info = os.path.abspath(args.p4info)
+
+    # 先填好缓存，缓存场景测的是命中缓存时的启动
+    warm = 'from p4ctl.p4info_cache import loadP4InfoHelper\nloadP4InfoHelper(%r)' % p4info
+    subprocess.run([sys.executable, '-c', warm], env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    print("%-48s %10s %10s" % ('scenario', 'median', 'min'))
+    for name, code in SCENARIOS:
+        times, error = timeScenario(code.replace('P4INFO', repr(p4info)), env, args.runs)
+        if times is None:
+            print("%-48s skipped: %s" % (name, error))
+        else:
+            print("%-48s %8.0fms %8.0fms" % (name, statistics.median(times) * 1e3,
+                                             min(times) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+寄存器和计数器的批量读写。P4Runtime的Read不指定下标时返回整个数组，
+每个数组一次RPC；写入时所有下标合并到按batch_size分批的WriteRequest里。
+"""
+from array import array
+
+from p4.v1 import p4runtime_pb2
+
+from p4runtime_lib.convert import encode
+
+from p4ctl.batch import DEFAULT_BATCH_SIZE, writeUpdates
+
+
+def _read(sw, *entities):
+    request = p4runtime_pb2.ReadRequest()
+    request.device_id = sw.device_id
+    for entity in entities:
+        request.entities.add().CopyFrom(entity)
+    for response in sw.client_stub.Read(request):
+        for e in response.entities:
+            yield e
+
+
+def registerInfo(p4info_helper, register_name):
+    """
+    :return: (register id, bitwidth, size)
+    """
+    register = p4info_helper.get('registers', name=register_name)
+    return (register.preamble.id, register.type_spec.bitstring.bit.bitwidth,
+            register.size)
+
+
+def readRegister(sw, p4info_helper, register_name):
+    """
+    读出整个寄存器数组(单元宽度不超过64位)。
+
+    :return: array('Q') indexed by register index
+    """
+    return readRegisters(sw, p4info_helper, [register_name])[0]
+
+
+def readRegisters(sw, p4info_helper, register_names):
+    """
+    整个读出多个寄存器数组：每个寄存器一个不带下标的实体，放在同一个ReadRequest里，
+    只有一次RPC。
+
+    :return: tuple of array('Q') in the order of register_names
+    """
+    arrays = {}
+    entities = []
+    for name in register_names:
+        register_id, _, size = registerInfo(p4info_helper, name)
+        arrays[register_id] = array('Q', bytes(8 * size))
+        entity = p4runtime_pb2.Entity()
+        entity.register_entry.register_id = register_id
+        entities.append(entity)
+    for e in _read(sw, *entities):
+        r = e.register_entry
+        arrays[r.register_id][r.index.index] = int.from_bytes(r.data.bitstring, 'big')
+    return tuple(arrays[e.register_entry.register_id] for e in entities)
+
+
+def writeRegister(sw, p4info_helper, register_name, values,
+                  batch_size=DEFAULT_BATCH_SIZE):
+    """
+    :param values: {index: value} or an iterable of (index, value)
+    :return: the number of cells written
+    """
+    register_id, bitwidth, _ = registerInfo(p4info_helper, register_name)
+    items = values.items() if isinstance(values, dict) else values
+
+    def updates():
+        for index, value in items:
+            update = p4runtime_pb2.Update()
+            update.type = p4runtime_pb2.Update.MODIFY
+            r = update.entity.register_entry
+            r.register_id = register_id
+            r.index.index = index
+            r.data.bitstring = encode(value, bitwidth)
+            yield update
+
+    return writeUpdates(sw, updates(), batch_size)
+
+
+def resetRegister(sw, p4info_helper, register_name, batch_size=DEFAULT_BATCH_SIZE):
+    _, _, size = registerInfo(p4info_helper, register_name)
+    return writeRegister(sw, p4info_helper, register_name,
+                         ((i, 0) for i in range(size)), batch_size)
+
+
+def readCounter(sw, p4info_helper, counter_name):
+    """
+    读出整个间接计数器数组。
+
+    :return: (packets, bytes), two array('Q') indexed by counter index
+    """
+    counter = p4info_helper.get('counters', name=counter_name)
+    packets = array('Q', bytes(8 * counter.size))
+    byte_counts = array('Q', bytes(8 * counter.size))
+    entity = p4runtime_pb2.Entity()
+    entity.counter_entry.counter_id = counter.preamble.id
+    for e in _read(sw, entity):
+        c = e.counter_entry
+        packets[c.index.index] = c.data.packet_count
+        byte_counts[c.index.index] = c.data.byte_count
+    return packets, byte_counts
+
+
+def readCounterCells(sw, p4info_helper, counter_name, indices):
+    """
+    只读出计数器数组中的indices这些单元：每个下标一个实体，放在同一个ReadRequest里，
+    仍然只有一次RPC。数组很大而用到的下标很少时(例如按隧道ID索引的计数器)比整个读出快。
+
+    :param indices: distinct counter indices
+    :return: (packets, bytes), two array('Q') aligned with indices
+    """
+    counter_id = p4info_helper.get('counters', name=counter_name).preamble.id
+    indices = list(indices)
+    position = dict((index, i) for i, index in enumerate(indices))
+    packets = array('Q', bytes(8 * len(indices)))
+    byte_counts = array('Q', bytes(8 * len(indices)))
+    entities = []
+    for index in position:
+        entity = p4runtime_pb2.Entity()
+        entity.counter_entry.counter_id = counter_id
+        entity.counter_entry.index.index = index
+        entities.append(entity)
+    if not entities:
+        return packets, byte_counts
+    for e in _read(sw, *entities):
+        c = e.counter_entry
+        i = position[c.index.index]
+        packets[i] = c.data.packet_count
+        byte_counts[i] = c.data.byte_count
+    return packets, byte_counts
+
+
+def writeMeterConfig(sw, p4info_helper, meter_name, configs,
+                     batch_size=DEFAULT_BATCH_SIZE):
+    """
+    设置间接meter数组中若干下标的双速率三色参数。速率的单位由p4info中meter的
+    unit决定(BYTES时为字节/秒，PACKETS时为包/秒)，突发量对应为字节或包。
+
+    :param configs: {index: (cir, cburst, pir, pburst)} or an iterable of
+                    (index, (cir, cburst, pir, pburst))
+    :return: the number of cells written
+    """
+    meter_id = p4info_helper.get('meters', name=meter_name).preamble.id
+    items = configs.items() if isinstance(configs, dict) else configs
+
+    def updates():
+        for index, (cir, cburst, pir, pburst) in items:
+            update = p4runtime_pb2.Update()
+            update.type = p4runtime_pb2.Update.MODIFY
+            m = update.entity.meter_entry
+            m.meter_id = meter_id
+            m.index.index = index
+            m.config.cir = int(cir)
+            m.config.cburst = int(cburst)
+            m.config.pir = int(pir)
+            m.config.pburst = int(pburst)
+            yield update
+
+    return writeUpdates(sw, updates(), batch_size)
@@ -0,0 +1,306 @@
+"""
+链路故障检测和MRC配置切换。
+
+控制器每隔probe_interval从每条交换机间链路的两端各发一个packet-out探测帧，
+对端交换机把它连同入端口一起packet-in回控制器(见大作业/mrc/basic.p4)。
+某个方向超过dead_interval没有收到探测帧，就认为这条链路故障。
+
+检测到故障后，对每台交换机和每个目的主机，沿默认配置(ipv4_lpm)逐跳模拟
+转发；路径经过故障链路时，依次尝试备用配置(ipv4_lpm2、ipv4_lpm3)，选出第一个
+能绕开所有故障链路到达目的主机的配置，在该交换机的mrc_config表中写入
+目的地址 -> diffserv，让仍处于默认配置的报文从这里切换过去。每台交换机的
+改动合并为一个WriteRequest；链路恢复后相应表项被删除。
+
+备用配置来自各交换机runtime_json中的ipv4_lpm2/ipv4_lpm3表项，可以用
+    python -m p4ctl.topogen backup --topo triangle-topo/topology.json --classes 3
+为手写拓扑生成(triangle-topo已附带)。没有这些表项时检测照常进行，但所有受影响的
+(交换机, 目的主机)都没有可切换的配置。
+"""
+import ipaddress
+import struct
+import threading
+import time
+
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.batch import DEFAULT_BATCH_SIZE, buildTableEntryFromSpec, buildUpdate, writeUpdates
+from p4ctl.runtime import Plugin
+from p4ctl.topogen import buildFib, lookupRoute
+
+PROBE_ETHERTYPE = 0x88b5
+# 以太网头，然后是发出探测帧的交换机序号、出端口和序列号
+PROBE = struct.Struct('!6s6sHHHQ')
+BROADCAST = b'\xff' * 6
+
+CONFIG_TABLE = 'MyIngress.mrc_config'
+# (配置表, 选择该配置的diffserv)，第一项为默认配置
+CONFIGS = (('MyIngress.ipv4_lpm', 0), ('MyIngress.ipv4_lpm2', 4), ('MyIngress.ipv4_lpm3', 8))
+
+
+def switchLinks(topology):
+    """
+    :return: list of (switch a, port on a, switch b, port on b), one per link
+    """
+    links = []
+    for a in topology.switches:
+        for b, pa in topology.ports[a].items():
+            if a < b:
+                links.append((a, pa, b, topology.ports[b][a]))
+    return links
+
+
+def linkName(link):
+    a, pa, b, pb = link
+    return '%s-p%d <-> %s-p%d' % (a, pa, b, pb)
+
+
+class _Walker(object):
+    """
+    按某个配置表逐跳模拟转发，判断从一台交换机到目的主机的路径是否绕开故障链路。
+    """
+
+    def __init__(self, topology, rules, table):
+        self.fib = buildFib(rules, table)
+        self.neighbours = dict((sw, dict((p, v) for v, p in topology.ports[sw].items()))
+                               for sw in topology.switches)
+        self.host_at = dict(((info['switch'], info['port']), h)
+                            for h, info in topology.hosts.items())
+
+    def reaches(self, sw, dst, ip, failed_ports):
+        """
+        :param failed_ports: set of (switch, port) on either end of a failed link
+        :return: True if dst is reached without crossing a failed link
+        """
+        seen = set()
+        while sw not in seen:
+            seen.add(sw)
+            hop = lookupRoute(self.fib, sw, ip)
+            if hop is None:
+                return False
+            port = hop[1]
+            if (sw, port) in self.host_at:
+                return self.host_at[(sw, port)] == dst
+            if (sw, port) in failed_ports or port not in self.neighbours[sw]:
+                return False
+            sw = self.neighbours[sw][port]
+        return False
+
+
+def planSwitchover(topology, rules, failed_links, configs=CONFIGS):
+    """
+    :param rules: {switch name: table_entries} with the tables of every configuration
+    :param failed_links: links as returned by switchLinks
+    :return: ({switch: {dst ip: diffserv}}, [(switch, dst host) with no usable configuration])
+    """
+    failed_ports = set()
+    for a, pa, b, pb in failed_links:
+        failed_ports.add((a, pa))
+        failed_ports.add((b, pb))
+    walkers = [(_Walker(topology, rules, table), diffserv) for table, diffserv in configs]
+    plan = {}
+    unprotected = []
+    for dst, info in topology.hosts.items():
+        ip = int(ipaddress.IPv4Address(info['ip']))
+        for sw in topology.switches:
+            default = walkers[0][0]
+            if default.reaches(sw, dst, ip, ()) and not default.reaches(sw, dst, ip, failed_ports):
+                for walker, diffserv in walkers[1:]:
+                    if walker.reaches(sw, dst, ip, failed_ports):
+                        plan.setdefault(sw, {})[info['ip']] = diffserv
+                        break
+                else:
+                    unprotected.append((sw, dst))
+    return plan, unprotected
+
+
+class LinkEvent(object):
+    __slots__ = ('link', 'kind', 'last_seen', 'detected', 'recovered', 'entries',
+                 'unprotected')
+
+    def __init__(self, link, kind, last_seen, detected):
+        self.link = link
+        self.kind = kind
+        self.last_seen = last_seen
+        self.detected = detected
+        self.recovered = None
+        self.entries = 0
+        self.unprotected = 0
+
+    def __str__(self):
+        if self.kind == 'down':
+            text = "%s down: detected %.0fms after the last probe" % (
+                linkName(self.link), (self.detected - self.last_seen) * 1e3)
+        else:
+            text = "%s up: probes received again" % linkName(self.link)
+        if self.recovered is not None:
+            text += ", %d entries written %.1fms after detection" % (
+                self.entries, (self.recovered - self.detected) * 1e3)
+        if self.unprotected:
+            text += ", %d switch/destination pairs without a backup configuration" % (
+                self.unprotected)
+        return text
+
+
+class FailureDetector(Plugin):
+    """
+    用packet-out探测帧检测链路故障，并按planSwitchover改写各交换机的mrc_config。
+    """
+    name = 'failover'
+
+    def __init__(self, topology, rules, probe_interval=0.05, dead_interval=0.2,
+                 configs=CONFIGS, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param topology: the Topology
+        :param rules: {switch name: table_entries}, see topo.loadRuntimeEntries
+        :param probe_interval: seconds between probes on each link direction
+        :param dead_interval: seconds without a probe before a link is declared down
+        """
+        self.topology = topology
+        self.rules = rules
+        self.probe_interval = probe_interval
+        self.dead_interval = dead_interval
+        self.configs = configs
+        self.batch_size = batch_size
+        self.enabled = False
+        self.links = []
+        self.down = set()
+        self.events = []
+        self.installed = {}
+        self._names = []
+        self._peer = {}
+        self._last_seen = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def install(self, runtime):
+        helper = runtime.p4info_helper
+        try:
+            helper.get('tables', name=CONFIG_TABLE)
+        except AttributeError as e:
+            print("Failure detection disabled: %s" % e)
+            return
+        if not any(cpm.preamble.name == 'packet_out'
+                   for cpm in helper.p4info.controller_packet_metadata):
+            print("Failure detection disabled: the P4 program has no packet_out header")
+            return
+        self.enabled = True
+        backup = set(table for table, _ in self.configs[1:])
+        missing = [name for name in runtime.switch_names
+                   if not any(e['table'] in backup and 'match' in e
+                              for e in self.rules.get(name, []))]
+        if missing:
+            print("No backup configuration on %s: see python -m p4ctl.topogen backup" % (
+                ', '.join(missing)))
+        self.links = [l for l in switchLinks(self.topology)
+                      if l[0] in runtime.switch_names and l[2] in runtime.switch_names]
+        self._names = list(runtime.switch_names)
+        for a, pa, b, pb in self.links:
+            self._peer[(a, pa)] = (b, pb)
+            self._peer[(b, pb)] = (a, pa)
+        runtime.stream.onPacketIn(self._onPacketIn)
+        print("Probing %d links every %.0fms" % (len(self.links), self.probe_interval * 1e3))
+
+    def tasks(self, runtime):
+        if not self.enabled:
+            return []
+        return [('link-probe', self.probe_interval, self.probe),
+                ('link-check', self.probe_interval, self.check)]
+
+    def _startProbing(self):
+        # 调用方持有self._lock。从第一次探测(或检查)开始计时，而不是从install开始，
+        # 否则install之后的其他插件和事件循环启动的耗时会被误判为链路故障
+        if not self._last_seen:
+            now = time.perf_counter()
+            for end in self._peer:
+                self._last_seen[end] = now
+
+    def probe(self, runtime):
+        with self._lock:
+            self._startProbing()
+        self._seq += 1
+        for index, name in enumerate(self._names):
+            sw = runtime.switch(name)
+            for port in self.topology.ports[name].values():
+                payload = PROBE.pack(BROADCAST, b'\x00' * 6, PROBE_ETHERTYPE,
+                                     index, port, self._seq)
+                runtime.stream.sendPacketOut(sw, payload, egress_port=port)
+
+    def _onPacketIn(self, sw, packet):
+        if len(packet.payload) < PROBE.size:
+            return
+        _, _, ethertype, index, port, _ = PROBE.unpack_from(packet.payload)
+        if ethertype != PROBE_ETHERTYPE or index >= len(self._names):
+            return
+        # 探测帧记在发出它的一端，且必须从拓扑中的对端端口收到
+        origin = (self._names[index], port)
+        if self._peer.get(origin) != (sw.name, packet.metadata.get('ingress_port')):
+            return
+        with self._lock:
+            self._last_seen[origin] = time.perf_counter()
+
+    def check(self, runtime):
+        now = time.perf_counter()
+        changed = []
+        with self._lock:
+            self._startProbing()
+            for link in self.links:
+                a, pa, b, pb = link
+                last_seen = min(self._last_seen[(a, pa)], self._last_seen[(b, pb)])
+                alive = now - last_seen <= self.dead_interval
+                if not alive and link not in self.down:
+                    self.down.add(link)
+                    changed.append(LinkEvent(link, 'down', last_seen, now))
+                elif alive and link in self.down:
+                    self.down.discard(link)
+                    changed.append(LinkEvent(link, 'up', last_seen, now))
+            down = list(self.down)
+        if not changed:
+            return
+        entries, unprotected = self.reconfigure(runtime, down)
+        recovered = time.perf_counter()
+        for event in changed:
+            event.recovered = recovered
+            event.entries = entries
+            event.unprotected = len(unprotected)
+            self.events.append(event)
+            print(event)
+
+    def reconfigure(self, runtime, down):
+        """
+        把各交换机的mrc_config改写为down对应的切换方案，只写与已写入表项的差异。
+
+        :return: (number of entries written, unprotected pairs)
+        """
+        plan, unprotected = planSwitchover(self.topology, self.rules, down, self.configs)
+        written = 0
+        for name in runtime.switch_names:
+            desired = plan.get(name, {})
+            current = self.installed.setdefault(name, {})
+            updates = []
+            for ip in [ip for ip in current if ip not in desired]:
+                updates.append(self._update(runtime, ip, current.pop(ip),
+                                            p4runtime_pb2.Update.DELETE))
+            for ip, diffserv in desired.items():
+                if ip not in current:
+                    updates.append(self._update(runtime, ip, diffserv, p4runtime_pb2.Update.INSERT))
+                elif current[ip] != diffserv:
+                    updates.append(self._update(runtime, ip, diffserv, p4runtime_pb2.Update.MODIFY))
+            if updates:
+                written += writeUpdates(runtime.switch(name), updates, self.batch_size)
+            current.update(desired)
+        return written, unprotected
+
+    @staticmethod
+    def _update(runtime, ip, diffserv, update_type):
+        flow = {'table': CONFIG_TABLE,
+                'match': {'hdr.ipv4.dstAddr': [ip, 32]},
+                'action_name': 'MyIngress.set_config',
+                'action_params': {'diffserv': diffserv}}
+        return buildUpdate(buildTableEntryFromSpec(runtime.p4info_helper, flow), update_type)
+
+    def printReport(self):
+        if not self.events:
+            return
+        print('\n----- Link events -----')
+        for event in self.events:
+            print(event)
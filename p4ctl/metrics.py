@@ -0,0 +1,172 @@
+import bisect
+import os
+import threading
+import time
+
+import grpc
+
+# 延迟直方图各桶的上界(秒)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    __slots__ = ('counts', 'count', 'sum', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, elapsed, error=False):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        self.count += 1
+        self.sum += elapsed
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        """
+        按桶内线性插值估计分位数；落在最后一个(无上界)桶时返回最大的有限上界。
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c:
+                if i == len(LATENCY_BUCKETS):
+                    return LATENCY_BUCKETS[-1]
+                lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+                return lower + (LATENCY_BUCKETS[i] - lower) * (rank - seen) / c
+            seen += c
+        return LATENCY_BUCKETS[-1]
+
+
+class RpcMetrics(object):
+    """
+    按 (交换机, RPC类型) 统计P4Runtime调用的延迟直方图和错误数。
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, switch_name, rpc, elapsed, error=False):
+        key = (switch_name, rpc)
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+            h.observe(elapsed, error)
+
+    def interceptor(self, switch_name):
+        return RpcTimingInterceptor(self, switch_name)
+
+    def writePrometheus(self, path):
+        """
+        以Prometheus文本格式写出(先写临时文件再改名，供node_exporter的
+        textfile collector读取时不会读到半个文件)。
+        """
+        with self._lock:
+            items = sorted((k, (list(h.counts), h.count, h.sum, h.errors))
+                           for k, h in self.histograms.items())
+        lines = ['# HELP p4runtime_rpc_latency_seconds P4Runtime RPC latency.',
+                 '# TYPE p4runtime_rpc_latency_seconds histogram']
+        for (sw, rpc), (counts, count, total, _) in items:
+            labels = 'switch="%s",rpc="%s"' % (sw, rpc)
+            cumulative = 0
+            for bound, c in zip(LATENCY_BUCKETS, counts):
+                cumulative += c
+                lines.append('p4runtime_rpc_latency_seconds_bucket{%s,le="%g"} %d' % (
+                    labels, bound, cumulative))
+            lines.append('p4runtime_rpc_latency_seconds_bucket{%s,le="+Inf"} %d' % (labels, count))
+            lines.append('p4runtime_rpc_latency_seconds_sum{%s} %.9f' % (labels, total))
+            lines.append('p4runtime_rpc_latency_seconds_count{%s} %d' % (labels, count))
+        lines.append('# HELP p4runtime_rpc_errors_total Failed P4Runtime RPCs.')
+        lines.append('# TYPE p4runtime_rpc_errors_total counter')
+        for (sw, rpc), (_, _, _, errors) in items:
+            lines.append('p4runtime_rpc_errors_total{switch="%s",rpc="%s"} %d' % (sw, rpc, errors))
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, path)
+
+    def printSummary(self):
+        with self._lock:
+            items = sorted(self.histograms.items())
+        if not items:
+            return
+        print('\n----- P4Runtime RPC latency -----')
+        for (sw, rpc), h in items:
+            print("%-4s %-32s calls=%-6d errors=%-4d mean=%.2fms p50=%.2fms p99=%.2fms" % (
+                sw, rpc, h.count, h.errors, h.sum / h.count * 1e3,
+                h.quantile(0.5) * 1e3, h.quantile(0.99) * 1e3))
+
+
+def _rpcName(method, request):
+    name = method.rsplit('/', 1)[-1]
+    # Read按实体类型细分，读表项和读计数器分开统计
+    if name == 'Read' and len(request.entities):
+        name = 'Read:' + request.entities[0].WhichOneof('entity')
+    return name
+
+
+class _TimedStream(object):
+    """
+    包装服务端流式调用的返回值，迭代结束(或出错)时记录整个流的耗时。
+    """
+
+    def __init__(self, call, metrics, switch_name, rpc, start):
+        self._call = call
+        self._metrics = metrics
+        self._switch_name = switch_name
+        self._rpc = rpc
+        self._start = start
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._call)
+        except StopIteration:
+            self._done(False)
+            raise
+        except grpc.RpcError:
+            self._done(True)
+            raise
+
+    def _done(self, error):
+        if self._start is not None:
+            self._metrics.observe(self._switch_name, self._rpc,
+                                  time.perf_counter() - self._start, error)
+            self._start = None
+
+    def __getattr__(self, attr):
+        return getattr(self._call, attr)
+
+
+class RpcTimingInterceptor(grpc.UnaryUnaryClientInterceptor,
+                           grpc.UnaryStreamClientInterceptor):
+
+    def __init__(self, metrics, switch_name):
+        self.metrics = metrics
+        self.switch_name = switch_name
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        rpc = _rpcName(client_call_details.method, request)
+        start = time.perf_counter()
+        outcome = continuation(client_call_details, request)
+        # 阻塞调用时outcome已完成，回调会立即执行
+        outcome.add_done_callback(lambda f: self.metrics.observe(
+            self.switch_name, rpc, time.perf_counter() - start,
+            f.exception() is not None))
+        return outcome
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        rpc = _rpcName(client_call_details.method, request)
+        start = time.perf_counter()
+        call = continuation(client_call_details, request)
+        return _TimedStream(call, self.metrics, self.switch_name, rpc, start)
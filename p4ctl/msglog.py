@@ -0,0 +1,189 @@
+"""
+二进制P4Runtime请求日志，替代p4runtime_lib.switch.GrpcRequestLogger的同步文本转储。
+
+RPC线程只把(时间戳, 方法名, 请求)放进有界队列，序列化和写盘都在后台线程完成；
+队列满时丢弃并计数，不会拖慢下发。文件格式：
+    文件头 b'P4RTLOG1'
+    每条记录 struct '<IdH'(请求长度, 时间戳, 方法名长度) + 方法名 + 请求的protobuf二进制
+
+离线转换为文本：
+    python -m p4ctl.msglog logs/s1-p4runtime-requests.bin
+"""
+import argparse
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import grpc
+
+FILE_MAGIC = b'P4RTLOG1'
+RECORD_HEADER = struct.Struct('<IdH')
+
+
+class BinaryRequestLogger(grpc.UnaryUnaryClientInterceptor,
+                          grpc.UnaryStreamClientInterceptor):
+    """
+    Logs the requests sent to the switch as length-prefixed binary protobufs
+    from a background thread.
+    """
+
+    _sentinel = object()
+
+    def __init__(self, log_file, max_bytes=64 * 1024 * 1024, backup_count=5,
+                 sample_every=1, queue_size=65536):
+        """
+        :param log_file: the log file path
+        :param max_bytes: rotate once the file would exceed this size, 0 to
+                          never rotate
+        :param backup_count: the number of rotated files (log_file.1 ...) kept
+        :param sample_every: log only one request out of every sample_every
+        :param queue_size: the bound on requests waiting to be written
+        """
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.sample_every = sample_every
+        self.logged = 0
+        self.dropped = 0
+        self._seen = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._f = self._open()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='p4rt-msglog')
+        self._thread.start()
+
+    def _open(self):
+        f = open(self.log_file, 'wb')
+        f.write(FILE_MAGIC)
+        return f
+
+    def _rotate(self):
+        self._f.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = '%s.%d' % (self.log_file, i)
+            if os.path.exists(src):
+                os.replace(src, '%s.%d' % (self.log_file, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.log_file, self.log_file + '.1')
+        self._f = self._open()
+
+    def log_message(self, method_name, body):
+        self._seen += 1
+        if self.sample_every > 1 and self._seen % self.sample_every:
+            return
+        try:
+            self._queue.put_nowait((time.time(), method_name, body))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        f_size = len(FILE_MAGIC)
+        while True:
+            item = self._queue.get()
+            if item is self._sentinel:
+                break
+            ts, method_name, body = item
+            method = method_name.encode('utf-8')
+            # 预先序列化好的请求(如快照恢复)直接记录原始字节
+            payload = body if isinstance(body, bytes) else body.SerializeToString()
+            record = RECORD_HEADER.pack(len(payload), ts, len(method)) + method + payload
+            if self.max_bytes and f_size + len(record) > self.max_bytes:
+                self._rotate()
+                f_size = len(FILE_MAGIC)
+            self._f.write(record)
+            f_size += len(record)
+            self.logged += 1
+            if self._queue.empty():
+                self._f.flush()
+        self._f.close()
+
+    def close(self, timeout=5.0):
+        """
+        写完队列中剩余的请求后关闭文件。写线程已经退出(例如写盘出错)时不再等待，
+        队列中剩余的请求计入dropped。
+        """
+        if self._thread.is_alive():
+            try:
+                self._queue.put(self._sentinel, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        if not self._thread.is_alive():
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not self._sentinel:
+                    self.dropped += 1
+            self._f.close()
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        self.log_message(client_call_details.method, request)
+        return continuation(client_call_details, request)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        self.log_message(client_call_details.method, request)
+        return continuation(client_call_details, request)
+
+
+def readLog(log_file):
+    """
+    逐条读取日志，yield (时间戳, 方法名, 请求的protobuf二进制)。
+    """
+    with open(log_file, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError("%s is not a P4Runtime binary log" % log_file)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # 进程被杀时最后一条记录可能不完整
+                return
+            length, ts, method_len = RECORD_HEADER.unpack(header)
+            method = f.read(method_len).decode('utf-8')
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield ts, method, payload
+
+
+def _requestTypes():
+    from p4.v1 import p4runtime_pb2
+    return {
+        'Write': p4runtime_pb2.WriteRequest,
+        'Read': p4runtime_pb2.ReadRequest,
+        'SetForwardingPipelineConfig': p4runtime_pb2.SetForwardingPipelineConfigRequest,
+        'GetForwardingPipelineConfig': p4runtime_pb2.GetForwardingPipelineConfigRequest,
+        'Capabilities': p4runtime_pb2.CapabilitiesRequest,
+    }
+
+
+def decodeLog(log_file, out):
+    """
+    把二进制日志转换成与GrpcRequestLogger相同的文本格式写入out。
+    """
+    types = _requestTypes()
+    for ts, method, payload in readLog(log_file):
+        request_type = types.get(method.rsplit('/', 1)[-1])
+        stamp = datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        out.write("\n[%s] %s\n---\n" % (stamp, method))
+        if request_type is None:
+            out.write("<%d bytes of unknown request>\n" % len(payload))
+        else:
+            out.write(str(request_type.FromString(payload)))
+        out.write('---\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode a binary P4Runtime request log')
+    parser.add_argument('log_file', help='the .bin log written by BinaryRequestLogger')
+    args = parser.parse_args()
+    decodeLog(args.log_file, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import pickle
+
+from p4.config.v1 import p4info_pb2
+
+import p4runtime_lib.helper
+
+# P4Info中带preamble的实体类型
+ENTITY_TYPES = ('tables', 'actions', 'action_profiles', 'counters',
+                'direct_counters', 'meters', 'direct_meters',
+                'controller_packet_metadata', 'value_sets', 'registers',
+                'digests', 'externs')
+
+CACHE_VERSION = 1
+
+
+def _buildIndex(p4info):
+    """
+    {实体类型: ({名字或别名: 下标}, {id: 下标})}，以及表的匹配域和动作的参数
+    {(表名, 匹配域名或id): 下标}，{(动作名, 参数名或id): 下标}。
+    """
+    index = {}
+    for entity_type in ENTITY_TYPES:
+        if not hasattr(p4info, entity_type):
+            continue
+        by_name, by_id = {}, {}
+        for i, o in enumerate(getattr(p4info, entity_type)):
+            by_name[o.preamble.name] = i
+            by_name.setdefault(o.preamble.alias, i)
+            by_id[o.preamble.id] = i
+        index[entity_type] = (by_name, by_id)
+    match_fields = {}
+    for i, t in enumerate(p4info.tables):
+        for j, mf in enumerate(t.match_fields):
+            match_fields[(t.preamble.name, mf.name)] = (i, j)
+            match_fields[(t.preamble.name, mf.id)] = (i, j)
+    params = {}
+    for i, a in enumerate(p4info.actions):
+        for j, p in enumerate(a.params):
+            params[(a.preamble.name, p.name)] = (i, j)
+            params[(a.preamble.name, p.id)] = (i, j)
+    index['match_fields'] = match_fields
+    index['params'] = params
+    return index
+
+
+class IndexedP4InfoHelper(p4runtime_lib.helper.P4InfoHelper):
+    """
+    P4InfoHelper的查找全部是线性扫描；这里用预先建好的字典索引代替，
+    其余接口(buildTableEntry等)保持不变。
+    """
+
+    def __init__(self, p4info, index=None):
+        # 不调用父类__init__，它会重新解析文本格式的p4info
+        self.p4info = p4info
+        self.index = index if index is not None else _buildIndex(p4info)
+
+    def get(self, entity_type, name=None, id=None):
+        if name is not None and id is not None:
+            raise AssertionError("name or id must be None")
+        by_name, by_id = self.index[entity_type]
+        pos = by_name.get(name) if name else by_id.get(id)
+        if pos is None:
+            if name:
+                raise AttributeError("Could not find %r of type %s" % (name, entity_type))
+            raise AttributeError("Could not find id %r of type %s" % (id, entity_type))
+        return getattr(self.p4info, entity_type)[pos]
+
+    def get_match_field(self, table_name, name=None, id=None):
+        pos = self.index['match_fields'].get((table_name, name if name is not None else id))
+        if pos is None:
+            raise AttributeError("%r has no match field %r" % (
+                table_name, name if name is not None else id))
+        return self.p4info.tables[pos[0]].match_fields[pos[1]]
+
+    def get_action_param(self, action_name, name=None, id=None):
+        pos = self.index['params'].get((action_name, name if name is not None else id))
+        if pos is None:
+            raise AttributeError("action %r has no param %r, (has: %r)" % (
+                action_name, name if name is not None else id,
+                [p.name for p in self.get('actions', name=action_name).params]))
+        return self.p4info.actions[pos[0]].params[pos[1]]
+
+
+def cachePath(p4info_file_path):
+    base = p4info_file_path[:-4] if p4info_file_path.endswith('.txt') else p4info_file_path
+    return base + '.cache'
+
+
+def loadP4InfoHelper(p4info_file_path, cache_file_path=None):
+    """
+    加载p4info。解析结果和索引以二进制形式缓存在build/xxx.p4.p4info.cache中，
+    以文本文件的sha256为键；文件没变时直接从缓存加载，不再做文本解析。
+
+    :param p4info_file_path: the p4info proto in text format from p4c
+    :param cache_file_path: where to keep the cache, next to the p4info by default
+    :return: an IndexedP4InfoHelper
+    """
+    if cache_file_path is None:
+        cache_file_path = cachePath(p4info_file_path)
+    with open(p4info_file_path, 'rb') as f:
+        text = f.read()
+    digest = hashlib.sha256(text).hexdigest()
+
+    try:
+        with open(cache_file_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['version'] == CACHE_VERSION and cached['sha256'] == digest:
+            return IndexedP4InfoHelper(p4info_pb2.P4Info.FromString(cached['p4info']),
+                                       cached['index'])
+    except Exception:
+        # 缓存缺失、截断或内容不对(反序列化可能抛出各种异常)时都从文本重新解析
+        pass
+
+    from google.protobuf import text_format
+    p4info = p4info_pb2.P4Info()
+    text_format.Merge(text.decode('utf-8'), p4info)
+    index = _buildIndex(p4info)
+    try:
+        tmp = cache_file_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': CACHE_VERSION, 'sha256': digest,
+                         'p4info': p4info.SerializeToString(), 'index': index},
+                        f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file_path)
+    except OSError as e:
+        print("Could not write p4info cache %s: %s" % (cache_file_path, e))
+    return IndexedP4InfoHelper(p4info, index)
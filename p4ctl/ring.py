@@ -0,0 +1,45 @@
+from array import array
+
+
+class RingBuffer(object):
+    """
+    定长环形缓冲区：预先分配好的array('d')，追加是O(1)且不再分配内存，
+    写满后覆盖最旧的样本。
+    """
+    __slots__ = ('data', 'capacity', 'count', 'pos')
+
+    def __init__(self, capacity):
+        self.data = array('d', bytes(8 * capacity))
+        self.capacity = capacity
+        self.count = 0
+        self.pos = 0
+
+    def append(self, value):
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def values(self, n=None):
+        """
+        最近n个(默认全部)样本，从旧到新。
+        """
+        n = self.count if n is None else min(n, self.count)
+        start = (self.pos - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.data[start:start + n]
+        return self.data[start:] + self.data[:self.pos]
+
+    def last(self):
+        return self.data[self.pos - 1] if self.count else 0.0
+
+    def mean(self, n=None):
+        v = self.values(n)
+        return sum(v) / len(v) if len(v) else 0.0
+
+    def max(self, n=None):
+        v = self.values(n)
+        return max(v) if len(v) else 0.0
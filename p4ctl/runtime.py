@@ -0,0 +1,337 @@
+import asyncio
+import os
+import time
+
+import grpc
+from google.rpc import code_pb2
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+import p4runtime_lib.bmv2
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+
+from p4ctl.metrics import RpcMetrics
+from p4ctl.msglog import BinaryRequestLogger
+from p4ctl.stream import StreamHandler
+
+GRPC_BASE_PORT = 50051
+
+
+def switchAddresses(switch_names, host='127.0.0.1'):
+    """
+    与utils/run_exercise.py的分配方式一致：交换机按拓扑中出现的顺序，
+    gRPC端口从50051起依次递增，device_id从0起依次递增。
+
+    :return: list of (name, address, device_id)
+    """
+    return [(name, '%s:%d' % (host, GRPC_BASE_PORT + i), i)
+            for i, name in enumerate(switch_names)]
+
+
+def interceptSwitch(sw, *interceptors):
+    """
+    在已建立的交换机连接上追加gRPC拦截器。StreamChannel在连接建立时就已打开，
+    不受影响；之后经client_stub发出的一元/服务端流RPC都会经过这些拦截器。
+    """
+    sw.channel = grpc.intercept_channel(sw.channel, *interceptors)
+    sw.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(sw.channel)
+    return sw
+
+
+def connectSwitch(name, address, device_id, log_dir='logs', log_format='binary',
+                  metrics=None, mirror=None):
+    """
+    建立一条Bmv2SwitchConnection。
+
+    :param log_dir: where to dump P4Runtime requests, None to disable
+    :param log_format: 'binary' for the background BinaryRequestLogger
+                       (logs/sX-p4runtime-requests.bin), 'text' for the
+                       synchronous p4runtime_lib text dump
+    :param metrics: an RpcMetrics recording the latency of every RPC
+    :param mirror: a standby.StatePublisher forwarding successful writes to
+                   the backup controller
+    """
+    dump_file = None
+    if log_dir is not None and log_format == 'text':
+        dump_file = os.path.join(log_dir, '%s-p4runtime-requests.txt' % name)
+    sw = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+        name=name,
+        address=address,
+        device_id=device_id,
+        proto_dump_file=dump_file)
+    interceptors = []
+    if metrics is not None:
+        interceptors.append(metrics.interceptor(name))
+    if mirror is not None:
+        interceptors.append(mirror.interceptor(name))
+    sw.request_logger = None
+    if log_dir is not None and log_format == 'binary':
+        sw.request_logger = BinaryRequestLogger(
+            os.path.join(log_dir, '%s-p4runtime-requests.bin' % name))
+        interceptors.append(sw.request_logger)
+    if interceptors:
+        interceptSwitch(sw, *interceptors)
+    return sw
+
+
+def arbitrate(sw, election_id=1):
+    """
+    与SwitchConnection.MasterArbitrationUpdate相同，但可以指定election_id。
+    election_id记在sw.election_id上，batch.writeUpdates和setPipelineConfig
+    发出的写请求都使用它(SwitchConnection自带的写方法固定使用1)。
+    必须在StreamHandler接管sw的流之前调用。
+
+    :return: the arbitration update; status.code is OK when sw is now the primary
+    """
+    request = p4runtime_pb2.StreamMessageRequest()
+    request.arbitration.device_id = sw.device_id
+    request.arbitration.election_id.high = election_id >> 64
+    request.arbitration.election_id.low = election_id & 0xffffffffffffffff
+    sw.election_id = election_id
+    sw.requests_stream.put(request)
+    for msg in sw.stream_msg_resp:
+        if msg.WhichOneof('update') == 'arbitration':
+            return msg.arbitration
+
+
+def setPipelineConfig(sw, p4info, bmv2_file_path):
+    """
+    与SwitchConnection.SetForwardingPipelineConfig相同，使用sw.election_id。
+    """
+    election_id = getattr(sw, 'election_id', 1)
+    request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
+    request.election_id.high = election_id >> 64
+    request.election_id.low = election_id & 0xffffffffffffffff
+    request.device_id = sw.device_id
+    request.config.p4info.CopyFrom(p4info)
+    request.config.p4_device_config = sw.buildDeviceConfig(
+        bmv2_json_file_path=bmv2_file_path).SerializeToString()
+    request.action = p4runtime_pb2.SetForwardingPipelineConfigRequest.VERIFY_AND_COMMIT
+    sw.client_stub.SetForwardingPipelineConfig(request)
+
+
+class Plugin(object):
+    """
+    控制器插件。install在所有交换机装好P4程序后调用一次，用来写初始表项；
+    tasks返回 (名字, 周期秒数, 函数) 列表，函数以runtime为参数被周期调用。
+    """
+    name = None
+
+    def install(self, runtime):
+        pass
+
+    def tasks(self, runtime):
+        return []
+
+
+class TaskStats(object):
+    __slots__ = ('count', 'errors', 'overruns', 'total', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.overruns = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, elapsed, interval):
+        self.count += 1
+        self.total += elapsed
+        self.last = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if elapsed > interval:
+            self.overruns += 1
+
+
+class ControllerRuntime(object):
+    """
+    单进程多交换机控制器运行时：根据topology.json建立交换机连接(每台交换机
+    一条连接，所有插件共用)，下发P4程序，安装插件，然后在一个事件循环上运行
+    StreamChannel处理和各个周期任务。
+    """
+
+    def __init__(self, p4info_helper, bmv2_file_path, topo=None,
+                 switch_names=None, log_dir='logs', log_format='binary',
+                 metrics_interval=10, election_id=1, mirror=None):
+        """
+        :param p4info_helper: the P4Info helper
+        :param bmv2_file_path: the BMv2 JSON file from p4c
+        :param topo: the parsed topology.json, see loadTopology
+        :param switch_names: the switches to use when no topology is given
+        :param log_dir: where to dump P4Runtime requests, None to disable
+        :param log_format: 'binary' or 'text', see connectSwitch
+        :param metrics_interval: seconds between writes of the Prometheus
+                                 metrics file (log_dir/p4runtime-metrics.prom)
+        :param election_id: the election ID to arbitrate with; a primary with
+                            a hot standby needs one above the standby's
+        :param mirror: a standby.StatePublisher, see connectSwitch
+        """
+        if topo is not None:
+            switch_names = list(topo['switches'])
+        self.p4info_helper = p4info_helper
+        self.bmv2_file_path = bmv2_file_path
+        self.topo = topo
+        self.switch_names = list(switch_names)
+        self.addresses = dict((n, (a, d)) for n, a, d in switchAddresses(self.switch_names))
+        self.log_dir = log_dir
+        self.log_format = log_format
+        self.metrics = RpcMetrics()
+        self.metrics_interval = metrics_interval
+        self.metrics_file = None
+        if log_dir is not None:
+            self.metrics_file = os.path.join(log_dir, 'p4runtime-metrics.prom')
+        self.election_id = election_id
+        self.mirror = mirror
+        self.switches = {}
+        self.plugins = []
+        self.stream = StreamHandler(p4info_helper)
+        self.running = False
+        self._periodic = []
+        self.task_stats = {}
+
+    def switch(self, name):
+        """
+        返回交换机name的连接，首次调用时建立；之后所有调用共享同一条连接。
+        """
+        sw = self.switches.get(name)
+        if sw is None:
+            address, device_id = self.addresses[name]
+            sw = connectSwitch(name, address, device_id,
+                               self.log_dir, self.log_format, self.metrics, self.mirror)
+            self.switches[name] = sw
+        return sw
+
+    def addSwitch(self, name):
+        """
+        加入topology.json中新增的交换机。run_exercise.py按拓扑中的顺序分配gRPC端口
+        和device_id，新交换机排在已有交换机之后。start之后调用时立即完成连接、仲裁
+        和P4程序下发，事件循环已在运行时还会接管它的StreamChannel；之后插件就可以
+        通过switch(name)写入表项。
+
+        :return: the switch connection
+        """
+        if name in self.addresses:
+            return self.switch(name)
+        self.switch_names.append(name)
+        self.addresses = dict((n, (a, d)) for n, a, d in switchAddresses(self.switch_names))
+        if not self.switches:
+            # 还没有start，start时与其他交换机一起处理
+            return self.switch(name)
+        sw = self._arbitrate(name)
+        setPipelineConfig(sw, self.p4info_helper.p4info, self.bmv2_file_path)
+        print("Installed P4 Program using SetForwardingPipelineConfig on %s" % name)
+        if self.running:
+            self.stream.addSwitch(sw)
+        return sw
+
+    def addPlugin(self, plugin):
+        self.plugins.append(plugin)
+        return plugin
+
+    def addPeriodicTask(self, name, interval, fn):
+        """
+        :param name: the task name used in the latency summary
+        :param interval: the period in seconds
+        :param fn: fn(runtime), a plain function (run in the default executor)
+                   or a coroutine function (run on the event loop)
+        """
+        self._periodic.append((name, interval, fn))
+        self.task_stats[name] = TaskStats()
+
+    def start(self):
+        """
+        建立所有连接，完成仲裁，下发P4程序，并安装所有插件。
+        """
+        for name in self.switch_names:
+            self._arbitrate(name)
+        for name in self.switch_names:
+            setPipelineConfig(self.switches[name], self.p4info_helper.p4info,
+                              self.bmv2_file_path)
+            print("Installed P4 Program using SetForwardingPipelineConfig on %s" % name)
+        for plugin in self.plugins:
+            plugin.install(self)
+            for name, interval, fn in plugin.tasks(self):
+                self.addPeriodicTask(name, interval, fn)
+        if self.metrics_file is not None:
+            self.addPeriodicTask('metrics-export', self.metrics_interval,
+                                 lambda runtime: runtime.metrics.writePrometheus(
+                                     runtime.metrics_file))
+
+    def _arbitrate(self, name):
+        sw = self.switch(name)
+        # 仲裁走StreamChannel，不经过拦截器，单独计时
+        start = time.perf_counter()
+        update = arbitrate(sw, self.election_id)
+        self.metrics.observe(name, 'MasterArbitrationUpdate',
+                             time.perf_counter() - start)
+        if update is not None and update.status.code != code_pb2.OK:
+            print("%s: not the primary controller (%s)" % (name, update.status.message))
+        return sw
+
+    def run(self):
+        """
+        运行事件循环直到被中断(KeyboardInterrupt会照常抛出)。
+        """
+        asyncio.run(self._main())
+
+    async def _main(self):
+        for name in self.switch_names:
+            self.stream.addSwitch(self.switches[name])
+        aws = list(self.stream.start())
+        self.running = True
+        for name, interval, fn in self._periodic:
+            aws.append(asyncio.ensure_future(self._runPeriodic(name, interval, fn)))
+        try:
+            if aws:
+                await asyncio.gather(*aws)
+            else:
+                await asyncio.Event().wait()
+        finally:
+            self.running = False
+            self.stream.stop()
+
+    async def _runPeriodic(self, name, interval, fn):
+        loop = asyncio.get_running_loop()
+        stats = self.task_stats[name]
+        next_run = loop.time()
+        while True:
+            start = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(fn):
+                    await fn(self)
+                else:
+                    await loop.run_in_executor(None, fn, self)
+            except Exception as e:
+                stats.errors += 1
+                print("Task %s failed: %r" % (name, e))
+            stats.record(time.perf_counter() - start, interval)
+            # 按固定节拍调度；超时的轮次直接跳过，不补跑
+            next_run += interval
+            now = loop.time()
+            if next_run < now:
+                next_run = now
+            await asyncio.sleep(next_run - now)
+
+    def printTaskSummary(self):
+        if not self.task_stats:
+            return
+        print('\n----- Periodic task latency -----')
+        for name, s in self.task_stats.items():
+            mean = s.total / s.count if s.count else 0.0
+            print("%-24s runs=%d errors=%d overruns=%d mean=%.2fms max=%.2fms last=%.2fms" % (
+                name, s.count, s.errors, s.overruns,
+                mean * 1e3, s.max * 1e3, s.last * 1e3))
+
+    def shutdown(self):
+        self.printTaskSummary()
+        self.metrics.printSummary()
+        if self.metrics_file is not None:
+            self.metrics.writePrometheus(self.metrics_file)
+        ShutdownAllSwitchConnections()
+        for sw in self.switches.values():
+            if sw.request_logger is not None:
+                sw.request_logger.close()
+                if sw.request_logger.dropped:
+                    print("%s: %d P4Runtime requests not logged (queue full)" % (
+                        sw.name, sw.request_logger.dropped))
@@ -0,0 +1,280 @@
+"""
+分片多进程控制器：把交换机分给若干worker进程，每个进程有自己的P4Info解析结果
+和P4Runtime连接，负责所属交换机的表项编译、序列化和RPC；父进程只分发规则、
+汇总计数器和状态。
+
+命令行用法(PYTHONPATH需包含tutorials/utils和本仓库根目录)：
+    python -m p4ctl.sharding --topo pod-topo/topology.json --workers 4
+会把拓扑中每台交换机runtime_json里的table_entries分发给对应worker安装。
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+
+import grpc
+
+from p4ctl.batch import DEFAULT_BATCH_SIZE, buildTableEntryFromSpec, writeTableEntries
+from p4ctl.runtime import connectSwitch, switchAddresses
+from p4ctl.topo import loadRuntimeEntries, loadTopology
+
+
+def partitionSwitches(switch_names, num_workers):
+    """
+    按序号轮转分配，相邻编号的交换机落在不同worker上。
+
+    :return: list of switch name lists, one per worker
+    """
+    shards = [[] for _ in range(num_workers)]
+    for i, name in enumerate(switch_names):
+        shards[i % num_workers].append(name)
+    return shards
+
+
+def _describe(e):
+    if isinstance(e, grpc.RpcError):
+        return "%s: %s" % (e.code(), e.details())
+    return "%s: %s" % (type(e).__name__, e)
+
+
+def _worker(shard_id, p4info_file_path, bmv2_file_path, assignments, log_dir,
+            batch_size, cmd_queue, result_queue):
+    # 回复为 (shard_id, 命令序号, 'ok'/'error'/'ready', 结果)，启动阶段的序号为0。
+    # 任何异常都要回复，否则父进程会一直等这个worker
+    from p4ctl.metrics import RpcMetrics
+
+    switches = {}
+    metrics = RpcMetrics()
+    status = {'shard': shard_id, 'pid': os.getpid(), 'switches': [],
+              'entries': 0, 'errors': 0, 'rpc_time': 0.0}
+    try:
+        # 连接在worker进程内建立，各进程的gRPC channel互不共享
+        from p4ctl.p4info_cache import loadP4InfoHelper
+        p4info_helper = loadP4InfoHelper(p4info_file_path)
+        for name, address, device_id in assignments:
+            sw = connectSwitch(name, address, device_id, log_dir, metrics=metrics)
+            sw.MasterArbitrationUpdate()
+            sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                           bmv2_json_file_path=bmv2_file_path)
+            switches[name] = sw
+            status['switches'].append(name)
+        result_queue.put((shard_id, 0, 'ready', None))
+    except Exception as e:
+        result_queue.put((shard_id, 0, 'error', _describe(e)))
+        return
+
+    for seq, cmd, arg in iter(cmd_queue.get, None):
+        try:
+            if cmd == 'install':
+                installed = {}
+                for name, flows in arg.items():
+                    start = time.perf_counter()
+                    entries = [buildTableEntryFromSpec(p4info_helper, f) for f in flows]
+                    installed[name] = writeTableEntries(switches[name], entries, batch_size)
+                    status['rpc_time'] += time.perf_counter() - start
+                    status['entries'] += installed[name]
+                result_queue.put((shard_id, seq, 'ok', installed))
+            elif cmd == 'counters':
+                counter_name, index = arg
+                counter_id = p4info_helper.get_counters_id(counter_name)
+                values = {}
+                for name, sw in switches.items():
+                    rows = values[name] = []
+                    for response in sw.ReadCounters(counter_id, index):
+                        for entity in response.entities:
+                            c = entity.counter_entry
+                            rows.append((c.index.index, c.data.packet_count,
+                                         c.data.byte_count))
+                result_queue.put((shard_id, seq, 'ok', values))
+            elif cmd == 'status':
+                result_queue.put((shard_id, seq, 'ok', dict(status)))
+            else:
+                result_queue.put((shard_id, seq, 'error', 'unknown command %r' % cmd))
+        except Exception as e:
+            status['errors'] += 1
+            result_queue.put((shard_id, seq, 'error', _describe(e)))
+
+    for sw in switches.values():
+        sw.shutdown()
+        if sw.request_logger is not None:
+            sw.request_logger.close()
+    if log_dir is not None:
+        metrics.writePrometheus(
+            os.path.join(log_dir, 'p4runtime-metrics-shard%d.prom' % shard_id))
+
+
+class ShardedController(object):
+    """
+    父进程一侧的协调器。所有方法都是同步的：把命令发给相关worker，
+    等待它们全部回复后返回合并结果。
+    """
+
+    def __init__(self, p4info_file_path, bmv2_file_path, switch_names,
+                 num_workers=None, log_dir='logs', batch_size=DEFAULT_BATCH_SIZE,
+                 timeout=60.0):
+        """
+        :param p4info_file_path: the p4info file from p4c
+        :param bmv2_file_path: the BMv2 JSON file from p4c
+        :param switch_names: the switches in topology order
+        :param num_workers: the number of worker processes, defaults to the
+                            number of CPUs
+        :param timeout: seconds to wait for the replies to one command
+        """
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(1, min(num_workers, len(switch_names)))
+        self.p4info_file_path = p4info_file_path
+        self.bmv2_file_path = bmv2_file_path
+        self.log_dir = log_dir
+        self.batch_size = batch_size
+        self.timeout = timeout
+        addresses = dict((n, (n, a, d)) for n, a, d in switchAddresses(switch_names))
+        self.shards = [[addresses[n] for n in names]
+                       for names in partitionSwitches(switch_names, num_workers)]
+        self.owner = {}
+        for shard_id, assignments in enumerate(self.shards):
+            for name, _, _ in assignments:
+                self.owner[name] = shard_id
+        self._ctx = multiprocessing.get_context('spawn')
+        self._result_queue = self._ctx.Queue()
+        self._cmd_queues = []
+        self._procs = []
+        self._seq = 0
+
+    def start(self):
+        for shard_id, assignments in enumerate(self.shards):
+            cmd_queue = self._ctx.Queue()
+            p = self._ctx.Process(
+                target=_worker, name='p4ctl-shard-%d' % shard_id,
+                args=(shard_id, self.p4info_file_path, self.bmv2_file_path,
+                      assignments, self.log_dir, self.batch_size,
+                      cmd_queue, self._result_queue))
+            p.daemon = True
+            p.start()
+            self._cmd_queues.append(cmd_queue)
+            self._procs.append(p)
+        self._collect(range(len(self.shards)), 0)
+
+    def _send(self, shard_cmds):
+        """
+        :param shard_cmds: {shard id: (command, argument)}
+        :return: the results by shard id, see _collect
+        """
+        self._seq += 1
+        for shard_id, (cmd, arg) in shard_cmds.items():
+            self._cmd_queues[shard_id].put((self._seq, cmd, arg))
+        return self._collect(shard_cmds, self._seq)
+
+    def _collect(self, shard_ids, seq):
+        """
+        等待shard_ids中每个worker对命令seq的回复。先收齐全部回复(或确认worker
+        已退出/超时)再报告错误，较早命令迟到的回复按序号丢弃，不会被当成本次的结果。
+
+        :return: {shard id: result}
+        """
+        results = {}
+        errors = []
+        pending = set(shard_ids)
+        deadline = time.monotonic() + self.timeout
+        while pending:
+            try:
+                shard_id, reply_seq, kind, payload = self._result_queue.get(timeout=0.5)
+            except queue.Empty:
+                for shard_id in sorted(pending):
+                    p = self._procs[shard_id]
+                    if not p.is_alive():
+                        errors.append("shard %d: worker exited with code %s" % (
+                            shard_id, p.exitcode))
+                        pending.discard(shard_id)
+                if pending and time.monotonic() > deadline:
+                    errors.extend("shard %d: no reply within %.0fs" % (shard_id, self.timeout)
+                                  for shard_id in sorted(pending))
+                    pending.clear()
+                continue
+            if reply_seq != seq or shard_id not in pending:
+                continue
+            pending.discard(shard_id)
+            if kind == 'error':
+                errors.append("shard %d: %s" % (shard_id, payload))
+            else:
+                results[shard_id] = payload
+        if errors:
+            raise RuntimeError('; '.join(errors))
+        return results
+
+    def _broadcast(self, cmd, arg=None):
+        return self._send(dict((shard_id, (cmd, arg))
+                               for shard_id in range(len(self._cmd_queues))))
+
+    def install(self, rules_by_switch):
+        """
+        :param rules_by_switch: {switch name: [runtime.json table entry, ...]}
+        :return: {switch name: number of entries written}
+        """
+        per_shard = {}
+        for name, flows in rules_by_switch.items():
+            per_shard.setdefault(self.owner[name], {})[name] = flows
+        installed = {}
+        for result in self._send(dict((shard_id, ('install', arg))
+                                      for shard_id, arg in per_shard.items())).values():
+            installed.update(result)
+        return installed
+
+    def readCounters(self, counter_name, index=None):
+        """
+        :return: {switch name: [(index, packets, bytes), ...]}
+        """
+        values = {}
+        for result in self._broadcast('counters', (counter_name, index)).values():
+            values.update(result)
+        return values
+
+    def status(self):
+        return [s for _, s in sorted(self._broadcast('status').items())]
+
+    def stop(self):
+        for q in self._cmd_queues:
+            q.put(None)
+        for p in self._procs:
+            p.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded P4Runtime Controller')
+    parser.add_argument('--topo', help='topology.json listing the switches',
+                        type=str, action="store", required=True)
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/basic.p4.p4info.txt')
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/basic.json')
+    parser.add_argument('--workers', help='number of worker processes',
+                        type=int, action="store", required=False, default=None)
+    args = parser.parse_args()
+
+    topo = loadTopology(args.topo)
+    # runtime_json路径相对于运行make的练习目录，即当前目录
+    rules = loadRuntimeEntries(topo, '.')
+    controller = ShardedController(args.p4info, args.bmv2_json,
+                                   list(topo['switches']), args.workers)
+    try:
+        start = time.perf_counter()
+        controller.start()
+        print("Started %d shards in %.2fs" % (len(controller.shards),
+                                              time.perf_counter() - start))
+        start = time.perf_counter()
+        installed = controller.install(rules)
+        print("Installed %d entries on %d switches in %.2fs" % (
+            sum(installed.values()), len(installed), time.perf_counter() - start))
+        for s in controller.status():
+            print("shard %d (pid %d): %d switches, %d entries, %d errors, %.2fs in RPCs" % (
+                s['shard'], s['pid'], len(s['switches']), s['entries'],
+                s['errors'], s['rpc_time']))
+    finally:
+        controller.stop()
+
+
+if __name__ == '__main__':
+    main()
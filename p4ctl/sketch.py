@@ -0,0 +1,214 @@
+"""
+读取数据面count-min sketch(见大作业/mrc/basic.p4)并找出大流。
+
+每个周期用一个ReadRequest读出三行计数器和每列记录的候选流，之后把读到的非零单元
+清零。候选流的估计值是它
+在三行对应列上计数的最小值；count-min sketch只会高估，真实字节数以
+1 - e^-rows 的概率落在 [估计值 - e/width * 总字节数, 估计值] 内。
+装有NumPy时解码在数组上向量化完成，否则逐列计算。
+"""
+import math
+import socket
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from p4ctl.externs import readRegisters, registerInfo, resetRegister, writeRegister
+from p4ctl.runtime import Plugin
+
+SKETCH_ROWS = ('MyIngress.cms_row0', 'MyIngress.cms_row1', 'MyIngress.cms_row2')
+CANDIDATE_REGISTERS = ('MyIngress.hh_src', 'MyIngress.hh_dst', 'MyIngress.hh_ports',
+                       'MyIngress.hh_proto', 'MyIngress.hh_idx1', 'MyIngress.hh_idx2')
+CANDIDATE_COUNT = 'MyIngress.hh_count'
+
+PROTO_NAMES = {1: 'icmp', 6: 'tcp', 17: 'udp'}
+
+
+def _ip(value):
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+class HeavyHitter(object):
+    __slots__ = ('src', 'dst', 'proto', 'sport', 'dport', 'bytes', 'lower', 'share')
+
+    def __init__(self, src, dst, proto, sport, dport, estimate, lower, share):
+        self.src = src
+        self.dst = dst
+        self.proto = proto
+        self.sport = sport
+        self.dport = dport
+        self.bytes = estimate
+        self.lower = lower
+        self.share = share
+
+    def toDict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __str__(self):
+        return "%s:%d -> %s:%d %s %d bytes (>= %d, %.1f%%)" % (
+            self.src, self.sport, self.dst, self.dport,
+            PROTO_NAMES.get(self.proto, str(self.proto)),
+            self.bytes, self.lower, self.share * 100)
+
+
+def readSketch(sw, p4info_helper):
+    """
+    整行读出sketch和候选流寄存器，全部放在一个ReadRequest里。
+
+    :return: (rows, candidates), tuples of array('Q') in the order of
+             SKETCH_ROWS and CANDIDATE_REGISTERS
+    """
+    registers = readRegisters(sw, p4info_helper, SKETCH_ROWS + CANDIDATE_REGISTERS)
+    return registers[:len(SKETCH_ROWS)], registers[len(SKETCH_ROWS):]
+
+
+def resetSketch(sw, p4info_helper, rows=None):
+    """
+    三行计数器和候选流的计数清零；候选流的键不必清，计数为0的列会被下一个报文占据。
+
+    :param rows: the rows returned by readSketch; if given, only the cells read
+                 as non-zero are cleared (hh_count can only be non-zero where row0
+                 is), otherwise every cell is. Bytes counted into a cell that was
+                 still zero when read are then carried into the next epoch.
+    """
+    if rows is None:
+        for name in SKETCH_ROWS + (CANDIDATE_COUNT,):
+            resetRegister(sw, p4info_helper, name)
+        return
+    for name, row in zip(SKETCH_ROWS, rows):
+        writeRegister(sw, p4info_helper, name, ((i, 0) for i, v in enumerate(row) if v))
+    writeRegister(sw, p4info_helper, CANDIDATE_COUNT,
+                  ((i, 0) for i, v in enumerate(rows[0]) if v))
+
+
+def _estimates(rows, candidates, columns):
+    """
+    :return: the count-min estimate of the candidate recorded in each column
+    """
+    row0, row1, row2 = rows
+    idx1, idx2 = candidates[4], candidates[5]
+    if np is not None:
+        r0, r1, r2, i1, i2 = (np.frombuffer(a, dtype=np.uint64)
+                              for a in (row0, row1, row2, idx1, idx2))
+        cols = np.asarray(columns, dtype=np.int64)
+        return np.minimum(np.minimum(r0[cols], r1[i1[cols].astype(np.int64)]),
+                          r2[i2[cols].astype(np.int64)]).tolist()
+    return [min(row0[c], row1[idx1[c]], row2[idx2[c]]) for c in columns]
+
+
+def decodeHeavyHitters(rows, candidates, k=10, min_share=0.0):
+    """
+    :param rows: the sketch rows from readSketch
+    :param candidates: the candidate registers from readSketch
+    :param k: the number of flows to report
+    :param min_share: only report flows above this fraction of the total bytes
+    :return: (total bytes, list of the top-k HeavyHitter by estimate)
+    """
+    width = len(rows[0])
+    total = sum(rows[0])
+    if not total:
+        return 0, []
+    # 同一条流只会记录在它自己的row0列上；没有报文落入的列候选为空
+    columns = [c for c in range(width) if rows[0][c]]
+    estimates = _estimates(rows, candidates, columns)
+    epsilon = math.e / width
+    hitters = []
+    for c, estimate in sorted(zip(columns, estimates), key=lambda x: -x[1])[:k]:
+        if estimate < min_share * total:
+            break
+        src, dst, ports, proto = (candidates[i][c] for i in range(4))
+        hitters.append(HeavyHitter(_ip(src), _ip(dst), proto, ports >> 16, ports & 0xffff,
+                                   estimate, max(0, int(estimate - epsilon * total)),
+                                   estimate / float(total)))
+    return total, hitters
+
+
+def aclEntries(hitters, acl_table='MyIngress.acl', priority=10):
+    """
+    把大流转换为ACL练习(acl.p4)的丢弃表项，格式与sX-acl.json的table_entries相同。
+    acl表只匹配目的地址和UDP目的端口，TCP流只按目的地址匹配。
+    """
+    entries = []
+    seen = set()
+    for h in hitters:
+        match = {'hdr.ipv4.dstAddr': [h.dst, 0xffffffff]}
+        if h.proto == 17:
+            match['hdr.udp.dstPort'] = [h.dport, 0xffff]
+        key = tuple(sorted((k, tuple(v)) for k, v in match.items()))
+        if key in seen:
+            continue
+        seen.add(key)
+        entries.append({'table': acl_table, 'match': match,
+                        'action_name': 'MyIngress.drop', 'action_params': {},
+                        'priority': priority})
+    return entries
+
+
+def destinationLoad(hitters):
+    """
+    按目的地址汇总大流字节数。
+
+    :return: {dst ip: bytes}
+    """
+    load = {}
+    for h in hitters:
+        load[h.dst] = load.get(h.dst, 0) + h.bytes
+    return load
+
+
+class HeavyHitterMonitor(Plugin):
+    """
+    每个周期读出各交换机的sketch，解码出前k个大流后清零，并把结果交给on_report。
+    """
+    name = 'heavy-hitters'
+
+    def __init__(self, epoch=1.0, k=10, min_share=0.01, on_report=None):
+        """
+        :param epoch: seconds between reads
+        :param on_report: on_report(switch name, total bytes, hitters)
+        """
+        self.epoch = epoch
+        self.k = k
+        self.min_share = min_share
+        self.on_report = on_report
+        self.enabled = False
+        self.reports = {}
+
+    def install(self, runtime):
+        try:
+            for name in SKETCH_ROWS + CANDIDATE_REGISTERS + (CANDIDATE_COUNT,):
+                registerInfo(runtime.p4info_helper, name)
+        except AttributeError as e:
+            # P4Info中没有sketch寄存器：build/里是旧程序的编译结果，需重新make
+            print("Heavy hitter detection disabled (rebuild basic.p4 with make): %s" % e)
+            return
+        self.enabled = True
+        for name in runtime.switch_names:
+            resetSketch(runtime.switch(name), runtime.p4info_helper)
+
+    def tasks(self, runtime):
+        if not self.enabled:
+            return []
+        return [('heavy-hitters', self.epoch, self.step)]
+
+    def step(self, runtime):
+        for name in runtime.switch_names:
+            sw = runtime.switch(name)
+            rows, candidates = readSketch(sw, runtime.p4info_helper)
+            # 只清零读到的非零单元；读和清零之间落入这些单元的报文不计入任何周期
+            resetSketch(sw, runtime.p4info_helper, rows)
+            total, hitters = decodeHeavyHitters(rows, candidates, self.k, self.min_share)
+            self.reports[name] = (total, hitters)
+            if self.on_report is not None:
+                self.on_report(name, total, hitters)
+
+
+def printReport(switch_name, total, hitters):
+    if not hitters:
+        return
+    print("%s: %d bytes, top %d flows:" % (switch_name, total, len(hitters)))
+    for h in hitters:
+        print("    %s" % h)
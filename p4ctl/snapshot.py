@@ -0,0 +1,177 @@
+"""
+交换机状态快照：用Read读出表项、计数器和寄存器，每个实体预先序列化成
+WriteRequest.updates字段的编码(tag + 长度 + Update)，顺序写入文件。
+恢复时把文件mmap进来，按索引切出连续的一段字节，拼上device_id/election_id
+的编码直接作为WriteRequest发送，不在Python里重建任何protobuf对象。
+
+文件格式(小端)：
+    头部  magic b'P4SNAP01' | 更新条数 n (u64) | 索引偏移 (u64) | device_id (u64)
+    数据  n条已编码的updates字段
+    索引  n+1个u64，第i条更新在文件中的起始偏移，最后一个为数据末尾
+
+命令行用法(PYTHONPATH需包含tutorials/utils和本仓库根目录)：
+    python -m p4ctl.snapshot save    --topo topology.json --dir snapshots
+    python -m p4ctl.snapshot restore --topo topology.json --dir snapshots
+save会以master身份仲裁，应在控制器停止时运行；控制器内部可直接调用captureSnapshot。
+"""
+import argparse
+import mmap
+import os
+import struct
+from array import array
+
+import grpc
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.batch import DEFAULT_BATCH_SIZE
+from p4ctl.runtime import connectSwitch, switchAddresses
+from p4ctl.topo import loadTopology
+
+SNAPSHOT_MAGIC = b'P4SNAP01'
+SNAPSHOT_HEADER = struct.Struct('<8sQQQ')
+
+# WriteRequest中各字段的tag(字段号 << 3 | wire type)：device_id = 1 (varint)，
+# election_id = 3 (length-delimited)，updates = 4 (length-delimited)；2是已废弃的role_id
+_TAG_DEVICE_ID = b'\x08'
+_TAG_ELECTION_ID = b'\x1a'
+_TAG_UPDATES = b'\x22'
+
+WRITE_METHOD = '/p4.v1.P4Runtime/Write'
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _readEntities(sw, entity_type):
+    request = p4runtime_pb2.ReadRequest()
+    request.device_id = sw.device_id
+    # id为0的通配读，读出该类型的全部实体
+    getattr(request.entities.add(), entity_type).SetInParent()
+    for response in sw.client_stub.Read(request):
+        for entity in response.entities:
+            yield entity
+
+
+def captureSnapshot(sw, snapshot_file_path,
+                    entity_types=('table_entry', 'counter_entry', 'register_entry')):
+    """
+    读出交换机状态并写入快照文件。
+
+    :param sw: the switch connection
+    :param snapshot_file_path: the output file
+    :param entity_types: the entity kinds to read, in restore order
+    :return: the number of updates written
+    """
+    offsets = array('Q')
+    update = p4runtime_pb2.Update()
+    with open(snapshot_file_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 0, 0, sw.device_id))
+        pos = SNAPSHOT_HEADER.size
+        for entity_type in entity_types:
+            try:
+                for entity in _readEntities(sw, entity_type):
+                    update.Clear()
+                    if entity_type == 'table_entry' and not entity.table_entry.is_default_action:
+                        update.type = p4runtime_pb2.Update.INSERT
+                    else:
+                        update.type = p4runtime_pb2.Update.MODIFY
+                    update.entity.CopyFrom(entity)
+                    body = update.SerializeToString()
+                    record = _TAG_UPDATES + _varint(len(body)) + body
+                    offsets.append(pos)
+                    f.write(record)
+                    pos += len(record)
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                    raise
+                print("%s: reading %s is not supported, skipped" % (sw.name, entity_type))
+        count = len(offsets)
+        offsets.append(pos)
+        f.write(offsets.tobytes())
+        f.seek(0)
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, count, pos, sw.device_id))
+    return count
+
+
+def restoreSnapshot(sw, snapshot_file_path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    把快照分批写回交换机(交换机上应已装好同一个P4程序)。
+
+    :return: the number of updates written
+    """
+    election_id = p4runtime_pb2.Uint128()
+    election_id.high = getattr(sw, 'election_id', 1) >> 64
+    election_id.low = getattr(sw, 'election_id', 1) & 0xffffffffffffffff
+    election_id = election_id.SerializeToString()
+    prefix = (_TAG_DEVICE_ID + _varint(sw.device_id) +
+              _TAG_ELECTION_ID + _varint(len(election_id)) + election_id)
+    # 请求已经是序列化好的字节，不再经过protobuf序列化
+    write = sw.channel.unary_unary(
+        WRITE_METHOD, request_serializer=None,
+        response_deserializer=p4runtime_pb2.WriteResponse.FromString)
+
+    with open(snapshot_file_path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, count, index_offset, _ = SNAPSHOT_HEADER.unpack_from(mm)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("%s is not a switch snapshot" % snapshot_file_path)
+        offsets = array('Q')
+        offsets.frombytes(mm[index_offset:index_offset + 8 * (count + 1)])
+        for i in range(0, count, batch_size):
+            end = offsets[min(i + batch_size, count)]
+            write(prefix + mm[offsets[i]:end])
+    finally:
+        mm.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Switch state snapshot/restore')
+    parser.add_argument('action', choices=['save', 'restore'])
+    parser.add_argument('--topo', help='topology.json listing the switches',
+                        type=str, action="store", required=True)
+    parser.add_argument('--dir', help='snapshot directory',
+                        type=str, action="store", required=False, default='snapshots')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/basic.p4.p4info.txt')
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/basic.json')
+    args = parser.parse_args()
+
+    from p4runtime_lib.switch import ShutdownAllSwitchConnections
+
+    from p4ctl.p4info_cache import loadP4InfoHelper
+
+    topo = loadTopology(args.topo)
+    os.makedirs(args.dir, exist_ok=True)
+    if args.action == 'restore':
+        p4info_helper = loadP4InfoHelper(args.p4info)
+    try:
+        for name, address, device_id in switchAddresses(list(topo['switches'])):
+            sw = connectSwitch(name, address, device_id, log_dir=None)
+            sw.MasterArbitrationUpdate()
+            path = os.path.join(args.dir, '%s.snap' % name)
+            if args.action == 'save':
+                print("Saved %d updates from %s" % (captureSnapshot(sw, path), name))
+            else:
+                sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                               bmv2_json_file_path=args.bmv2_json)
+                print("Restored %d updates to %s" % (restoreSnapshot(sw, path), name))
+    finally:
+        ShutdownAllSwitchConnections()
+
+
+if __name__ == '__main__':
+    main()
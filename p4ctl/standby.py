@@ -0,0 +1,610 @@
+"""
+主备热切换。
+
+主控制器(primary)以较高的election_id仲裁，并通过StatePublisher把每个成功的
+Write请求转发给备控制器：
+
+    publisher = StatePublisher(('127.0.0.1', 9560))
+    runtime = ControllerRuntime(p4info_helper, bmv2, topo, election_id=10, mirror=publisher)
+
+大作业/mrc的控制器在命令行上提供同样的设置：
+    python3 mrccontroller.py --topo pod-topo/topology.json --election-id 10 --mirror 127.0.0.1:9560
+
+备控制器(backup)以election_id - 1作为从控制器连上所有交换机，在内存中镜像每台
+交换机应有的状态。以下任一情况发生时立即接管：
+  - 与主控制器之间的镜像连接断开，或超过dead_interval没有收到心跳；
+  - 交换机通知备控制器成为primary(主控制器到交换机的流已断开)。
+接管时以election_id + 1重新仲裁(主控制器即使还活着也会被抢占)，然后读出交换机上
+现有的表项，只写入与镜像状态的差异，而不是重装全部表项。
+
+    python -m p4ctl.standby --topo topology.json --primary 127.0.0.1:9560 --election-id 10
+
+在没有BMv2的环境里，可以用standin.py的P4Runtime替身演练一次切换
+(需要tutorials/utils在PYTHONPATH中)：
+    python -m p4ctl.standby --drill --switches 3 --entries 5000
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import struct
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from google.rpc import code_pb2
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.batch import DEFAULT_BATCH_SIZE, writeUpdates
+from p4ctl.runtime import arbitrate, connectSwitch, switchAddresses
+from p4ctl.standin import entityKey
+
+# 镜像连接上的记录：类型 | 交换机名长度 | 负载长度，后接交换机名和负载
+RECORD_HEADER = struct.Struct('<BHI')
+RECORD_HEARTBEAT = 0
+RECORD_WRITE = 1     # 负载为序列化的WriteRequest
+RECORD_RESET = 2     # 交换机重新下发了P4程序，之前的状态作废
+
+WRITE_METHOD = '/p4.v1.P4Runtime/Write'
+SET_PIPELINE_METHOD = '/p4.v1.P4Runtime/SetForwardingPipelineConfig'
+
+
+class DesiredState(object):
+    """
+    每台交换机上应有的实体 {交换机: {entityKey: 序列化的Entity}}，按首次写入的顺序保存，
+    恢复时先写的实体(例如隧道的中转表项)仍然先写。
+    """
+
+    def __init__(self):
+        self.switches = {}
+        self._lock = threading.Lock()
+
+    def apply(self, switch_name, request):
+        with self._lock:
+            entities = self.switches.setdefault(switch_name, {})
+            for update in request.updates:
+                key = entityKey(update.entity)
+                if update.type == p4runtime_pb2.Update.DELETE:
+                    entities.pop(key, None)
+                else:
+                    entities[key] = update.entity.SerializeToString()
+
+    def reset(self, switch_name):
+        with self._lock:
+            self.switches.pop(switch_name, None)
+
+    def entities(self, switch_name):
+        """
+        :return: list of (entityKey, serialized Entity)
+        """
+        with self._lock:
+            return list(self.switches.get(switch_name, {}).items())
+
+    def count(self):
+        with self._lock:
+            return sum(len(e) for e in self.switches.values())
+
+
+def _record(kind, switch_name=b'', payload=b''):
+    return RECORD_HEADER.pack(kind, len(switch_name), len(payload)) + switch_name + payload
+
+
+def _recvExactly(conn, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = conn.recv(n - len(buf))
+        if not chunk:
+            raise EOFError('mirror connection closed')
+        buf += chunk
+    return bytes(buf)
+
+
+class _MirrorInterceptor(grpc.UnaryUnaryClientInterceptor):
+
+    def __init__(self, publisher, switch_name):
+        self.publisher = publisher
+        self.switch_name = switch_name
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        outcome = continuation(client_call_details, request)
+        method = client_call_details.method
+        if method == WRITE_METHOD:
+            # snapshot.restoreSnapshot发送的是已序列化的字节
+            payload = request if isinstance(request, bytes) else request.SerializeToString()
+            outcome.add_done_callback(
+                lambda f: f.exception() is None and self.publisher.publishWrite(
+                    self.switch_name, payload))
+        elif method == SET_PIPELINE_METHOD:
+            outcome.add_done_callback(
+                lambda f: f.exception() is None and self.publisher.publishReset(
+                    self.switch_name))
+        return outcome
+
+
+class StatePublisher(object):
+    """
+    主控制器一侧：监听address，向连上来的备控制器先发送当前的全部状态，
+    之后转发每个成功的Write，并每隔heartbeat_interval秒发送一次心跳。
+    与BinaryRequestLogger一样，解析和发送都在后台线程里进行，不增加写请求的延迟。
+    转发线程意外退出时心跳随之停止，备控制器在dead_interval后接管，
+    而不是继续跟随一个不再更新的镜像。
+    """
+
+    def __init__(self, address, heartbeat_interval=0.05):
+        self.state = DesiredState()
+        self.heartbeat_interval = heartbeat_interval
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.listen(4)
+        self._publisher = threading.Thread(target=self._publish, daemon=True)
+        self._publisher.start()
+        for target in (self._accept, self._heartbeat):
+            threading.Thread(target=target, daemon=True).start()
+
+    def interceptor(self, switch_name):
+        return _MirrorInterceptor(self, switch_name)
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                try:
+                    for name in list(self.state.switches):
+                        request = p4runtime_pb2.WriteRequest()
+                        for _, blob in self.state.entities(name):
+                            update = request.updates.add()
+                            update.type = p4runtime_pb2.Update.MODIFY
+                            update.entity.ParseFromString(blob)
+                        conn.sendall(_record(RECORD_WRITE, name.encode(),
+                                             request.SerializeToString()))
+                except OSError:
+                    conn.close()
+                    continue
+                self.subscribers.append(conn)
+
+    def _send(self, record):
+        # 调用方持有self._lock
+        for conn in list(self.subscribers):
+            try:
+                conn.sendall(record)
+            except OSError:
+                self.subscribers.remove(conn)
+                conn.close()
+
+    def _heartbeat(self):
+        record = _record(RECORD_HEARTBEAT)
+        while not self._closed.wait(self.heartbeat_interval):
+            if not self._publisher.is_alive():
+                print("Mirror publisher stopped, no more heartbeats")
+                return
+            with self._lock:
+                self._send(record)
+
+    def _publish(self):
+        for kind, switch_name, payload in iter(self._queue.get, None):
+            # 更新状态和发送在同一把锁内，新连上的备控制器收到的快照与之后的记录不重不漏
+            with self._lock:
+                try:
+                    if kind == RECORD_WRITE:
+                        self.state.apply(switch_name,
+                                         p4runtime_pb2.WriteRequest.FromString(payload))
+                    else:
+                        self.state.reset(switch_name)
+                    record = _record(kind, switch_name.encode(), payload)
+                except Exception as e:
+                    # 备控制器同样无法应用这条记录，不转发
+                    print("%s: not mirroring a write: %r" % (switch_name, e))
+                    continue
+                self._send(record)
+
+    def publishWrite(self, switch_name, payload):
+        self._queue.put((RECORD_WRITE, switch_name, payload))
+
+    def publishReset(self, switch_name):
+        self._queue.put((RECORD_RESET, switch_name, b''))
+
+    def close(self):
+        self._queue.put(None)
+        self._closed.set()
+        self.sock.close()
+        with self._lock:
+            for conn in self.subscribers:
+                conn.close()
+            self.subscribers = []
+
+
+def _comparable(entity):
+    e = p4runtime_pb2.TableEntry()
+    e.CopyFrom(entity.table_entry)
+    for name in ('counter_data', 'meter_config', 'time_since_last_hit'):
+        e.ClearField(name)
+    return e.SerializeToString(deterministic=True)
+
+
+def reconcile(sw, desired, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    让交换机上的表项与desired一致：读出现有表项，插入缺少的、修改动作不同的、
+    删除多出来的；默认动作和计数器/寄存器等其他实体无法逐个比较，直接MODIFY。
+
+    :param desired: list of (entityKey, serialized Entity), see DesiredState.entities
+
+    :return: {'inserted', 'modified', 'deleted', 'unchanged'} counts
+    """
+    request = p4runtime_pb2.ReadRequest()
+    request.device_id = sw.device_id
+    request.entities.add().table_entry.SetInParent()
+    actual = {}
+    for response in sw.client_stub.Read(request):
+        for entity in response.entities:
+            actual[entityKey(entity)] = entity
+
+    counts = {'inserted': 0, 'modified': 0, 'deleted': 0, 'unchanged': 0}
+    wanted = set()
+    updates = []
+    for key, blob in desired:
+        wanted.add(key)
+        have = actual.get(key)
+        # 读回的字节与写入时相同是最常见的情况，不必再解析比较
+        if have is not None and have.SerializeToString() == blob:
+            counts['unchanged'] += 1
+            continue
+        entity = p4runtime_pb2.Entity.FromString(blob)
+        update = p4runtime_pb2.Update()
+        update.type = p4runtime_pb2.Update.MODIFY
+        if key[0] == 'table_entry' and not entity.table_entry.is_default_action:
+            if have is None:
+                update.type = p4runtime_pb2.Update.INSERT
+                counts['inserted'] += 1
+            elif _comparable(have) == _comparable(entity):
+                counts['unchanged'] += 1
+                continue
+            else:
+                counts['modified'] += 1
+        else:
+            counts['modified'] += 1
+        update.entity.CopyFrom(entity)
+        updates.append(update)
+    stale = []
+    for key, entity in actual.items():
+        if key not in wanted:
+            update = p4runtime_pb2.Update()
+            update.type = p4runtime_pb2.Update.DELETE
+            update.entity.CopyFrom(entity)
+            stale.append(update)
+    counts['deleted'] = len(stale)
+    # 先删除多余的表项，再补齐缺少的
+    writeUpdates(sw, stale + updates, batch_size)
+    return counts
+
+
+class StandbyController(object):
+    """
+    备控制器。start()之后在后台线程里接收镜像、监视主控制器，检测到主控制器
+    失效时自动接管；wait()等待接管完成并返回各阶段耗时。
+    """
+
+    def __init__(self, switch_names, primary_address, primary_election_id,
+                 host='127.0.0.1', log_dir=None, dead_interval=0.2,
+                 batch_size=DEFAULT_BATCH_SIZE, on_takeover=None):
+        """
+        :param switch_names: the switches in topology order
+        :param primary_address: (host, port) of the primary's StatePublisher
+        :param primary_election_id: the primary's election ID; the backup
+                                    arbitrates with one less and takes over
+                                    with one more
+        :param dead_interval: seconds without a heartbeat before the primary
+                              is considered lost
+        :param on_takeover: called as on_takeover(standby) once the switches
+                            are reconciled
+        """
+        if primary_election_id < 2:
+            raise ValueError("the primary needs an election ID >= 2 so the backup "
+                             "can sit below it")
+        self.switch_names = list(switch_names)
+        self.primary_address = primary_address
+        self.backup_election_id = primary_election_id - 1
+        self.takeover_election_id = primary_election_id + 1
+        self.host = host
+        self.log_dir = log_dir
+        self.dead_interval = dead_interval
+        self.batch_size = batch_size
+        self.on_takeover = on_takeover
+        self.state = DesiredState()
+        self.switches = {}
+        self.report = None
+        self._arbitration = {}
+        self._lost = threading.Event()
+        self._lost_reason = None
+        self._lost_at = None
+        self._lost_lock = threading.Lock()
+        self._takeover_lock = threading.Lock()
+        self._done = threading.Event()
+        self.error = None
+
+    def start(self, connect_timeout=10.0):
+        for name, address, device_id in switchAddresses(self.switch_names, self.host):
+            sw = connectSwitch(name, address, device_id, self.log_dir)
+            update = arbitrate(sw, self.backup_election_id)
+            if update is not None and update.status.code == code_pb2.OK:
+                print("%s: no primary controller, backup is primary" % name)
+            self.switches[name] = sw
+            self._arbitration[name] = queue.Queue()
+            threading.Thread(target=self._watchStream, args=(sw,),
+                             name='%s-standby' % name, daemon=True).start()
+
+        deadline = time.time() + connect_timeout
+        while True:
+            try:
+                conn = socket.create_connection(self.primary_address, timeout=1.0)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+        conn.settimeout(self.dead_interval)
+        threading.Thread(target=self._watchMirror, args=(conn,), daemon=True).start()
+        threading.Thread(target=self._takeoverWhenLost, daemon=True).start()
+
+    def primaryLost(self, reason):
+        with self._lost_lock:
+            if self._lost.is_set():
+                return
+            self._lost_at = time.perf_counter()
+            self._lost_reason = reason
+            self._lost.set()
+
+    def _watchStream(self, sw):
+        try:
+            for msg in sw.stream_msg_resp:
+                if msg.WhichOneof('update') != 'arbitration':
+                    continue
+                self._arbitration[sw.name].put(msg.arbitration)
+                if msg.arbitration.status.code == code_pb2.OK:
+                    self.primaryLost('%s made the backup primary' % sw.name)
+        except grpc.RpcError:
+            pass
+
+    def _watchMirror(self, conn):
+        try:
+            while True:
+                kind, name_len, payload_len = RECORD_HEADER.unpack(
+                    _recvExactly(conn, RECORD_HEADER.size))
+                name = _recvExactly(conn, name_len).decode()
+                payload = _recvExactly(conn, payload_len)
+                if kind == RECORD_WRITE:
+                    self.state.apply(name, p4runtime_pb2.WriteRequest.FromString(payload))
+                elif kind == RECORD_RESET:
+                    self.state.reset(name)
+        except socket.timeout:
+            self.primaryLost('no heartbeat for %.0fms' % (self.dead_interval * 1e3))
+        except (EOFError, OSError) as e:
+            self.primaryLost('mirror connection lost: %s' % e)
+        finally:
+            conn.close()
+
+    def _claim(self, sw, timeout):
+        """
+        :return: whether the switch made the backup primary within timeout
+        """
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.arbitration.device_id = sw.device_id
+        request.arbitration.election_id.high = self.takeover_election_id >> 64
+        request.arbitration.election_id.low = self.takeover_election_id & 0xffffffffffffffff
+        sw.requests_stream.put(request)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                update = self._arbitration[sw.name].get(
+                    timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                return False
+            election_id = (update.election_id.high << 64) | update.election_id.low
+            if update.status.code == code_pb2.OK and election_id == self.takeover_election_id:
+                sw.election_id = self.takeover_election_id
+                return True
+
+    def _takeoverWhenLost(self):
+        self._lost.wait()
+        self.takeover()
+
+    def takeover(self, timeout=2.0):
+        """
+        以更高的election_id取得所有交换机的primary身份，然后逐台对账。
+        可以在检测到主控制器失效之前手动调用；重复调用只执行一次。
+        timeout秒内没有确认primary身份的交换机不对账，记在报告的failed中。
+        """
+        with self._takeover_lock:
+            if self.report is None:
+                self.primaryLost('manual takeover')
+                self._takeover(timeout)
+        return self.report
+
+    def _takeover(self, timeout):
+        try:
+            switches = list(self.switches.values())
+            # 没有交换机时也要给出报告；ThreadPoolExecutor不接受max_workers=0
+            with futures.ThreadPoolExecutor(max_workers=max(1, len(switches))) as pool:
+                claimed = list(pool.map(lambda sw: self._claim(sw, timeout), switches))
+                mastership_at = time.perf_counter()
+                switches = [sw for sw, ok in zip(switches, claimed) if ok]
+                results = dict(zip(
+                    (sw.name for sw in switches),
+                    pool.map(lambda sw: reconcile(sw, self.state.entities(sw.name),
+                                                  self.batch_size), switches)))
+            reconciled_at = time.perf_counter()
+            self.report = {'reason': self._lost_reason,
+                           'mastership': mastership_at - self._lost_at,
+                           'reconciled': reconciled_at - self._lost_at,
+                           'mirrored': self.state.count(),
+                           'switches': results,
+                           'failed': sorted(set(self.switches) - set(results))}
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self._done.set()
+        if self.on_takeover is not None:
+            self.on_takeover(self)
+
+    def wait(self, timeout=None):
+        """
+        :return: the takeover report, or None if it has not finished within timeout
+        :raises: the exception that ended the takeover, if any
+        """
+        if self._done.wait(timeout) and self.error is not None:
+            raise self.error
+        return self.report
+
+
+def printReport(report):
+    print("Took over (%s): primary on all switches after %.1fms, reconciled after %.1fms" % (
+        report['reason'], report['mastership'] * 1e3, report['reconciled'] * 1e3))
+    print("%d mirrored entities" % report['mirrored'])
+    for name, c in sorted(report['switches'].items()):
+        print("%-4s inserted=%d modified=%d deleted=%d unchanged=%d" % (
+            name, c['inserted'], c['modified'], c['deleted'], c['unchanged']))
+    for name in report['failed']:
+        print("%-4s did not make the backup primary, not reconciled" % name)
+
+
+def _drillPrimary(switch_names, mirror_address, election_id, entries, ready, done):
+    publisher = StatePublisher(mirror_address)
+    switches = [connectSwitch(name, address, device_id, log_dir=None, mirror=publisher)
+                for name, address, device_id in switchAddresses(switch_names)]
+    for sw in switches:
+        arbitrate(sw, election_id)
+
+    def updates(start, stop):
+        # 替身不校验P4Info，用一张虚构的精确匹配表
+        for i in range(start, stop):
+            update = p4runtime_pb2.Update()
+            update.type = p4runtime_pb2.Update.INSERT
+            e = update.entity.table_entry
+            e.table_id = 1
+            m = e.match.add()
+            m.field_id = 1
+            m.exact.value = struct.pack('!I', i)
+            e.action.action.action_id = 1
+            yield update
+
+    # 一半在备控制器连上之前写入(经由初始快照镜像)，一半之后写入(经由增量记录)
+    half = entries // 2
+    for sw in switches:
+        writeUpdates(sw, updates(0, half))
+    ready.set()
+    while not publisher.subscribers:
+        time.sleep(0.01)
+    for sw in switches:
+        writeUpdates(sw, updates(half, entries))
+    done.set()
+    while True:
+        time.sleep(1)
+
+
+def drill(num_switches, entries, mirror_port=9560, election_id=10):
+    """
+    在本机的P4Runtime替身上演练一次切换：启动主控制器进程写入表项，
+    启动备控制器，然后SIGKILL主控制器，测量接管耗时并检查替身上的状态。
+    """
+    from p4ctl.standin import serve
+
+    servers = [serve(address, device_id) for _, address, device_id
+               in switchAddresses(['s%d' % (i + 1) for i in range(num_switches)])]
+    switch_names = ['s%d' % (i + 1) for i in range(num_switches)]
+    ctx = multiprocessing.get_context('spawn')
+    ready, done = ctx.Event(), ctx.Event()
+    primary = ctx.Process(target=_drillPrimary, daemon=True, args=(
+        switch_names, ('127.0.0.1', mirror_port), election_id, entries, ready, done))
+    primary.start()
+    try:
+        while not ready.wait(1):
+            if not primary.is_alive():
+                raise RuntimeError('the primary exited before writing')
+        standby = StandbyController(switch_names, ('127.0.0.1', mirror_port), election_id)
+        standby.start()
+        while not done.wait(1):
+            if not primary.is_alive():
+                raise RuntimeError('the primary exited while writing')
+        # 等最后一批增量记录到达备控制器
+        while standby.state.count() < entries * num_switches:
+            time.sleep(0.01)
+        # 模拟主控制器丢失前对交换机的一处改动没有同步到备控制器
+        servers[0][1].entities.pop(next(iter(servers[0][1].entities)))
+        os.kill(primary.pid, signal.SIGKILL)
+        report = standby.wait(10)
+        if report is None:
+            print("Backup did not take over")
+            return
+        printReport(report)
+        for (_, standin), name in zip(servers, switch_names):
+            print("%-4s primary election_id=%s, %d entries" % (
+                name, standin.primaryElectionId(), len(standin.entities)))
+    finally:
+        primary.join(1)
+        for server, _ in servers:
+            server.stop(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hot-standby P4Runtime controller')
+    parser.add_argument('--topo', help='topology.json listing the switches',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--primary', help="the primary's StatePublisher address host:port",
+                        type=str, action="store", required=False, default='127.0.0.1:9560')
+    parser.add_argument('--election-id', help="the primary's election ID",
+                        type=int, action="store", required=False, default=10)
+    parser.add_argument('--dead-interval', help='seconds without a heartbeat before taking over',
+                        type=float, action="store", required=False, default=0.2)
+    parser.add_argument('--drill', help='run a failover drill against local stand-ins',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--switches', help='switches in the drill',
+                        type=int, action="store", required=False, default=3)
+    parser.add_argument('--entries', help='table entries per switch in the drill',
+                        type=int, action="store", required=False, default=5000)
+    args = parser.parse_args()
+
+    if args.drill:
+        drill(args.switches, args.entries, election_id=args.election_id)
+        return
+    if args.topo is None:
+        parser.error('--topo is required unless --drill is given')
+
+    from p4runtime_lib.switch import ShutdownAllSwitchConnections
+
+    from p4ctl.topo import loadTopology
+
+    host, _, port = args.primary.rpartition(':')
+    standby = StandbyController(list(loadTopology(args.topo)['switches']),
+                                (host, int(port)), args.election_id,
+                                log_dir='logs', dead_interval=args.dead_interval)
+    try:
+        standby.start()
+        print("Standing by for %s (%d switches)" % (args.primary, len(standby.switches)))
+        # 带超时等待，Ctrl-C可以随时打断
+        report = None
+        while report is None:
+            report = standby.wait(1.0)
+        printReport(report)
+        # 保持连接，交换机不会回到无主状态
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    finally:
+        ShutdownAllSwitchConnections()
+
+
+if __name__ == '__main__':
+    main()
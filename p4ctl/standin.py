@@ -0,0 +1,244 @@
+"""
+本地P4Runtime替身：在内存中实现主备仲裁、表项和其他实体的Write/Read，以及
+流水线配置的保存。不做任何转发，只用来在没有BMv2的环境里演练控制器逻辑，
+例如standby.py的主备切换。
+
+仲裁规则与P4Runtime规范一致：每台设备上election_id最大的流为primary，
+primary变化时通知该设备上所有的流(primary收到OK，其余收到ALREADY_EXISTS，
+没有primary时为NOT_FOUND)；只有primary的写请求会被接受。
+
+    python -m p4ctl.standin --switches 3
+在50051起的端口上各启动一个替身设备，device_id与run_exercise.py的分配一致。
+"""
+import argparse
+import queue
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from google.rpc import code_pb2
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+# 与runtime.GRPC_BASE_PORT相同；这里不导入runtime，替身不依赖tutorials/utils
+GRPC_BASE_PORT = 50051
+
+# 不属于实体标识的字段(动作、计数值、配置等)
+_DATA_FIELDS = ('action', 'data', 'config', 'counter_data', 'meter_config',
+                'meter_counter_data', 'time_since_last_hit', 'idle_timeout_ns',
+                'metadata', 'is_const')
+
+
+def entityKey(entity):
+    """
+    实体的标识：实体类型加上去掉动作/数据字段后的确定性序列化结果。
+    同一张表中match和priority相同的表项、同一个计数器/寄存器下标的键相同。
+    """
+    kind = entity.WhichOneof('entity')
+    key = type(getattr(entity, kind))()
+    key.CopyFrom(getattr(entity, kind))
+    fields = key.DESCRIPTOR.fields_by_name
+    for name in _DATA_FIELDS:
+        if name in fields:
+            key.ClearField(name)
+    return kind, key.SerializeToString(deterministic=True)
+
+
+def _electionId(uint128):
+    return (uint128.high << 64) | uint128.low
+
+
+class _Stream(object):
+    __slots__ = ('out', 'device_id', 'election_id', 'closed')
+
+    def __init__(self):
+        self.out = queue.Queue()
+        self.device_id = None
+        self.election_id = None
+        self.closed = False
+
+
+class P4RuntimeStandIn(p4runtime_pb2_grpc.P4RuntimeServicer):
+
+    def __init__(self, device_id=0):
+        self.device_id = device_id
+        self.entities = {}
+        self.config = None
+        self.writes = 0
+        self.streams = []
+        self._primary = None
+        self._lock = threading.Lock()
+
+    def primaryElectionId(self):
+        with self._lock:
+            return self._primary.election_id if self._primary is not None else None
+
+    # ---------- StreamChannel ----------
+
+    def StreamChannel(self, request_iterator, context):
+        stream = _Stream()
+        with self._lock:
+            self.streams.append(stream)
+
+        def consume():
+            try:
+                for request in request_iterator:
+                    if request.WhichOneof('update') == 'arbitration':
+                        self._arbitrate(stream, request.arbitration)
+            except grpc.RpcError:
+                pass
+            finally:
+                self._close(stream)
+
+        threading.Thread(target=consume, daemon=True).start()
+        context.add_callback(lambda: self._close(stream))
+        for msg in iter(stream.out.get, None):
+            yield msg
+
+    def _arbitrate(self, stream, arbitration):
+        with self._lock:
+            if arbitration.device_id != self.device_id:
+                msg = p4runtime_pb2.StreamMessageResponse()
+                msg.arbitration.CopyFrom(arbitration)
+                msg.arbitration.status.code = code_pb2.NOT_FOUND
+                msg.arbitration.status.message = 'unknown device %d' % arbitration.device_id
+                stream.out.put(msg)
+                return
+            stream.device_id = arbitration.device_id
+            stream.election_id = _electionId(arbitration.election_id)
+            changed = self._elect()
+            for s in (self.streams if changed else [stream]):
+                self._notify(s)
+
+    def _close(self, stream):
+        with self._lock:
+            if stream.closed:
+                return
+            stream.closed = True
+            self.streams.remove(stream)
+            stream.out.put(None)
+            if self._elect():
+                for s in self.streams:
+                    self._notify(s)
+
+    def _elect(self):
+        """
+        重新选出primary，返回primary是否变化。调用方持有锁。
+        """
+        candidates = [s for s in self.streams if s.election_id is not None]
+        primary = max(candidates, key=lambda s: s.election_id) if candidates else None
+        changed = primary is not self._primary
+        self._primary = primary
+        return changed
+
+    def _notify(self, stream):
+        if stream.election_id is None:
+            return
+        msg = p4runtime_pb2.StreamMessageResponse()
+        msg.arbitration.device_id = self.device_id
+        if self._primary is None:
+            msg.arbitration.status.code = code_pb2.NOT_FOUND
+        else:
+            msg.arbitration.election_id.high = self._primary.election_id >> 64
+            msg.arbitration.election_id.low = self._primary.election_id & 0xffffffffffffffff
+            msg.arbitration.status.code = (code_pb2.OK if stream is self._primary
+                                           else code_pb2.ALREADY_EXISTS)
+        stream.out.put(msg)
+
+    # ---------- unary RPCs ----------
+
+    def _checkPrimary(self, request, context):
+        if request.device_id != self.device_id:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'unknown device %d' % request.device_id)
+        if self._primary is None or _electionId(request.election_id) != self._primary.election_id:
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, 'not the primary controller')
+
+    def Write(self, request, context):
+        with self._lock:
+            self._checkPrimary(request, context)
+            for update in request.updates:
+                key = entityKey(update.entity)
+                is_table = key[0] == 'table_entry' and not update.entity.table_entry.is_default_action
+                if update.type == p4runtime_pb2.Update.INSERT and is_table and key in self.entities:
+                    context.abort(grpc.StatusCode.ALREADY_EXISTS, 'entry already exists')
+                if update.type != p4runtime_pb2.Update.INSERT and is_table and key not in self.entities:
+                    context.abort(grpc.StatusCode.NOT_FOUND, 'entry not found')
+                if update.type == p4runtime_pb2.Update.DELETE:
+                    self.entities.pop(key, None)
+                else:
+                    self.entities[key] = update.entity.SerializeToString()
+                self.writes += 1
+        return p4runtime_pb2.WriteResponse()
+
+    def Read(self, request, context):
+        with self._lock:
+            stored = [p4runtime_pb2.Entity.FromString(v) for v in self.entities.values()]
+        response = p4runtime_pb2.ReadResponse()
+        for wanted in request.entities:
+            kind = wanted.WhichOneof('entity')
+            for entity in stored:
+                if entity.WhichOneof('entity') != kind:
+                    continue
+                if kind == 'table_entry':
+                    if entity.table_entry.is_default_action:
+                        continue
+                    if wanted.table_entry.table_id not in (0, entity.table_entry.table_id):
+                        continue
+                response.entities.add().CopyFrom(entity)
+        yield response
+
+    def SetForwardingPipelineConfig(self, request, context):
+        with self._lock:
+            self._checkPrimary(request, context)
+            self.config = request.config
+            self.entities.clear()
+        return p4runtime_pb2.SetForwardingPipelineConfigResponse()
+
+    def GetForwardingPipelineConfig(self, request, context):
+        response = p4runtime_pb2.GetForwardingPipelineConfigResponse()
+        if self.config is not None:
+            response.config.CopyFrom(self.config)
+        return response
+
+    def Capabilities(self, request, context):
+        return p4runtime_pb2.CapabilitiesResponse(p4runtime_api_version='stand-in')
+
+
+def serve(address, device_id=0, max_workers=16):
+    """
+    :return: (grpc server, the P4RuntimeStandIn)
+    """
+    standin = P4RuntimeStandIn(device_id)
+    # 每条StreamChannel占用一个工作线程
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    p4runtime_pb2_grpc.add_P4RuntimeServicer_to_server(standin, server)
+    server.add_insecure_port(address)
+    server.start()
+    return server, standin
+
+
+def main():
+    parser = argparse.ArgumentParser(description='In-memory P4Runtime stand-in')
+    parser.add_argument('--switches', help='number of devices to serve',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--host', help='address to listen on',
+                        type=str, action="store", required=False, default='127.0.0.1')
+    args = parser.parse_args()
+
+    servers = []
+    for i in range(args.switches):
+        address = '%s:%d' % (args.host, GRPC_BASE_PORT + i)
+        servers.append(serve(address, i))
+        print("device %d on %s" % (i, address))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server, _ in servers:
+            server.stop(0)
+
+
+if __name__ == '__main__':
+    main()
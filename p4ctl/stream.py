@@ -0,0 +1,268 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import grpc
+from p4.v1 import p4runtime_pb2
+
+from p4runtime_lib.convert import encode
+
+PACKET_IN = 'packet'
+DIGEST = 'digest'
+IDLE_TIMEOUT = 'idle_timeout_notification'
+
+
+class PacketIn(object):
+    """
+    解码后的packet-in消息：payload为原始报文，metadata为 {名字: 整数值}。
+    """
+    __slots__ = ('payload', 'metadata')
+
+    def __init__(self, payload, metadata):
+        self.payload = payload
+        self.metadata = metadata
+
+
+class StreamHandler(object):
+    """
+    在asyncio事件循环上接管每台交换机的StreamChannel，把packet-in、digest和
+    idle-timeout消息分发给注册的处理函数。
+
+    每台交换机有一个读线程(gRPC流迭代是阻塞的)和一个有界队列。队列满时读线程
+    阻塞在put上，不再从gRPC流中取消息，压力就通过HTTP/2流控传回交换机；
+    drop_when_full=True时改为丢弃并计数。消费协程每次尽量取出一批消息处理，
+    这一批里产生的digest确认在批末一起发送。
+    stop之后阻塞在put上的读线程每隔poll_interval醒来一次，发现已停止就退出。
+    """
+
+    def __init__(self, p4info_helper, queue_size=1024, batch_size=64,
+                 drop_when_full=False, auto_ack=True, poll_interval=0.1):
+        """
+        :param p4info_helper: the P4Info helper
+        :param queue_size: the per-switch event queue bound
+        :param batch_size: the max number of events dispatched per wakeup
+        :param drop_when_full: drop events instead of blocking the reader
+        :param auto_ack: acknowledge every digest list after dispatching it
+        :param poll_interval: how often a reader blocked on a full queue checks for stop
+        """
+        self.p4info_helper = p4info_helper
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.drop_when_full = drop_when_full
+        self.auto_ack = auto_ack
+        self.poll_interval = poll_interval
+        self.handlers = {PACKET_IN: [], DIGEST: [], IDLE_TIMEOUT: []}
+        self.switches = []
+        self.stats = {}
+        self._queues = {}
+        self._pending_acks = {}
+        self._tasks = []
+        self._threads = []
+        self._putting = set()
+        self._stopping = threading.Event()
+        self._packet_in_meta = None
+        self._packet_out_meta = None
+        self._loop = None
+
+    def addSwitch(self, sw):
+        """
+        交换机需已完成MasterArbitrationUpdate，之后流上的消息都归本对象处理。
+        start之后加入的交换机(可以在其他线程中调用)立即在事件循环上开始处理。
+        """
+        self.switches.append(sw)
+        self.stats[sw.name] = {PACKET_IN: 0, DIGEST: 0, IDLE_TIMEOUT: 0,
+                               'dropped': 0, 'errors': 0, 'max_depth': 0}
+        self._pending_acks[sw.name] = []
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._startSwitch, sw)
+
+    def onPacketIn(self, handler):
+        """
+        handler(sw, PacketIn)，可以是普通函数或协程函数。
+        """
+        self.handlers[PACKET_IN].append(handler)
+        return handler
+
+    def onDigest(self, handler):
+        """
+        handler(sw, DigestList)，可以是普通函数或协程函数。
+        """
+        self.handlers[DIGEST].append(handler)
+        return handler
+
+    def onIdleTimeout(self, handler):
+        """
+        handler(sw, IdleTimeoutNotification)，可以是普通函数或协程函数。
+        """
+        self.handlers[IDLE_TIMEOUT].append(handler)
+        return handler
+
+    def start(self):
+        """
+        在当前运行的事件循环上启动所有读线程和消费协程，返回消费协程列表。
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopping.clear()
+        for sw in self.switches:
+            self._startSwitch(sw)
+        return self._tasks
+
+    def _startSwitch(self, sw):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._queues[sw.name] = queue
+        self._tasks.append(self._loop.create_task(self._consume(sw, queue)))
+        t = threading.Thread(target=self._read, args=(sw, queue),
+                             name='%s-stream' % sw.name, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    async def run(self):
+        await asyncio.gather(*self.start())
+
+    def stop(self, timeout=1.0):
+        """
+        取消消费协程，发出未发送的digest确认，并唤醒、等待阻塞在队列put上的读线程。
+        阻塞在gRPC流上的读线程在连接关闭(ShutdownAllSwitchConnections)时退出。
+
+        :param timeout: seconds to wait for each blocked reader thread
+        """
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        for sw in self.switches:
+            self.flushDigestAcks(sw)
+        for t in list(self._putting):
+            t.join(timeout)
+
+    def _put(self, queue, item):
+        """
+        在读线程中把item放入队列，队列满时阻塞(背压)。
+
+        :return: False if the handler was stopped while waiting
+        """
+        self._putting.add(threading.current_thread())
+        try:
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), self._loop)
+            while True:
+                try:
+                    future.result(self.poll_interval)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if self._stopping.is_set():
+                        future.cancel()
+                        return False
+        finally:
+            self._putting.discard(threading.current_thread())
+
+    def _read(self, sw, queue):
+        loop = self._loop
+        try:
+            for msg in sw.stream_msg_resp:
+                if self._stopping.is_set():
+                    return
+                kind = msg.WhichOneof('update')
+                if kind == 'error':
+                    print("%s stream error: %s" % (sw.name, msg.error))
+                    continue
+                if kind not in self.handlers:
+                    continue
+                if self.drop_when_full:
+                    loop.call_soon_threadsafe(self._offer, sw, queue, kind, msg)
+                elif not self._put(queue, (kind, msg)):
+                    return
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.CANCELLED:
+                print("%s stream closed: %s" % (sw.name, e.details()))
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _offer(self, sw, queue, kind, msg):
+        try:
+            queue.put_nowait((kind, msg))
+        except asyncio.QueueFull:
+            self.stats[sw.name]['dropped'] += 1
+
+    async def _consume(self, sw, queue):
+        stats = self.stats[sw.name]
+        while True:
+            batch = [await queue.get()]
+            if queue.qsize() + 1 > stats['max_depth']:
+                stats['max_depth'] = queue.qsize() + 1
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            for kind, msg in batch:
+                stats[kind] += 1
+                await self._dispatch(sw, kind, msg)
+            self.flushDigestAcks(sw)
+
+    async def _dispatch(self, sw, kind, msg):
+        if kind == PACKET_IN:
+            event = self.decodePacketIn(msg.packet)
+        elif kind == DIGEST:
+            event = msg.digest
+        else:
+            event = msg.idle_timeout_notification
+        for handler in self.handlers[kind]:
+            try:
+                result = handler(sw, event)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                self.stats[sw.name]['errors'] += 1
+                print("%s %s handler failed: %r" % (sw.name, kind, e))
+        if kind == DIGEST and self.auto_ack:
+            self.ackDigest(sw, event)
+
+    def _controllerMetadata(self, name):
+        meta = {}
+        for cpm in self.p4info_helper.p4info.controller_packet_metadata:
+            if cpm.preamble.name == name:
+                for m in cpm.metadata:
+                    meta[m.id] = (m.name, m.bitwidth)
+        return meta
+
+    def decodePacketIn(self, packet):
+        if self._packet_in_meta is None:
+            self._packet_in_meta = self._controllerMetadata('packet_in')
+        metadata = {}
+        for m in packet.metadata:
+            name = self._packet_in_meta.get(m.metadata_id, (m.metadata_id,))[0]
+            metadata[name] = int.from_bytes(m.value, 'big')
+        return PacketIn(packet.payload, metadata)
+
+    def sendPacketOut(self, sw, payload, **metadata):
+        """
+        通过StreamChannel向交换机发送packet-out。
+
+        :param sw: the switch connection
+        :param payload: the raw packet bytes
+        :param metadata: packet_out header fields by name, e.g. egress_port=2
+        """
+        if self._packet_out_meta is None:
+            self._packet_out_meta = dict(
+                (name, (md_id, bitwidth)) for md_id, (name, bitwidth)
+                in self._controllerMetadata('packet_out').items())
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.packet.payload = payload
+        for name, value in metadata.items():
+            md_id, bitwidth = self._packet_out_meta[name]
+            md = request.packet.metadata.add()
+            md.metadata_id = md_id
+            md.value = encode(value, bitwidth)
+        sw.requests_stream.put(request)
+
+    def ackDigest(self, sw, digest):
+        """
+        记下一个待确认的digest list，在当前批次结束时统一发送。
+        """
+        self._pending_acks[sw.name].append((digest.digest_id, digest.list_id))
+
+    def flushDigestAcks(self, sw):
+        pending = self._pending_acks[sw.name]
+        for digest_id, list_id in pending:
+            request = p4runtime_pb2.StreamMessageRequest()
+            request.digest_ack.digest_id = digest_id
+            request.digest_ack.list_id = list_id
+            sw.requests_stream.put(request)
+        del pending[:]
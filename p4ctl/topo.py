@@ -0,0 +1,140 @@
+import json
+import os
+import re
+from collections import deque
+
+
+def loadTopology(topo_file_path):
+    """
+    读取topology.json。手写的拓扑文件里常有多余的尾随逗号，这里先去掉再解析。
+    """
+    with open(topo_file_path) as f:
+        text = f.read()
+    return json.loads(re.sub(r',(\s*[}\]])', r'\1', text))
+
+
+def loadRuntimeEntries(topo, topo_dir):
+    """
+    读取拓扑中每台交换机runtime_json文件里的table_entries。
+    """
+    rules = {}
+    for name, params in topo['switches'].items():
+        runtime_json = params.get('runtime_json')
+        if runtime_json:
+            with open(os.path.join(topo_dir, runtime_json)) as f:
+                rules[name] = json.load(f)['table_entries']
+    return rules
+
+
+def parseNode(node):
+    """
+    'sX-pY' -> ('sX', Y)；主机名没有端口，返回 (name, None)。
+    """
+    name, sep, port = node.partition('-p')
+    if sep and port.isdigit():
+        return name, int(port)
+    return node, None
+
+
+class Topology(object):
+    """
+    topology.json的图表示：
+      hosts:  {主机名: {'ip', 'prefix_len', 'mac', 'switch', 'port', 'gw', 'gw_mac'}}
+      ports:  {交换机: {相邻交换机: 本端端口}}
+    """
+
+    def __init__(self, topo=None):
+        self.switches = []
+        self.hosts = {}
+        self.ports = {}
+        self._bfs_cache = {}
+        if topo is not None:
+            for name in topo['switches']:
+                self.addSwitch(name)
+            for name, params in topo['hosts'].items():
+                self.hosts[name] = self._hostInfo(params)
+            for a, b in topo['links']:
+                self.addLink(a, b)
+
+    @classmethod
+    def fromFile(cls, topo_file_path):
+        return cls(loadTopology(topo_file_path))
+
+    @staticmethod
+    def _hostInfo(params):
+        ip, _, prefix_len = params['ip'].partition('/')
+        info = {'ip': ip, 'prefix_len': int(prefix_len or 32), 'mac': params['mac'],
+                'switch': None, 'port': None, 'gw': None, 'gw_mac': None}
+        for cmd in params.get('commands', []):
+            words = cmd.split()
+            if words[:4] == ['route', 'add', 'default', 'gw']:
+                info['gw'] = words[4]
+            elif words[:1] == ['arp'] and '-s' in words:
+                i = words.index('-s')
+                if words[i + 1] == info['gw'] or info['gw'] is None:
+                    info['gw_mac'] = words[i + 2]
+        return info
+
+    def addSwitch(self, name):
+        if name not in self.ports:
+            self.switches.append(name)
+            self.ports[name] = {}
+            self._bfs_cache.clear()
+
+    def addHost(self, name, params):
+        """
+        :param params: the host entry as written in topology.json
+        """
+        self.hosts[name] = self._hostInfo(params)
+
+    def addLink(self, a, b):
+        (na, pa), (nb, pb) = parseNode(a), parseNode(b)
+        if pa is None:
+            self.hosts[na]['switch'], self.hosts[na]['port'] = nb, pb
+        elif pb is None:
+            self.hosts[nb]['switch'], self.hosts[nb]['port'] = na, pa
+        else:
+            # 手写拓扑中重复列出的链路以第一次出现的为准
+            self.ports[na].setdefault(nb, pa)
+            self.ports[nb].setdefault(na, pb)
+            self._bfs_cache.clear()
+
+    def hostsOn(self, switch_name):
+        return [h for h, info in self.hosts.items() if info['switch'] == switch_name]
+
+    def edgeSwitches(self):
+        edges = set(info['switch'] for info in self.hosts.values())
+        return [s for s in self.switches if s in edges]
+
+    def _bfs(self, src):
+        parent = self._bfs_cache.get(src)
+        if parent is None:
+            parent = {src: None}
+            todo = deque([src])
+            while todo:
+                u = todo.popleft()
+                for v in self.ports[u]:
+                    if v not in parent:
+                        parent[v] = u
+                        todo.append(v)
+            self._bfs_cache[src] = parent
+        return parent
+
+    def path(self, src, dst):
+        """
+        src到dst的最短跳数路径。
+
+        :return: list of (switch, egress port towards the next switch), ending
+                 with (dst, None); None if dst is unreachable
+        """
+        parent = self._bfs(dst)
+        if src not in parent:
+            return None
+        hops = []
+        u = src
+        while u != dst:
+            nxt = parent[u]
+            hops.append((u, self.ports[u][nxt]))
+            u = nxt
+        hops.append((dst, None))
+        return hops
@@ -0,0 +1,420 @@
+"""
+生成k叉fat-tree和leaf-spine拓扑，输出格式与大作业/mrc下手写的拓扑相同：
+一个topology.json，加上每台交换机一个sX-runtime.json(basic.p4的ipv4_lpm和arp_exact)。
+
+地址规划：第n台接入交换机(从1开始编号)下挂子网 10.(n>>8).(n&255).0/24，
+其上第h台主机(从1开始)的地址为 .h、MAC为 08:00:00:NN:NN:HH；
+网关地址为 .254、MAC为 08:00:00:NN:NN:00。
+
+交换机按 接入 -> 汇聚 -> 核心(leaf-spine为 leaf -> spine) 的顺序编号，主机端口从1开始，
+上行端口紧随其后。路由为到每个子网的最短路径，存在多个等价下一跳时按子网编号轮流选择，
+使不同子网的流量分散到不同上行链路。
+
+备用配置(ipv4_lpm2、ipv4_lpm3，供p4ctl.failover切换)在默认配置的基础上再轮换一次
+等价下一跳，并各自隔离一部分交换机间链路(不经过它们)，没有等价路径的拓扑中
+也能绕开故障链路。
+
+命令行用法(在练习目录下运行，runtime_json路径相对于该目录)：
+    python -m p4ctl.topogen fattree --k 4 --out fattree-k4
+    python -m p4ctl.topogen leafspine --leaves 8 --spines 4 --hosts 4 --out leafspine-8x4
+给手写拓扑已有的runtime_json补上(或重新生成)备用配置，其他表项保持不变：
+    python -m p4ctl.topogen backup --topo triangle-topo/topology.json --classes 3
+"""
+import argparse
+import ipaddress
+import json
+import os
+from collections import deque
+
+from p4ctl.topo import Topology, loadTopology
+
+LPM_TABLES = ('MyIngress.ipv4_lpm', 'MyIngress.ipv4_lpm2', 'MyIngress.ipv4_lpm3')
+GATEWAY_HOST = 254
+
+
+def subnetPlan(n, h):
+    """
+    第n个子网中第h台主机的 (地址/前缀, MAC)；h为0时返回网关的 (地址, MAC)。
+    """
+    mac = '08:00:00:%02x:%02x:%02x' % (n >> 8, n & 0xff, h)
+    if h == 0:
+        return '10.%d.%d.%d' % (n >> 8, n & 0xff, GATEWAY_HOST), mac
+    return '10.%d.%d.%d/24' % (n >> 8, n & 0xff, h), mac
+
+
+class _Builder(object):
+
+    def __init__(self):
+        self.switches = []
+        self.hosts = {}
+        self.links = []
+        self.subnets = 0
+
+    def switch(self):
+        name = 's%d' % (len(self.switches) + 1)
+        self.switches.append(name)
+        return name
+
+    def link(self, a, port_a, b, port_b):
+        self.links.append(['%s-p%d' % (a, port_a), '%s-p%d' % (b, port_b)])
+
+    def attachHosts(self, switch_name, count):
+        if count > GATEWAY_HOST - 1:
+            raise ValueError("at most %d hosts per switch" % (GATEWAY_HOST - 1))
+        self.subnets += 1
+        gw, gw_mac = subnetPlan(self.subnets, 0)
+        for h in range(1, count + 1):
+            name = 'h%d' % (len(self.hosts) + 1)
+            ip, mac = subnetPlan(self.subnets, h)
+            self.hosts[name] = {
+                'ip': ip, 'mac': mac,
+                'commands': ['route add default gw %s dev eth0' % gw,
+                             'arp -i eth0 -s %s %s' % (gw, gw_mac)]}
+            self.links.append([name, '%s-p%d' % (switch_name, h)])
+
+    def topology(self, runtime_dir):
+        return {
+            'hosts': self.hosts,
+            'switches': dict((name, {'runtime_json': os.path.join(
+                runtime_dir, '%s-runtime.json' % name)}) for name in self.switches),
+            'links': self.links,
+        }
+
+
+def fatTree(k, runtime_dir='.'):
+    """
+    k叉fat-tree：k个pod，每个pod有k/2台接入和k/2台汇聚交换机，(k/2)^2台核心交换机，
+    每台接入交换机下挂k/2台主机。
+
+    :return: the topology.json dict
+    """
+    if k < 2 or k % 2:
+        raise ValueError("k must be an even number >= 2")
+    half = k // 2
+    b = _Builder()
+    edges = [[b.switch() for _ in range(half)] for _ in range(k)]
+    aggs = [[b.switch() for _ in range(half)] for _ in range(k)]
+    cores = [b.switch() for _ in range(half * half)]
+    for pod in range(k):
+        for e, edge in enumerate(edges[pod]):
+            b.attachHosts(edge, half)
+            for a, agg in enumerate(aggs[pod]):
+                b.link(edge, half + 1 + a, agg, 1 + e)
+        for a, agg in enumerate(aggs[pod]):
+            for c in range(half):
+                b.link(agg, half + 1 + c, cores[a * half + c], 1 + pod)
+    return b.topology(runtime_dir)
+
+
+def leafSpine(leaves, spines, hosts_per_leaf, runtime_dir='.'):
+    """
+    每台leaf连接全部spine，并下挂hosts_per_leaf台主机。
+
+    :return: the topology.json dict
+    """
+    b = _Builder()
+    leaf_names = [b.switch() for _ in range(leaves)]
+    spine_names = [b.switch() for _ in range(spines)]
+    for i, leaf in enumerate(leaf_names):
+        b.attachHosts(leaf, hosts_per_leaf)
+        for j, spine in enumerate(spine_names):
+            b.link(leaf, hosts_per_leaf + 1 + j, spine, 1 + i)
+    return b.topology(runtime_dir)
+
+
+def _distances(topology, src, isolated=()):
+    """
+    :param isolated: links not to use, as frozenset({switch a, switch b})
+    """
+    dist = {src: 0}
+    todo = deque([src])
+    while todo:
+        u = todo.popleft()
+        for v in topology.ports[u]:
+            if v not in dist and frozenset((u, v)) not in isolated:
+                dist[v] = dist[u] + 1
+                todo.append(v)
+    return dist
+
+
+def isolateLinks(topology, classes):
+    """
+    为每个备用配置选出其中隔离的交换机间链路：按顺序把每条链路分给第一个隔离它之后
+    带主机的交换机仍然连通的备用配置；分不出去的链路在所有配置中都会被使用，
+    它故障时没有可切换的配置。
+
+    :return: list of sets of frozenset({switch a, switch b}), one per table;
+             the default configuration isolates nothing
+    """
+    edges = sorted(set(info['switch'] for info in topology.hosts.values()
+                       if info['switch'] is not None))
+    isolated = [set() for _ in range(classes)]
+    if not edges:
+        return isolated
+    for a in topology.switches:
+        for b in topology.ports[a]:
+            if a >= b:
+                continue
+            link = frozenset((a, b))
+            for c in range(1, classes):
+                dist = _distances(topology, edges[0], isolated[c] | {link})
+                if all(e in dist for e in edges):
+                    isolated[c].add(link)
+                    break
+    return isolated
+
+
+def _entry(table, prefix, mac, port):
+    return {'table': table,
+            'match': {'hdr.ipv4.dstAddr': list(prefix)},
+            'action_name': 'MyIngress.ipv4_forward',
+            'action_params': {'dstAddr': mac, 'port': port}}
+
+
+def buildRuntime(topo, classes=1, p4info='build/basic.p4.p4info.txt',
+                 bmv2_json='build/basic.json'):
+    """
+    为topo中的每台交换机生成runtime.json内容。也适用于手写的拓扑：
+    子网取自主机的ip/前缀，下一跳MAC为目的子网的网关MAC(没有时用该子网第一台主机的MAC)。
+
+    :param topo: the topology.json dict
+    :param classes: how many of ipv4_lpm/ipv4_lpm2/ipv4_lpm3 to fill; each extra
+                    table rotates the choice among equal-cost next hops by one and
+                    avoids the links isolateLinks assigns to it
+    :return: {switch name: runtime.json dict}
+    """
+    topology = Topology(topo)
+    tables = LPM_TABLES[:classes]
+    isolated = isolateLinks(topology, classes)
+    runtimes = {}
+    for name in topology.switches:
+        entries = [{'table': t, 'default_action': True,
+                    'action_name': 'MyIngress.drop', 'action_params': {}} for t in tables]
+        runtimes[name] = {'target': 'bmv2', 'p4info': p4info, 'bmv2_json': bmv2_json,
+                          'table_entries': entries}
+
+    subnets = {}
+    for info in topology.hosts.values():
+        net = ipaddress.ip_interface('%s/%d' % (info['ip'], info['prefix_len'])).network
+        subnet = subnets.setdefault((info['switch'], net), {
+            'switch': info['switch'], 'prefix': (str(net.network_address), net.prefixlen),
+            'gw': info['gw'], 'gw_mac': info['gw_mac'] or info['mac'], 'hosts': []})
+        subnet['hosts'].append(info)
+
+    for n, subnet in enumerate(subnets.values()):
+        edge = subnet['switch']
+        entries = runtimes[edge]['table_entries']
+        for t in tables:
+            for info in subnet['hosts']:
+                entries.append(_entry(t, (info['ip'], 32), info['mac'], info['port']))
+        if subnet['gw'] is not None:
+            entries.append({'table': 'MyIngress.arp_exact',
+                            'match': {'hdr.arp.oper': [1],
+                                      'hdr.arp_ipv4.tpa': [subnet['gw'], 32]},
+                            'action_name': 'MyIngress.send_arp_reply',
+                            'action_params': {'dstAddr': subnet['gw_mac']}})
+        for c, t in enumerate(tables):
+            dist = _distances(topology, edge, isolated[c])
+            for sw in topology.switches:
+                if sw == edge or sw not in dist:
+                    continue
+                ports = sorted(p for v, p in topology.ports[sw].items()
+                               if dist.get(v) == dist[sw] - 1
+                               and frozenset((sw, v)) not in isolated[c])
+                runtimes[sw]['table_entries'].append(
+                    _entry(t, subnet['prefix'], subnet['gw_mac'], ports[(n + c) % len(ports)]))
+    return runtimes
+
+
+def addBackupRoutes(topo, runtimes, classes=3):
+    """
+    用buildRuntime生成的ipv4_lpm2/ipv4_lpm3表项替换runtimes中这些表原有的表项，
+    其他表(包括手写的ipv4_lpm和arp_exact)保持不变。
+
+    :param runtimes: {switch name: runtime.json dict}, modified in place
+    """
+    backup = LPM_TABLES[1:classes]
+    generated = buildRuntime(topo, classes)
+    for name, runtime in runtimes.items():
+        entries = [e for e in runtime['table_entries'] if e['table'] not in LPM_TABLES[1:]]
+        entries.extend(e for e in generated[name]['table_entries'] if e['table'] in backup)
+        runtime['table_entries'] = entries
+    return runtimes
+
+
+def buildFib(rules, table='MyIngress.ipv4_lpm'):
+    """
+    :param rules: {switch name: table_entries}
+    :return: the ipv4_forward routes of table on each switch, for lookupRoute
+    """
+    fib = {}
+    for sw, entries in rules.items():
+        routes = {}
+        for e in entries:
+            if e['table'] == table and 'match' in e:
+                addr, prefix_len = e['match']['hdr.ipv4.dstAddr']
+                routes[(int(ipaddress.IPv4Address(addr)), prefix_len)] = (
+                    e['action_params']['dstAddr'], e['action_params']['port'])
+        fib[sw] = (routes, sorted(set(p for _, p in routes), reverse=True))
+    return fib
+
+
+def lookupRoute(fib, sw, ip):
+    """
+    在buildFib的结果中做最长前缀匹配。
+
+    :param ip: the destination address as an int
+    :return: (next hop MAC, egress port) or None
+    """
+    routes, prefix_lens = fib.get(sw, ({}, []))
+    for prefix_len in prefix_lens:
+        mask = (0xffffffff << (32 - prefix_len)) & 0xffffffff
+        hop = routes.get((ip & mask, prefix_len))
+        if hop is not None:
+            return hop
+    return None
+
+
+def verifyRuntime(topo, runtimes, table='MyIngress.ipv4_lpm'):
+    """
+    离线验证：对每一对主机，从源主机所在交换机出发按table做最长前缀匹配逐跳转发，
+    检查报文最终从目的主机的端口、以目的主机的MAC送出，且没有环路和黑洞。
+    同一(交换机, 目的主机)的结果会被缓存，开销与 交换机数 x 主机数 成正比。
+
+    :return: (number of host pairs checked, [(src, dst, reason), ...])
+    """
+    topology = Topology(topo)
+    neighbours = dict((sw, dict((p, v) for v, p in topology.ports[sw].items()))
+                      for sw in topology.switches)
+    host_at = dict(((info['switch'], info['port']), h) for h, info in topology.hosts.items())
+    fib = buildFib(dict((sw, r['table_entries']) for sw, r in runtimes.items()), table)
+
+    resolved = {}
+    failures = []
+    pairs = 0
+    for dst, dinfo in topology.hosts.items():
+        ip = int(ipaddress.IPv4Address(dinfo['ip']))
+        for src, sinfo in topology.hosts.items():
+            if src == dst:
+                continue
+            pairs += 1
+            sw = sinfo['switch']
+            trail, seen = [], set()
+            while (sw, dst) not in resolved:
+                if sw in seen:
+                    reason = 'loop at %s' % sw
+                    break
+                trail.append(sw)
+                seen.add(sw)
+                hop = lookupRoute(fib, sw, ip)
+                if hop is None:
+                    reason = 'no route on %s' % sw
+                    break
+                mac, port = hop
+                if (sw, port) in host_at:
+                    if host_at[(sw, port)] != dst:
+                        reason = 'delivered to %s by %s' % (host_at[(sw, port)], sw)
+                    elif mac != dinfo['mac']:
+                        reason = 'wrong MAC %s from %s' % (mac, sw)
+                    else:
+                        reason = None
+                    break
+                if port not in neighbours[sw]:
+                    reason = '%s port %d is not connected' % (sw, port)
+                    break
+                sw = neighbours[sw][port]
+            else:
+                reason = resolved[(sw, dst)]
+            for s in trail:
+                resolved[(s, dst)] = reason
+            if reason is not None:
+                failures.append((src, dst, reason))
+    return pairs, failures
+
+
+def writeTopology(out_dir, topo, runtimes):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'topology.json'), 'w') as f:
+        json.dump(topo, f, indent=4)
+    for name, runtime in runtimes.items():
+        with open(os.path.join(out_dir, '%s-runtime.json' % name), 'w') as f:
+            json.dump(runtime, f, indent=2)
+
+
+def dumpRuntime(runtime, f):
+    """
+    按手写sX-runtime.json的排版写出：每个表项一个对象，匹配域和动作参数各占一行。
+    """
+    def field(indent, key, value):
+        if not isinstance(value, dict):
+            return '%s%s: %s' % (indent, json.dumps(key), json.dumps(value))
+        if not value:
+            return '%s%s: { }' % (indent, json.dumps(key))
+        return '%s%s: {\n%s\n%s}' % (indent, json.dumps(key), ',\n'.join(
+            field(indent + '  ', k, v) for k, v in value.items()), indent)
+
+    lines = [field('  ', k, v) + ',' for k, v in runtime.items() if k != 'table_entries']
+    entries = ['    {\n%s\n    }' % ',\n'.join(field('      ', k, v) for k, v in e.items())
+               for e in runtime['table_entries']]
+    f.write('{\n%s\n  "table_entries": [\n%s\n  ]\n}\n' % (
+        '\n'.join(lines), ',\n'.join(entries)))
+
+
+def backupMain(topo_file_path, classes):
+    topo = loadTopology(topo_file_path)
+    runtimes = {}
+    for name, params in topo['switches'].items():
+        with open(params['runtime_json']) as f:
+            runtimes[name] = json.load(f)
+    addBackupRoutes(topo, runtimes, classes)
+    for table in LPM_TABLES[:classes]:
+        pairs, failures = verifyRuntime(topo, runtimes, table)
+        print("%s: %d/%d host pairs reachable" % (table, pairs - len(failures), pairs))
+    for name, params in topo['switches'].items():
+        with open(params['runtime_json'], 'w') as f:
+            dumpRuntime(runtimes[name], f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fat-tree / leaf-spine topology generator')
+    parser.add_argument('kind', choices=['fattree', 'leafspine', 'backup'])
+    parser.add_argument('--out', help='output directory, relative to the exercise directory',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--topo', help='hand-written topology.json to add backup routes to',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--k', help='fat-tree arity',
+                        type=int, action="store", required=False, default=4)
+    parser.add_argument('--leaves', help='leaf switches',
+                        type=int, action="store", required=False, default=4)
+    parser.add_argument('--spines', help='spine switches',
+                        type=int, action="store", required=False, default=2)
+    parser.add_argument('--hosts', help='hosts per leaf',
+                        type=int, action="store", required=False, default=2)
+    parser.add_argument('--classes', help='number of ipv4_lpm tables to fill (1-3)',
+                        type=int, choices=[1, 2, 3], action="store", required=False, default=1)
+    args = parser.parse_args()
+
+    if args.kind == 'backup':
+        if args.topo is None:
+            parser.error('backup needs --topo')
+        backupMain(args.topo, args.classes)
+        return
+    if args.out is None:
+        parser.error('%s needs --out' % args.kind)
+    if args.kind == 'fattree':
+        topo = fatTree(args.k, args.out)
+    else:
+        topo = leafSpine(args.leaves, args.spines, args.hosts, args.out)
+    runtimes = buildRuntime(topo, args.classes)
+    pairs, failures = verifyRuntime(topo, runtimes)
+    for src, dst, reason in failures[:10]:
+        print("%s -> %s: %s" % (src, dst, reason))
+    writeTopology(args.out, topo, runtimes)
+    print("Wrote %d switches, %d hosts, %d table entries to %s; %d/%d host pairs reachable" % (
+        len(topo['switches']), len(topo['hosts']),
+        sum(len(r['table_entries']) for r in runtimes.values()), args.out,
+        pairs - len(failures), pairs))
+
+
+if __name__ == '__main__':
+    main()
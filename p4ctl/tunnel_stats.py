@@ -0,0 +1,240 @@
+"""
+隧道计数器核算：把每条隧道在入口交换机的ingressTunnelCounter和出口交换机的
+egressTunnelCounter配对，计算滑动窗口内的吞吐量和网内丢包率。
+
+每次采样对每台交换机的每个计数器只发一次Read(同一请求里带上所有相关隧道ID)，
+所有Read同时发出，采样时刻取各RPC中点的平均值，各RPC最早开始到最晚结束的
+间隔记为采样偏差(skew)；偏差内正在隧道中传输的报文会表现为很小的丢包。
+所有隧道的计数放在一组向量里，窗口统计一次算完；装有NumPy时用NumPy数组。
+"""
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from p4ctl.externs import readCounterCells
+
+INGRESS_COUNTER = 'MyIngress.ingressTunnelCounter'
+EGRESS_COUNTER = 'MyIngress.egressTunnelCounter'
+
+
+def _vector(values):
+    if np is not None:
+        return np.frombuffer(values, dtype=np.uint64).astype(np.float64)
+    return array('d', values)
+
+
+def _sub(a, b):
+    if np is not None:
+        return a - b
+    return array('d', (x - y for x, y in zip(a, b)))
+
+
+def _loss(sent, received):
+    if np is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(sent > 0, np.clip(1.0 - received / sent, 0.0, 1.0), 0.0)
+    return array('d', (min(1.0, max(0.0, 1.0 - r / s)) if s > 0 else 0.0
+                       for s, r in zip(sent, received)))
+
+
+class TunnelSnapshot(object):
+    """
+    一次采样：各向量按TunnelAccounting.tunnels的顺序排列。
+    """
+    __slots__ = ('time', 'skew', 'in_packets', 'in_bytes', 'out_packets', 'out_bytes')
+
+    def __init__(self, time, skew, in_packets, in_bytes, out_packets, out_bytes):
+        self.time = time
+        self.skew = skew
+        self.in_packets = in_packets
+        self.in_bytes = in_bytes
+        self.out_packets = out_packets
+        self.out_bytes = out_bytes
+
+
+class WindowStats(object):
+    """
+    窗口内每条隧道的发送/到达报文数、吞吐量(字节/秒)和丢包率。
+    """
+    __slots__ = ('seconds', 'sent', 'received', 'offered', 'throughput', 'loss')
+
+    def __init__(self, first, last):
+        self.seconds = last.time - first.time
+        self.sent = _sub(last.in_packets, first.in_packets)
+        self.received = _sub(last.out_packets, first.out_packets)
+        if np is not None:
+            self.offered = (last.in_bytes - first.in_bytes) / self.seconds
+            self.throughput = (last.out_bytes - first.out_bytes) / self.seconds
+        else:
+            self.offered = array('d', (b / self.seconds for b in
+                                       _sub(last.in_bytes, first.in_bytes)))
+            self.throughput = array('d', (b / self.seconds for b in
+                                          _sub(last.out_bytes, first.out_bytes)))
+        self.loss = _loss(self.sent, self.received)
+
+
+class TunnelAccounting(object):
+    """
+    周期调用poll采样；保留最近window+1次采样，窗口统计用第一次和最后一次之差。
+    丢包率超过loss_threshold(且窗口内至少发送了min_packets个报文)时告警一次，
+    降到阈值一半以下时解除。
+    poll和printReport作为周期任务可能在不同线程中同时运行，history、tunnels和alarms
+    由self._lock保护；读计数器的RPC在锁外进行。
+    """
+
+    def __init__(self, manager, connection, p4info_helper, window=4, loss_threshold=0.05,
+                 min_packets=20, on_alert=None):
+        """
+        :param manager: the TunnelManager whose tunnels are accounted
+        :param connection: connection(switch name) -> switch connection
+        :param window: the number of poll intervals in the sliding window
+        :param on_alert: on_alert(tunnel, loss, cleared); by default alerts are printed
+        """
+        self.manager = manager
+        self.connection = connection
+        self.p4info_helper = p4info_helper
+        self.loss_threshold = loss_threshold
+        self.min_packets = min_packets
+        self.on_alert = on_alert or self._printAlert
+        self.tunnels = []
+        self.history = deque(maxlen=window + 1)
+        self.alarms = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._workers = 0
+
+    def _reads(self):
+        """
+        :return: [(switch, counter name, tunnel ids, positions in self.tunnels)]
+        """
+        groups = {}
+        for i, t in enumerate(self.tunnels):
+            for key in ((t.src, INGRESS_COUNTER), (t.dst, EGRESS_COUNTER)):
+                ids, positions = groups.setdefault(key, ([], []))
+                ids.append(t.tunnel_id)
+                positions.append(i)
+        return [(sw, counter, ids, positions) for (sw, counter), (ids, positions) in groups.items()]
+
+    def _timedRead(self, sw_name, counter, ids):
+        start = time.perf_counter()
+        packets, byte_counts = readCounterCells(self.connection(sw_name), self.p4info_helper,
+                                                counter, ids)
+        return start, time.perf_counter(), packets, byte_counts
+
+    def snapshot(self):
+        """
+        并发读出所有隧道的两端计数器。
+
+        :return: a TunnelSnapshot
+        """
+        reads = self._reads()
+        if self._workers < len(reads):
+            # 每个Read一个线程，保证所有Read同时发出
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=len(reads))
+            self._workers = len(reads)
+        futures = [self._executor.submit(self._timedRead, sw, counter, ids)
+                   for sw, counter, ids, _ in reads]
+        n = len(self.tunnels)
+        vectors = dict((name, array('Q', bytes(8 * n))) for name in
+                       ('in_packets', 'in_bytes', 'out_packets', 'out_bytes'))
+        starts, ends = [], []
+        for (sw, counter, ids, positions), future in zip(reads, futures):
+            start, end, packets, byte_counts = future.result()
+            starts.append(start)
+            ends.append(end)
+            prefix = 'in_' if counter == INGRESS_COUNTER else 'out_'
+            for i, p, b in zip(positions, packets, byte_counts):
+                vectors[prefix + 'packets'][i] = p
+                vectors[prefix + 'bytes'][i] = b
+        now = sum(s + e for s, e in zip(starts, ends)) / (2.0 * len(starts)) if starts \
+            else time.perf_counter()
+        skew = max(ends) - min(starts) if starts else 0.0
+        return TunnelSnapshot(now, skew, *(_vector(vectors[name]) for name in
+                                           ('in_packets', 'in_bytes', 'out_packets', 'out_bytes')))
+
+    def poll(self, runtime=None):
+        """
+        采样一次并检查告警；可直接作为ControllerRuntime的周期任务。
+        """
+        tunnels = sorted(self.manager.tunnels.values(), key=lambda t: t.tunnel_id)
+        if len(tunnels) != len(self.tunnels) or \
+                any(a is not b for a, b in zip(tunnels, self.tunnels)):
+            # 隧道集合变化后向量的排列不同，重新开始计窗口。IdAllocator会复用空出的ID，
+            # 所以按隧道对象比较，已删除隧道的告警也不能留给复用其ID的新隧道
+            kept = set(id(t) for t in self.tunnels)
+            with self._lock:
+                self.tunnels = tunnels
+                self.history.clear()
+                self.alarms &= set(t.tunnel_id for t in tunnels if id(t) in kept)
+        # 只有poll修改self.tunnels，采样时不必持锁
+        snapshot = self.snapshot()
+        alerts = []
+        with self._lock:
+            self.history.append(snapshot)
+            stats = self._window()
+            if stats is None:
+                return
+            for i, tunnel in enumerate(self.tunnels):
+                loss = stats.loss[i]
+                key = tunnel.tunnel_id
+                if key not in self.alarms:
+                    if stats.sent[i] >= self.min_packets and loss > self.loss_threshold:
+                        self.alarms.add(key)
+                        alerts.append((tunnel, float(loss), False))
+                elif loss < self.loss_threshold / 2:
+                    self.alarms.discard(key)
+                    alerts.append((tunnel, float(loss), True))
+        for alert in alerts:
+            self.on_alert(*alert)
+
+    def _window(self):
+        # 调用方持有self._lock
+        if len(self.history) < 2:
+            return None
+        return WindowStats(self.history[0], self.history[-1])
+
+    def window(self):
+        """
+        :return: the WindowStats over the retained history, None before two polls
+        """
+        with self._lock:
+            return self._window()
+
+    @staticmethod
+    def _printAlert(tunnel, loss, cleared):
+        if cleared:
+            print("Tunnel %d %s -> %s (%s): loss back to %.1f%%" % (
+                tunnel.tunnel_id, tunnel.src, tunnel.dst, tunnel.host, loss * 100))
+        else:
+            print("ALERT tunnel %d %s -> %s (%s): %.1f%% of packets lost in the fabric" % (
+                tunnel.tunnel_id, tunnel.src, tunnel.dst, tunnel.host, loss * 100))
+
+    def printReport(self, runtime=None):
+        with self._lock:
+            stats = self._window()
+            if stats is None:
+                return
+            skew = self.history[-1].skew
+            tunnels = list(self.tunnels)
+            alarms = set(self.alarms)
+        print('\n----- Tunnels over the last %.1fs (read skew %.1fms) -----' % (
+            stats.seconds, skew * 1e3))
+        for i, t in enumerate(tunnels):
+            print("%5d %-4s -> %-4s %-4s sent=%-7d recv=%-7d offered=%9.0fB/s "
+                  "delivered=%9.0fB/s loss=%5.1f%%%s" % (
+                      t.tunnel_id, t.src, t.dst, t.host, stats.sent[i], stats.received[i],
+                      stats.offered[i], stats.throughput[i], stats.loss[i] * 100,
+                      ' ALERT' if t.tunnel_id in alarms else ''))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,179 @@
+import heapq
+
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.batch import DEFAULT_BATCH_SIZE, writeTableEntries
+
+
+class IdAllocator(object):
+    """
+    紧凑的ID分配器：总是分配当前最小的空闲ID，释放的ID优先复用。
+    """
+
+    def __init__(self, first=1, last=0xffff):
+        self.first = first
+        self.last = last
+        self._next = first
+        self._free = []
+
+    def allocate(self):
+        if self._free:
+            return heapq.heappop(self._free)
+        if self._next > self.last:
+            raise RuntimeError("tunnel IDs %d..%d exhausted" % (self.first, self.last))
+        self._next += 1
+        return self._next - 1
+
+    def release(self, tunnel_id):
+        heapq.heappush(self._free, tunnel_id)
+
+    def __len__(self):
+        return self._next - self.first - len(self._free)
+
+
+class Tunnel(object):
+    __slots__ = ('tunnel_id', 'src', 'host', 'path')
+
+    def __init__(self, tunnel_id, src, host, path):
+        self.tunnel_id = tunnel_id
+        self.src = src
+        self.host = host
+        self.path = path
+
+    @property
+    def dst(self):
+        return self.path[-1][0]
+
+
+class TunnelManager(object):
+    """
+    为每个 (入口交换机, 目的主机) 建一条隧道，在路径上的每台交换机安装规则：
+    1) 入口交换机ipv4_lpm表中的隧道入口规则(myTunnel_ingress)；
+    2) 路径上除最后一台外每台交换机myTunnel_exact表中的转发规则(myTunnel_forward)；
+    3) 出口交换机myTunnel_exact表中的隧道出口规则(myTunnel_egress)。
+    同一交换机上的主机之间不走隧道，直接用ipv4_forward转发。
+
+    已安装的隧道不会重算：新增边缘交换机时只安装与它有关的O(N)条新隧道。
+    """
+
+    def __init__(self, p4info_helper, topology, connection, allocator=None,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param p4info_helper: the P4Info helper
+        :param topology: the p4ctl.topo.Topology
+        :param connection: connection(switch name) -> switch connection
+        :param allocator: the tunnel ID allocator (myTunnel.dst_id is 16 bits)
+        """
+        self.p4info_helper = p4info_helper
+        self.topology = topology
+        self.connection = connection
+        self.allocator = allocator or IdAllocator()
+        self.batch_size = batch_size
+        self.tunnels = {}
+        self._local = set()
+
+    def _buildTunnel(self, src, host, entries):
+        info = self.topology.hosts[host]
+        path = self.topology.path(src, info['switch'])
+        if path is None:
+            print("No path from %s to %s, skipping tunnel" % (src, host))
+            return None
+        tunnel = Tunnel(self.allocator.allocate(), src, host, path)
+        for sw_name, port in path[:-1]:
+            entries['transit'].setdefault(sw_name, []).append(
+                self.p4info_helper.buildTableEntry(
+                    table_name="MyIngress.myTunnel_exact",
+                    match_fields={"hdr.myTunnel.dst_id": tunnel.tunnel_id},
+                    action_name="MyIngress.myTunnel_forward",
+                    action_params={"port": port}))
+        entries['transit'].setdefault(tunnel.dst, []).append(
+            self.p4info_helper.buildTableEntry(
+                table_name="MyIngress.myTunnel_exact",
+                match_fields={"hdr.myTunnel.dst_id": tunnel.tunnel_id},
+                action_name="MyIngress.myTunnel_egress",
+                action_params={"dstAddr": info['mac'], "port": info['port']}))
+        entries['ingress'].setdefault(src, []).append(
+            self.p4info_helper.buildTableEntry(
+                table_name="MyIngress.ipv4_lpm",
+                match_fields={"hdr.ipv4.dstAddr": (info['ip'], 32)},
+                action_name="MyIngress.myTunnel_ingress",
+                action_params={"dst_id": tunnel.tunnel_id}))
+        return tunnel
+
+    def _buildLocal(self, host, entries):
+        info = self.topology.hosts[host]
+        entries['ingress'].setdefault(info['switch'], []).append(
+            self.p4info_helper.buildTableEntry(
+                table_name="MyIngress.ipv4_lpm",
+                match_fields={"hdr.ipv4.dstAddr": (info['ip'], 32)},
+                action_name="MyIngress.ipv4_forward",
+                action_params={"dstAddr": info['mac'], "port": info['port']}))
+
+    def _install(self, pairs):
+        """
+        ID先暂时分配，所有规则写入成功后才记入tunnels和_local。写入失败时删除
+        已写入的规则、释放这些ID，然后重新抛出异常，管理器的状态与交换机一致。
+        """
+        entries = {'transit': {}, 'ingress': {}}
+        new = []
+        local = set()
+        written = []
+        try:
+            for src, host in pairs:
+                if (src, host) in self.tunnels or (src, host) in self._local:
+                    continue
+                if self.topology.hosts[host]['switch'] == src:
+                    if (src, host) not in local:
+                        self._buildLocal(host, entries)
+                        local.add((src, host))
+                    continue
+                tunnel = self._buildTunnel(src, host, entries)
+                if tunnel is not None:
+                    new.append(tunnel)
+            # 先装转发和出口规则，再装入口规则，避免流量进入还没建好的隧道
+            for stage in ('transit', 'ingress'):
+                for sw_name, sw_entries in entries[stage].items():
+                    # 一台交换机的规则可能分多批写入，失败时也要清理已写入的批次
+                    written.append((sw_name, sw_entries))
+                    writeTableEntries(self.connection(sw_name), sw_entries, self.batch_size)
+        except Exception:
+            self._rollback(written)
+            for tunnel in new:
+                self.allocator.release(tunnel.tunnel_id)
+            raise
+        self._local.update(local)
+        for tunnel in new:
+            self.tunnels[(tunnel.src, tunnel.host)] = tunnel
+        print("Installed %d tunnels" % len(new))
+        return new
+
+    def _rollback(self, written):
+        # 入口规则后写，先删，与安装顺序相反
+        for sw_name, sw_entries in reversed(written):
+            try:
+                writeTableEntries(self.connection(sw_name), sw_entries, self.batch_size,
+                                  p4runtime_pb2.Update.DELETE)
+            except Exception as e:
+                print("Could not remove the tunnel rules written to %s: %s" % (sw_name, e))
+
+    def provision(self):
+        """
+        在所有边缘交换机之间建立全互联隧道(已存在的跳过)。
+        """
+        return self._install((src, host) for src in self.topology.edgeSwitches()
+                             for host in self.topology.hosts)
+
+    def addEdgeSwitch(self, switch_name):
+        """
+        拓扑中已加入switch_name及其主机和链路后调用，只安装进出它的隧道。
+        connection(switch_name)必须能返回它的连接；使用ControllerRuntime时先调用
+        runtime.addSwitch(switch_name)。
+        """
+        local_hosts = self.topology.hostsOn(switch_name)
+        pairs = [(switch_name, host) for host in self.topology.hosts]
+        pairs += [(src, host) for src in self.topology.edgeSwitches()
+                  if src != switch_name for host in local_hosts]
+        return self._install(pairs)
+
+    def tunnelsFrom(self, switch_name):
+        return [t for t in self.tunnels.values() if t.src == switch_name]
@@ -0,0 +1,60 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 与各练习的控制器相同：tutorials/utils在本仓库的上一级目录
+sys.path.append(os.path.join(ROOT, '../utils/'))
+sys.path.insert(0, ROOT)
+
+# 一份basic.p4的P4Info，只用于测试解析和缓存
+P4INFO = os.path.join(ROOT, 'tests', 'data', 'basic.p4.p4info.txt')
+
+
+class StandInSwitch(object):
+    """
+    连接p4ctl.standin替身的最小交换机连接：只有channel、client_stub、device_id和
+    election_id，足够batch、snapshot等直接发RPC的函数使用。创建时完成仲裁。
+    """
+
+    def __init__(self, address, device_id=0, election_id=1, name='s1'):
+        import queue
+
+        import grpc
+        from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+        self.name = name
+        self.device_id = device_id
+        self.election_id = election_id
+        self.channel = grpc.insecure_channel(address)
+        self.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(self.channel)
+        self.requests = queue.Queue()
+        self.stream_msg_resp = self.client_stub.StreamChannel(iter(self.requests.get, None))
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.arbitration.device_id = device_id
+        request.arbitration.election_id.high = election_id >> 64
+        request.arbitration.election_id.low = election_id & 0xffffffffffffffff
+        self.requests.put(request)
+        self.arbitration = next(self.stream_msg_resp).arbitration
+
+    def close(self):
+        self.requests.put(None)
+        self.channel.close()
+
+
+def startStandIn(device_id=0):
+    """
+    :return: (grpc server, the P4RuntimeStandIn, address)
+    """
+    from concurrent import futures
+
+    import grpc
+    from p4.v1 import p4runtime_pb2_grpc
+
+    from p4ctl.standin import P4RuntimeStandIn
+
+    standin = P4RuntimeStandIn(device_id)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=8))
+    p4runtime_pb2_grpc.add_P4RuntimeServicer_to_server(standin, server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    return server, standin, '127.0.0.1:%d' % port
@@ -0,0 +1,127 @@
+import importlib.util
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+import pytest
+
+from conftest import ROOT
+
+spec = importlib.util.spec_from_file_location(
+    'agent', os.path.join(ROOT, '大作业', 'mrc', 'agent.py'))
+agent = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(agent)
+
+
+def onesComplement(data):
+    """
+    按RFC 1071以网络字节序逐字求和，结果为0xffff说明校验和正确。
+    """
+    if len(data) % 2:
+        data += b'\0'
+    s = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    while s >> 16:
+        s = (s >> 16) + (s & 0xffff)
+    return s
+
+
+def test_checksum_known_ipv4_header():
+    header = bytes.fromhex('450000730000400040110000c0a80001c0a800c7')
+    assert agent._checksum(header) == bytes.fromhex('b861')
+
+
+def test_checksum_odd_length():
+    data = b'\x01\x02\x03'
+    csum = agent._checksum(data)
+    assert onesComplement(data + b'\0' + csum) == 0xffff
+
+
+def makeAgent():
+    # 不打开原始套接字，只测试报文构造
+    a = object.__new__(agent.PacketAgent)
+    a.src_mac = bytes.fromhex('080000000111')
+    a.src_ip = socket.inet_aton('10.0.1.1')
+    a.lock = threading.Lock()
+    a.cond = threading.Condition(a.lock)
+    a.ip_id = 0
+    return a
+
+
+@pytest.mark.parametrize('proto', ['tcp', 'udp'])
+def test_built_packets_have_valid_checksums(proto):
+    a = makeAgent()
+    eth, ip_args, l4 = a.buildPacket({'dst': '10.0.2.2', 'proto': proto, 'sport': 4000,
+                                      'dport': 1234, 'tos': 4, 'payload': 'hello'})
+    ip = a._ipHeader(ip_args, len(l4))
+    assert onesComplement(ip) == 0xffff
+    assert ip[1] == 4 and ip[9] == agent.PROTOCOLS[proto]
+    pseudo = ip[12:20] + struct.pack('!BBH', 0, agent.PROTOCOLS[proto], len(l4))
+    assert onesComplement(pseudo + l4) == 0xffff
+    assert struct.unpack_from('!HH', l4) == (4000, 1234)
+    assert eth[:6] == b'\xff' * 6 and eth[12:14] == b'\x08\x00'
+
+
+def test_ip_id_increments():
+    a = makeAgent()
+    ip_args = (0, 64, 6, socket.inet_aton('10.0.2.2'))
+    ids = [struct.unpack_from('!H', a._ipHeader(ip_args, 20), 4)[0] for _ in range(3)]
+    assert ids == [1, 2, 3]
+
+
+def udpFrame(options=b''):
+    ihl = 5 + len(options) // 4
+    ip = struct.pack('!BBHHHBBH4s4s', 0x40 | ihl, 4, 20 + len(options) + 8, 9, 0, 63, 17, 0,
+                     socket.inet_aton('10.0.1.1'), socket.inet_aton('10.0.2.2')) + options
+    return b'\xff' * 6 + b'\x08' * 6 + b'\x08\x00' + ip + struct.pack('!HHHH', 4000, 1234, 8, 0)
+
+
+@pytest.mark.parametrize('options', [b'', b'\x01' * 8])
+def test_parse_ipv4_reads_ports_after_options(options):
+    packet = agent._parseIpv4(udpFrame(options))
+    assert (packet['src'], packet['dst'], packet['proto']) == ('10.0.1.1', '10.0.2.2', 17)
+    assert (packet['sport'], packet['dport']) == (4000, 1234)
+    assert (packet['tos'], packet['ttl'], packet['id']) == (4, 63, 9)
+
+
+def test_parse_ipv4_ignores_non_ip_and_short_l4():
+    assert agent._parseIpv4(b'\xff' * 12 + b'\x08\x06' + b'\0' * 28) is None
+    # L4头被截断时不给出端口
+    packet = agent._parseIpv4(udpFrame(b'\x01' * 8)[:14 + 28 + 2])
+    assert packet['sport'] is None and packet['dport'] is None
+
+
+def test_socket_path_uses_host_name():
+    assert agent.socketPath('h1') == '/tmp/p4agent-h1.sock'
+    assert agent.socketPath('h1') != agent.socketPath('h2')
+
+
+class FailingAgent(object):
+    def handle(self, request):
+        if request.get('cmd') == 'send':
+            # 例如count传成字符串时range()抛出的TypeError
+            raise TypeError("'str' object cannot be interpreted as an integer")
+        return {'ok': True}
+
+
+def test_bad_command_keeps_connection(tmp_path):
+    path = str(tmp_path / 'agent.sock')
+    server = socketserver.ThreadingUnixStreamServer(path, agent._Handler)
+    server.daemon_threads = True
+    server.agent = FailingAgent()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = agent.AgentClient(path)
+        with pytest.raises(RuntimeError, match='TypeError'):
+            client.send('10.0.2.2', count='many')
+        # 同一条连接仍然可用
+        assert client.call('stats') == {'ok': True}
+        client.f.write(b'[1, 2]\n')
+        client.f.flush()
+        assert json.loads(client.f.readline())['ok'] is False
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
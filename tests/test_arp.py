@@ -0,0 +1,113 @@
+import pytest
+
+pytest.importorskip('p4runtime_lib')
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.arp import ArpResponder, arpEntries, gatewayMac
+from p4ctl.topo import Topology
+
+
+def host(ip, mac, gw=None, gw_mac=None):
+    commands = []
+    if gw is not None:
+        commands.append('route add default gw %s dev eth0' % gw)
+    if gw_mac is not None:
+        commands.append('arp -i eth0 -s %s %s' % (gw, gw_mac))
+    return {'ip': ip, 'mac': mac, 'commands': commands}
+
+
+TOPO = {
+    'hosts': {
+        'h1': host('10.0.1.1/24', '08:00:00:00:01:11', '10.0.1.10', '08:00:00:00:01:00'),
+        'h2': host('10.0.1.2/24', '08:00:00:00:01:22', '10.0.1.10', '08:00:00:00:01:00'),
+        'h3': host('10.0.2.2/24', '08:00:00:00:02:22', '10.0.2.20'),
+        'h4': host('10.0.3.3', '08:00:00:00:03:33'),
+    },
+    'switches': {'s1': {}, 's2': {}, 's3': {}},
+    'links': [['h1', 's1-p1'], ['h2', 's1-p2'], ['h3', 's2-p1'], ['h4', 's3-p1'],
+              ['s1-p3', 's2-p2'], ['s2-p3', 's3-p2']],
+}
+
+
+def test_gateway_mac():
+    topology = Topology(TOPO)
+    assert gatewayMac(topology.hosts['h1']) == '08:00:00:00:01:00'
+    # 没有arp -s时按手写拓扑的约定，主机MAC最后一个字节置0
+    assert gatewayMac(topology.hosts['h3']) == '08:00:00:00:02:00'
+
+
+def test_arp_entries():
+    assert arpEntries(Topology(TOPO)) == {
+        # 同网段的两台主机共用网关和网段表项
+        's1': {('10.0.1.10', 32): '08:00:00:00:01:00',
+               ('10.0.1.0', 24): '08:00:00:00:01:00'},
+        's2': {('10.0.2.20', 32): '08:00:00:00:02:00',
+               ('10.0.2.0', 24): '08:00:00:00:02:00'},
+        # /32且没有网关的主机不需要应答
+        's3': {},
+    }
+
+
+class FakeHelper(object):
+
+    def buildTableEntry(self, table_name, match_fields, default_action, action_name,
+                        action_params, priority):
+        entry = p4runtime_pb2.TableEntry()
+        ip, prefix_len = match_fields['hdr.arp_ipv4.tpa']
+        entry.table_id = 1
+        m = entry.match.add()
+        m.field_id = prefix_len
+        m.exact.value = ip.encode()
+        entry.action.action.params.add().value = action_params['dstAddr'].encode()
+        return entry
+
+
+class FakeSwitch(object):
+
+    def __init__(self, name, written):
+        self.name = name
+        self.device_id = 0
+        self.client_stub = self
+        self.written = written
+
+    def Write(self, request):
+        self.written.extend((self.name, u.type, u.entity.table_entry.match[0].exact.value.decode())
+                            for u in request.updates)
+
+
+class FakeRuntime(object):
+
+    def __init__(self, switch_names):
+        self.switch_names = switch_names
+        self.p4info_helper = FakeHelper()
+        self.written = []
+
+    def switch(self, name):
+        return FakeSwitch(name, self.written)
+
+
+def test_sync_writes_only_the_difference():
+    responder = ArpResponder(Topology(TOPO))
+    runtime = FakeRuntime(['s1', 's2'])
+    assert responder.sync(runtime) == {'s1': 2, 's2': 2}
+    assert all(t == p4runtime_pb2.Update.INSERT for _, t, _ in runtime.written)
+
+    del runtime.written[:]
+    assert responder.sync(runtime) == {'s1': 0, 's2': 0}
+    assert runtime.written == []
+
+    # h3换到另一个网段：旧表项删除，新表项插入
+    responder.topology.hosts['h3'].update(ip='10.0.4.2', gw='10.0.4.20')
+    assert responder.sync(runtime) == {'s1': 0, 's2': 4}
+    assert sorted(runtime.written) == sorted([
+        ('s2', p4runtime_pb2.Update.DELETE, '10.0.2.20'),
+        ('s2', p4runtime_pb2.Update.DELETE, '10.0.2.0'),
+        ('s2', p4runtime_pb2.Update.INSERT, '10.0.4.20'),
+        ('s2', p4runtime_pb2.Update.INSERT, '10.0.4.0')])
+
+    # 网关MAC变化：MODIFY
+    del runtime.written[:]
+    responder.topology.hosts['h1']['gw_mac'] = '08:00:00:00:01:99'
+    responder.topology.hosts['h2']['gw_mac'] = '08:00:00:00:01:99'
+    assert responder.sync(runtime) == {'s1': 2, 's2': 0}
+    assert set(t for _, t, _ in runtime.written) == {p4runtime_pb2.Update.MODIFY}
@@ -0,0 +1,106 @@
+import importlib.util
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('grpc')
+pytest.importorskip('p4runtime_lib')
+
+from conftest import ROOT
+
+spec = importlib.util.spec_from_file_location(
+    'ecncontroller', os.path.join(ROOT, '第3次实践作业', 'ecncontroller.py'))
+ecncontroller = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ecncontroller)
+
+
+class EcnSwitches(object):
+    """
+    代替寄存器/计数器读写和时钟：每台交换机按端口下标的qdepth_sum、报文数、
+    字节数和标记数，记下每次阈值写入。
+    """
+
+    def __init__(self, num_ports):
+        self.now = 0.0
+        self.size = num_ports + 1
+        self.state = {}
+        self.writes = []
+
+    def _switch(self, sw):
+        return self.state.setdefault(sw, dict(
+            (name, [0] * self.size) for name in ('qdepth', 'packets', 'bytes', 'marked')))
+
+    def perf_counter(self):
+        return self.now
+
+    def readRegister(self, sw, p4info_helper, name):
+        assert name == ecncontroller.QDEPTH_REGISTER
+        return list(self._switch(sw)['qdepth'])
+
+    def readCounter(self, sw, p4info_helper, name):
+        s = self._switch(sw)
+        if name == ecncontroller.PORT_COUNTER:
+            return list(s['packets']), list(s['bytes'])
+        assert name == ecncontroller.MARKED_COUNTER
+        return list(s['marked']), [0] * self.size
+
+    def writeRegister(self, sw, p4info_helper, name, values):
+        assert name == ecncontroller.THRESHOLD_REGISTER
+        self.writes.append((sw, dict(values)))
+
+    def send(self, sw, port, packets, qdepth, marked=0):
+        s = self._switch(sw)
+        s['packets'][port] += packets
+        s['bytes'][port] += packets * 1000
+        s['qdepth'][port] += packets * qdepth
+        s['marked'][port] += marked
+
+
+@pytest.fixture
+def switches(monkeypatch):
+    fake = EcnSwitches(num_ports=2)
+    monkeypatch.setattr(ecncontroller, 'time', fake)
+    for name in ('readRegister', 'readCounter', 'writeRegister'):
+        monkeypatch.setattr(ecncontroller, name, getattr(fake, name))
+    monkeypatch.setattr(ecncontroller, 'registerInfo', lambda helper, name: (1, 32, 3))
+    return fake
+
+
+def ecnRuntime(names):
+    helper = SimpleNamespace(get=lambda kind, name: SimpleNamespace(name=name))
+    return SimpleNamespace(switch_names=list(names), switch=lambda name: name,
+                           p4info_helper=helper)
+
+
+def test_long_queue_lowers_threshold(switches):
+    tuner = ecncontroller.EcnThresholdTuner(num_ports=2, window=2)
+    runtime = ecnRuntime(['s1'])
+    tuner.install(runtime)
+    assert switches.writes == [('s1', {1: 10, 2: 10})]
+    del switches.writes[:]
+    tuner.step(runtime)
+    for _ in range(2):
+        switches.now += 0.5
+        switches.send('s1', 1, 100, qdepth=20)
+        tuner.step(runtime)
+    # 端口1平均队列20超过目标10，阈值降为8；端口2没有流量，不变
+    assert switches.writes == [('s1', {1: 8})]
+    assert tuner.stats[('s1', 1)].changes == 1
+    assert tuner.stats[('s1', 2)].threshold == 10
+
+
+def test_switch_added_after_install_is_configured_on_next_step(switches):
+    tuner = ecncontroller.EcnThresholdTuner(num_ports=2, window=2)
+    runtime = ecnRuntime(['s1'])
+    tuner.install(runtime)
+    tuner.step(runtime)
+    runtime.switch_names.append('s4')
+    del switches.writes[:]
+    switches.now += 0.5
+    tuner.step(runtime)
+    assert switches.writes == [('s4', {1: 10, 2: 10})]
+    switches.now += 0.5
+    switches.send('s4', 2, 10, qdepth=3)
+    tuner.step(runtime)
+    assert tuner.stats[('s4', 2)].qdepth.mean(1) == 3
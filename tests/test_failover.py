@@ -0,0 +1,86 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('p4runtime_lib')
+
+from conftest import ROOT
+from p4ctl.failover import FailureDetector, planSwitchover, switchLinks
+from p4ctl.topo import Topology, loadRuntimeEntries, loadTopology
+
+MRC = os.path.join(ROOT, '大作业', 'mrc')
+
+
+@pytest.fixture(scope='module')
+def triangle():
+    topo = loadTopology(os.path.join(MRC, 'triangle-topo', 'topology.json'))
+    return Topology(topo), loadRuntimeEntries(topo, MRC)
+
+
+def link(topology, a, b):
+    return next(l for l in switchLinks(topology) if set((l[0], l[2])) == set((a, b)))
+
+
+def test_no_failure_no_switchover(triangle):
+    topology, rules = triangle
+    assert planSwitchover(topology, rules, []) == ({}, [])
+
+
+def test_switchover_around_failed_link(triangle):
+    topology, rules = triangle
+    # ipv4_lpm2隔离s1-s2，经s3绕行
+    plan, unprotected = planSwitchover(topology, rules, [link(topology, 's1', 's2')])
+    assert plan == {'s1': {'10.0.2.2': 4}, 's2': {'10.0.1.1': 4}}
+    assert unprotected == []
+    # ipv4_lpm3隔离s1-s3
+    plan, unprotected = planSwitchover(topology, rules, [link(topology, 's1', 's3')])
+    assert plan == {'s1': {'10.0.3.3': 8}, 's3': {'10.0.1.1': 8}}
+
+
+def test_link_without_backup_is_reported(triangle):
+    topology, rules = triangle
+    # 三角形只有两个备用配置，s2-s3不在任何一个中隔离
+    plan, unprotected = planSwitchover(topology, rules, [link(topology, 's2', 's3')])
+    assert plan == {}
+    assert sorted(unprotected) == [('s2', 'h3'), ('s3', 'h2')]
+
+
+class FakeStream(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def onPacketIn(self, handler):
+        self.handler = handler
+
+    def sendPacketOut(self, sw, payload, **metadata):
+        self.sent.append((sw, metadata['egress_port']))
+
+
+def fakeRuntime(switch_names):
+    helper = SimpleNamespace(
+        get=lambda kind, name: None,
+        p4info=SimpleNamespace(controller_packet_metadata=[
+            SimpleNamespace(preamble=SimpleNamespace(name='packet_out'))]))
+    return SimpleNamespace(switch_names=switch_names, p4info_helper=helper,
+                           stream=FakeStream(), switch=lambda name: name)
+
+
+def test_dead_interval_starts_with_probing(triangle):
+    topology, rules = triangle
+    detector = FailureDetector(topology, rules, probe_interval=0.01, dead_interval=0.05)
+    runtime = fakeRuntime(topology.switches)
+    detector.install(runtime)
+    assert detector.enabled
+    # install之后过了很久才开始探测(例如其他插件写表项)，不应判为故障
+    time.sleep(0.1)
+    detector.check(runtime)
+    assert detector.down == set()
+    detector.probe(runtime)
+    assert len(runtime.stream.sent) == 6
+    time.sleep(0.1)
+    detector.reconfigure = lambda runtime, down: (0, [])
+    detector.check(runtime)
+    assert detector.down == set(switchLinks(topology))
@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip('grpc')
+
+from p4ctl.metrics import LATENCY_BUCKETS, Histogram, RpcMetrics
+
+
+def test_empty_quantile():
+    assert Histogram().quantile(0.99) == 0.0
+
+
+def test_quantile_interpolates_within_bucket():
+    h = Histogram()
+    # 4个样本都落在(0.001, 0.0025]桶内
+    for elapsed in (0.0012, 0.0015, 0.002, 0.0024):
+        h.observe(elapsed)
+    assert h.quantile(0.5) == pytest.approx(0.001 + 0.0015 * 0.5)
+    assert h.quantile(1.0) == pytest.approx(0.0025)
+
+
+def test_quantile_across_buckets():
+    h = Histogram()
+    for _ in range(90):
+        h.observe(0.00005)
+    for _ in range(10):
+        h.observe(0.3)
+    assert h.quantile(0.5) <= 0.0001
+    assert 0.25 < h.quantile(0.99) <= 0.5
+
+
+def test_quantile_overflow_bucket():
+    h = Histogram()
+    h.observe(60.0)
+    assert h.quantile(0.5) == LATENCY_BUCKETS[-1]
+
+
+def test_bucket_bounds_are_inclusive():
+    h = Histogram()
+    h.observe(0.001)
+    assert h.counts[LATENCY_BUCKETS.index(0.001)] == 1
+
+
+def test_prometheus_buckets_are_cumulative(tmp_path):
+    metrics = RpcMetrics()
+    metrics.observe('s1', 'Write', 0.0003)
+    metrics.observe('s1', 'Write', 0.003, error=True)
+    path = str(tmp_path / 'p4runtime-metrics.prom')
+    metrics.writePrometheus(path)
+    with open(path) as f:
+        text = f.read()
+    assert 'p4runtime_rpc_latency_seconds_bucket{switch="s1",rpc="Write",le="0.0005"} 1' in text
+    assert 'p4runtime_rpc_latency_seconds_bucket{switch="s1",rpc="Write",le="0.005"} 2' in text
+    assert 'p4runtime_rpc_latency_seconds_bucket{switch="s1",rpc="Write",le="+Inf"} 2' in text
+    assert 'p4runtime_rpc_latency_seconds_count{switch="s1",rpc="Write"} 2' in text
+    assert 'p4runtime_rpc_errors_total{switch="s1",rpc="Write"} 1' in text
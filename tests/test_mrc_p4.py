@@ -0,0 +1,49 @@
+import glob
+import json
+import os
+import re
+
+from conftest import ROOT
+
+MRC = os.path.join(ROOT, '大作业', 'mrc')
+
+
+def p4Source():
+    with open(os.path.join(MRC, 'basic.p4'), encoding='utf-8') as f:
+        text = f.read()
+    # 去掉注释，注释里的名字不算定义
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    return re.sub(r'//[^\n]*', '', text)
+
+
+def tableActions(text):
+    """
+    :return: {table name: [action names]}
+    """
+    tables = {}
+    for name, body in re.findall(r'\btable\s+(\w+)\s*\{(.*?)\n    \}', text, flags=re.S):
+        listed = re.search(r'actions\s*=\s*\{(.*?)\}', body, flags=re.S).group(1)
+        tables[name] = [a.strip() for a in listed.split(';') if a.strip()]
+    return tables
+
+
+def test_table_actions_are_defined():
+    # p4c拒绝引用未定义动作的表；这里没有p4c，只做静态检查
+    text = p4Source()
+    defined = set(re.findall(r'\baction\s+(\w+)\s*\(', text)) | {'NoAction'}
+    tables = tableActions(text)
+    assert {'ipv4_lpm', 'ipv4_lpm2', 'ipv4_lpm3', 'mrc_config', 'arp_exact'} <= set(tables)
+    for name, actions in tables.items():
+        assert set(actions) <= defined, name
+
+
+def test_triangle_runtime_uses_program_tables():
+    tables = tableActions(p4Source())
+    for path in glob.glob(os.path.join(MRC, 'triangle-topo', '*-runtime.json')):
+        with open(path) as f:
+            entries = json.load(f)['table_entries']
+        for entry in entries:
+            table = entry['table'].split('.')[-1]
+            assert table in tables, (path, table)
+            if 'action_name' in entry:
+                assert entry['action_name'].split('.')[-1] in tables[table], (path, entry)
@@ -0,0 +1,84 @@
+import io
+import time
+
+import pytest
+
+pytest.importorskip('grpc')
+p4runtime_pb2 = pytest.importorskip('p4.v1.p4runtime_pb2')
+
+from p4ctl.msglog import BinaryRequestLogger, decodeLog, readLog
+
+
+def writeRequest(device_id):
+    request = p4runtime_pb2.WriteRequest()
+    request.device_id = device_id
+    request.updates.add().type = p4runtime_pb2.Update.INSERT
+    return request
+
+
+def test_round_trip(tmp_path):
+    log_file = str(tmp_path / 's1-p4runtime-requests.bin')
+    logger = BinaryRequestLogger(log_file)
+    before = time.time()
+    for i in range(3):
+        logger.log_message('/p4.v1.P4Runtime/Write', writeRequest(i))
+    logger.log_message('/p4.v1.P4Runtime/Read', b'\x0a\x00')
+    logger.close()
+    records = list(readLog(log_file))
+    assert logger.logged == 4 and logger.dropped == 0
+    assert [m for _, m, _ in records] == ['/p4.v1.P4Runtime/Write'] * 3 + ['/p4.v1.P4Runtime/Read']
+    assert all(ts >= before - 1 for ts, _, _ in records)
+    assert [p4runtime_pb2.WriteRequest.FromString(p).device_id
+            for _, _, p in records[:3]] == [0, 1, 2]
+    assert records[3][2] == b'\x0a\x00'
+
+
+def test_truncated_record_is_skipped(tmp_path):
+    log_file = str(tmp_path / 'log.bin')
+    logger = BinaryRequestLogger(log_file)
+    logger.log_message('/p4.v1.P4Runtime/Write', writeRequest(1))
+    logger.log_message('/p4.v1.P4Runtime/Write', writeRequest(2))
+    logger.close()
+    with open(log_file, 'rb') as f:
+        data = f.read()
+    with open(log_file, 'wb') as f:
+        f.write(data[:-3])
+    assert len(list(readLog(log_file))) == 1
+
+
+def test_rotation_keeps_backups(tmp_path):
+    log_file = str(tmp_path / 'log.bin')
+    logger = BinaryRequestLogger(log_file, max_bytes=200, backup_count=2)
+    for i in range(20):
+        logger.log_message('/p4.v1.P4Runtime/Write', writeRequest(i))
+    logger.close()
+    assert (tmp_path / 'log.bin.1').exists() and (tmp_path / 'log.bin.2').exists()
+    assert not (tmp_path / 'log.bin.3').exists()
+    # 最新的请求在当前文件里
+    last = list(readLog(log_file))[-1][2]
+    assert p4runtime_pb2.WriteRequest.FromString(last).device_id == 19
+
+
+def test_decode_uses_utc(tmp_path):
+    log_file = str(tmp_path / 'log.bin')
+    logger = BinaryRequestLogger(log_file)
+    logger._queue.put((0.0, '/p4.v1.P4Runtime/Write', writeRequest(7)))
+    logger.close()
+    out = io.StringIO()
+    decodeLog(log_file, out)
+    assert '[1970-01-01 00:00:00.000] /p4.v1.P4Runtime/Write' in out.getvalue()
+    assert 'device_id: 7' in out.getvalue()
+
+
+def test_close_after_writer_died(tmp_path):
+    logger = BinaryRequestLogger(str(tmp_path / 'log.bin'), queue_size=2)
+    # 模拟写线程出错退出后队列被填满
+    logger._queue.put(logger._sentinel)
+    logger._thread.join()
+    logger.log_message('/p4.v1.P4Runtime/Write', writeRequest(1))
+    logger.log_message('/p4.v1.P4Runtime/Write', writeRequest(2))
+    logger.log_message('/p4.v1.P4Runtime/Write', writeRequest(3))
+    start = time.perf_counter()
+    logger.close(timeout=0.5)
+    assert time.perf_counter() - start < 0.5
+    assert logger.dropped == 3
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import pickle
+import shutil
+
+import pytest
+
+pytest.importorskip('p4runtime_lib')
+pytest.importorskip('p4.config.v1.p4info_pb2')
+
+from conftest import P4INFO
+from p4ctl.p4info_cache import cachePath, loadP4InfoHelper
+
+
+@pytest.fixture
+def p4info(tmp_path):
+    path = str(tmp_path / 'basic.p4.p4info.txt')
+    shutil.copy(P4INFO, path)
+    return path
+
+
+def test_cache_is_written_and_reused(p4info):
+    helper = loadP4InfoHelper(p4info)
+    assert os.path.exists(cachePath(p4info))
+    cached = loadP4InfoHelper(p4info)
+    assert cached.p4info == helper.p4info
+    table = helper.p4info.tables[0]
+    assert cached.get('tables', name=table.preamble.name).preamble.id == table.preamble.id
+    assert cached.get('tables', id=table.preamble.id).preamble.name == table.preamble.name
+
+
+def test_changed_p4info_invalidates_cache(p4info):
+    helper = loadP4InfoHelper(p4info)
+    name = helper.p4info.tables[0].preamble.name
+    with open(p4info) as f:
+        text = f.read()
+    with open(p4info, 'w') as f:
+        f.write(text.replace(name, name + '_v2'))
+    assert loadP4InfoHelper(p4info).get('tables', name=name + '_v2') is not None
+
+
+def test_corrupt_cache_is_rebuilt(p4info):
+    with open(cachePath(p4info), 'wb') as f:
+        f.write(b'not a pickle')
+    assert len(loadP4InfoHelper(p4info).p4info.tables) > 0
+
+
+def cacheContents(p4info, kind):
+    with open(p4info, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if kind == 'truncated':
+        loadP4InfoHelper(p4info)
+        with open(cachePath(p4info), 'rb') as f:
+            return f.read()[:100]
+    if kind == 'not a dict':
+        return pickle.dumps(['version', 1])
+    if kind == 'bad p4info':
+        return pickle.dumps({'version': 1, 'sha256': digest, 'p4info': b'\xff\xff', 'index': {}})
+    # 引用不存在的类，反序列化时抛出AttributeError
+    return b'\x80\x04cp4ctl.p4info_cache\nNoSuchClass\n)\x81.'
+
+
+@pytest.mark.parametrize('kind', ['truncated', 'not a dict', 'bad p4info', 'unknown class'])
+def test_unreadable_cache_is_rebuilt(p4info, kind):
+    contents = cacheContents(p4info, kind)
+    with open(cachePath(p4info), 'wb') as f:
+        f.write(contents)
+    helper = loadP4InfoHelper(p4info)
+    assert len(helper.p4info.tables) > 0
+    # 重新写入的缓存可以正常使用
+    assert loadP4InfoHelper(p4info).p4info == helper.p4info
+
+
+def test_unknown_names_raise_attribute_error(p4info):
+    helper = loadP4InfoHelper(p4info)
+    with pytest.raises(AttributeError):
+        helper.get('tables', name='MyIngress.no_such_table')
+    table = helper.p4info.tables[0]
+    with pytest.raises(AttributeError):
+        helper.get_match_field(table.preamble.name, name='no.such.field')
+    mf = table.match_fields[0]
+    assert helper.get_match_field(table.preamble.name, id=mf.id).name == mf.name
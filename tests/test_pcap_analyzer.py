@@ -0,0 +1,120 @@
+import importlib.util
+import io
+import os
+import socket
+import struct
+
+import pytest
+
+from conftest import ROOT
+
+spec = importlib.util.spec_from_file_location(
+    'pcap_analyzer', os.path.join(ROOT, '大作业', 'mrc', 'pcap_analyzer.py'))
+pcap_analyzer = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pcap_analyzer)
+
+
+def frame(src, dst, ip_id, ttl=64, tos=0, sport=4000, dport=1234, options=b''):
+    ihl = 5 + len(options) // 4
+    ip = struct.pack('!BBHHHBBH4s4s', 0x40 | ihl, tos, 20 + len(options) + 8, ip_id, 0,
+                     ttl, 17, 0, socket.inet_aton(src), socket.inet_aton(dst)) + options
+    return b'\xff' * 6 + b'\x08' * 6 + b'\x08\x00' + ip + struct.pack('!HHHH', sport, dport, 8, 0)
+
+
+def writePcap(path, packets, nanoseconds=False, endian='<', truncate=0):
+    magic = 0xa1b23c4d if nanoseconds else 0xa1b2c3d4
+    unit = 1e9 if nanoseconds else 1e6
+    data = struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, 65535, 1)
+    for ts, pkt in packets:
+        data += struct.pack(endian + 'IIII', int(ts), int(round((ts % 1) * unit)),
+                            len(pkt), len(pkt)) + pkt
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) - truncate])
+
+
+def test_read_pcap_formats(tmp_path):
+    pkt = frame('10.0.1.1', '10.0.2.2', 7)
+    for name, kwargs in (('le-us', {}), ('be-us', {'endian': '>'}),
+                         ('le-ns', {'nanoseconds': True})):
+        path = str(tmp_path / ('%s.pcap' % name))
+        writePcap(path, [(10.25, pkt)], **kwargs)
+        (ts, switch, port, direction, key, ttl, tos), = list(
+            pcap_analyzer.readPcap(path, 's1', 1, 'in'))
+        assert ts == pytest.approx(10.25)
+        assert key == (socket.inet_aton('10.0.1.1'), socket.inet_aton('10.0.2.2'),
+                       17, 4000, 1234, 7)
+        assert (switch, port, direction, ttl, tos) == ('s1', 1, 'in', 64, 0)
+
+
+def test_read_pcap_skips_truncated_and_non_ip(tmp_path):
+    path = str(tmp_path / 'x.pcap')
+    arp = b'\xff' * 12 + b'\x08\x06' + b'\0' * 28
+    writePcap(path, [(1.0, arp), (2.0, frame('10.0.1.1', '10.0.2.2', 1)),
+                     (3.0, frame('10.0.1.1', '10.0.2.2', 2))], truncate=5)
+    assert [r[4][5] for r in pcap_analyzer.readPcap(path, 's1', 1, 'in')] == [1]
+
+
+def test_read_pcap_rejects_unknown_magic(tmp_path):
+    path = str(tmp_path / 's1-eth1_in.pcap')
+    with open(path, 'wb') as f:
+        f.write(b'\x0a\x0d\x0d\x0a' + b'\0' * 60)      # pcapng
+    with pytest.raises(ValueError, match='s1-eth1_in.pcap: not a pcap file'):
+        pcap_analyzer.readPcap(path, 's1', 1, 'in')
+
+
+def test_read_pcap_honours_ip_options(tmp_path):
+    path = str(tmp_path / 'x.pcap')
+    writePcap(path, [(1.0, frame('10.0.1.1', '10.0.2.2', 1, options=b'\x01' * 8))])
+    (record,) = pcap_analyzer.readPcap(path, 's1', 1, 'in')
+    assert record[4][3:5] == (4000, 1234)
+
+
+def test_find_pcaps(tmp_path):
+    for name in ('s1-eth1_in.pcap', 's12-eth3_out.pcap', 's1-eth1.pcap', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+    found = sorted((s, p, d) for _, s, p, d in pcap_analyzer.findPcaps([str(tmp_path)]))
+    assert found == [('s1', 1, 'in'), ('s12', 3, 'out')]
+
+
+def test_analyzer_correlates_hops():
+    key = ('a', 'b', 17, 1, 2, 1)
+    lost = ('a', 'b', 17, 1, 2, 2)
+    records = [
+        (0.000, 's1', 1, 'in', key, 64, 4),
+        (0.001, 's1', 2, 'out', key, 63, 4),
+        (0.003, 's2', 1, 'in', key, 63, 4),
+        (0.004, 's2', 2, 'out', key, 62, 4),
+        (0.010, 's1', 1, 'in', lost, 64, 0),
+        (0.011, 's1', 2, 'out', lost, 63, 0),
+        (0.012, 's2', 1, 'in', lost, 63, 0),
+    ]
+    analyzer = pcap_analyzer.Analyzer(window=1.0)
+    analyzer.feed(iter(records))
+    assert analyzer.packets == 2 and analyzer.records == 7
+    assert analyzer.switch_latency['s1'].count == 2
+    assert analyzer.switch_latency['s2'].mean() == pytest.approx(0.001)
+    assert analyzer.drops == {'s2': 1}
+    assert analyzer.link_latency[('s1', 2, 's2', 1)].mean() == pytest.approx(0.0015)
+    assert analyzer.ttl_changes[('s1', 1)] == 2
+    assert analyzer.paths[('ipv4_lpm2', 4, ('s1', 's2'))] == 1
+    assert analyzer.paths[('ipv4_lpm', 0, ('s1', 's2'))] == 1
+    out = io.StringIO()
+    analyzer.report(out)
+    assert '7 records, 2 packets' in out.getvalue()
+
+
+def test_analyzer_releases_packets_outside_window():
+    analyzer = pcap_analyzer.Analyzer(window=0.5)
+    seen = []
+    analyzer._finish = lambda obs: seen.append(len(obs))
+
+    def records():
+        yield (0.0, 's1', 1, 'in', 'a', 64, 0)
+        yield (0.1, 's1', 2, 'out', 'a', 63, 0)
+        yield (1.0, 's1', 1, 'in', 'b', 64, 0)
+        # 'a'已超出窗口，在读到下一条记录之前就已统计并释放
+        assert seen == [2] and list(analyzer.pending) == ['b']
+        yield (1.1, 's1', 2, 'out', 'b', 63, 0)
+
+    analyzer.feed(records())
+    assert seen == [2, 2]
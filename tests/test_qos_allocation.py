@@ -0,0 +1,146 @@
+import importlib.util
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('grpc')
+pytest.importorskip('p4runtime_lib')
+
+from conftest import ROOT
+
+spec = importlib.util.spec_from_file_location(
+    'qoscontroller', os.path.join(ROOT, '第4次实践作业', 'qoscontroller.py'))
+qoscontroller = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(qoscontroller)
+allocateRates = qoscontroller.allocateRates
+
+GUARANTEES = (0.2, 0.5, 0.3)
+
+
+def test_all_classes_within_guarantee():
+    # 各类别都只用了保证份额的一部分：非优先类别按需求承诺，剩余都作为峰值余量
+    alloc = allocateRates(1000.0, [100.0, 200.0, 100.0], GUARANTEES)
+    assert alloc == pytest.approx([(200, 200), (200, 800), (100, 700)])
+
+
+def test_saturated_link_commits_guarantees():
+    alloc = allocateRates(1000.0, [0.0, 900.0, 900.0], GUARANTEES)
+    assert [c for c, _ in alloc] == [200.0, 500.0, 300.0]
+    # 优先类别空闲的承诺速率只作为其他类别的峰值余量(黄色报文)
+    assert [p for _, p in alloc] == pytest.approx([200, 700, 500])
+
+
+def test_spare_bandwidth_goes_to_hungry_classes_by_guarantee():
+    guarantees = (0.2, 0.4, 0.2, 0.2)
+    alloc = allocateRates(1000.0, [200.0, 900.0, 900.0, 50.0], guarantees)
+    # 第3类只用了50，剩余的150按0.4:0.2分给第1、2类
+    assert [c for c, _ in alloc] == pytest.approx([200, 500, 250, 50])
+
+
+def test_water_filling_caps_at_demand():
+    guarantees = (0.2, 0.4, 0.2, 0.2)
+    alloc = allocateRates(1000.0, [200.0, 420.0, 900.0, 50.0], guarantees)
+    # 第1类只比保证份额多要20，它那份剩下的在下一轮给第2类
+    assert [c for c, _ in alloc] == pytest.approx([200, 420, 330, 50])
+    assert [p for _, p in alloc] == pytest.approx([200, 420, 330, 50])
+
+
+def test_priority_class_is_not_capped_by_its_demand():
+    alloc = allocateRates(1000.0, [600.0, 0.0, 0.0], GUARANTEES, priority=0)
+    assert alloc[0] == (200.0, 200.0)
+    alloc = allocateRates(1000.0, [0.0, 0.0, 600.0], GUARANTEES, priority=2)
+    assert alloc[2] == (300.0, 300.0)
+    assert alloc[0][1] == pytest.approx(700.0)
+
+
+class MeterSwitches(object):
+    """
+    代替readCounter/writeMeterConfig和时钟：每台交换机一组colour_counter字节数，
+    记下每次meter写入。
+    """
+
+    def __init__(self, ports):
+        self.now = 0.0
+        self.counters = {}
+        self.size = (max(ports) + 1) * len(qoscontroller.QOS_CLASSES) * 3
+        self.writes = []
+
+    def perf_counter(self):
+        return self.now
+
+    def readCounter(self, sw, p4info_helper, name):
+        assert name == qoscontroller.COLOUR_COUNTER
+        counts = self.counters.setdefault(sw, [0] * self.size)
+        return None, list(counts)
+
+    def writeMeterConfig(self, sw, p4info_helper, name, configs):
+        assert name == qoscontroller.CLASS_METER
+        self.writes.append((sw, dict(configs)))
+
+    def send(self, sw, port, cls, colour, nbytes):
+        counts = self.counters.setdefault(sw, [0] * self.size)
+        counts[(port * len(qoscontroller.QOS_CLASSES) + cls) * 3 + colour] += nbytes
+
+
+@pytest.fixture
+def switches(monkeypatch):
+    fake = MeterSwitches(ports=(1,))
+    monkeypatch.setattr(qoscontroller, 'time', fake)
+    monkeypatch.setattr(qoscontroller, 'readCounter', fake.readCounter)
+    monkeypatch.setattr(qoscontroller, 'writeMeterConfig', fake.writeMeterConfig)
+    return fake
+
+
+def meterRuntime(names):
+    helper = SimpleNamespace(get=lambda kind, name: SimpleNamespace(name=name))
+    return SimpleNamespace(switch_names=list(names), switch=lambda name: name,
+                           p4info_helper=helper)
+
+
+def test_step_rewrites_only_changed_meters_in_one_batch(switches):
+    meters = qoscontroller.QosMeters(ports=(1,), link_rate=1000, guarantees=GUARANTEES)
+    runtime = meterRuntime(['s1'])
+    meters.install(runtime)
+    assert [(sw, sorted(c)) for sw, c in switches.writes] == [('s1', [3, 4, 5])]
+    del switches.writes[:]
+
+    meters.step(runtime)            # 第一次只记下计数
+    assert switches.writes == []
+    switches.now += 1.0
+    switches.send('s1', 1, 1, 0, 500)
+    switches.send('s1', 1, 1, 1, 100)
+    meters.step(runtime)
+    stats = meters.stats[('s1', 1, 1)]
+    assert (stats.green.mean(1), stats.yellow.mean(1), stats.red.mean(1)) == (500, 100, 0)
+    # af需求600*1.2=720，ef空闲的190和剩余的65作为峰值余量；be只剩最低份额15；ef不变
+    assert switches.writes == [('s1', {
+        4: meters._config(720, 975), 5: meters._config(15, 270)})]
+    assert (stats.cir, stats.pir, stats.changes) == (720, 975, 1)
+    assert meters.stats[('s1', 1, 0)].changes == 0
+
+    del switches.writes[:]
+    switches.now += 1.0
+    switches.send('s1', 1, 1, 0, 510)
+    switches.send('s1', 1, 1, 1, 100)
+    meters.step(runtime)
+    # 变化不超过tolerance，不重写
+    assert switches.writes == []
+
+
+def test_switch_added_after_install_is_configured_on_next_step(switches):
+    meters = qoscontroller.QosMeters(ports=(1,), link_rate=1000, guarantees=GUARANTEES)
+    runtime = meterRuntime(['s1'])
+    meters.install(runtime)
+    meters.step(runtime)
+    runtime.switch_names.append('s4')
+    del switches.writes[:]
+    switches.now += 1.0
+    meters.step(runtime)
+    # s1空闲的类别也会缩小，这里只看s4：写入初始配置，本周期只记下计数
+    assert [sorted(c) for sw, c in switches.writes if sw == 's4'] == [[3, 4, 5]]
+    assert ('s4', 1, 2) in meters.stats
+    switches.now += 1.0
+    switches.send('s4', 1, 2, 0, 300)
+    meters.step(runtime)
+    assert meters.stats[('s4', 1, 2)].green.mean(1) == 300
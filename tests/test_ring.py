@@ -0,0 +1,37 @@
+import pytest
+
+from p4ctl.ring import RingBuffer
+
+
+def test_empty():
+    ring = RingBuffer(4)
+    assert len(ring) == 0
+    assert list(ring.values()) == []
+    assert ring.last() == ring.mean() == ring.max() == 0.0
+
+
+def test_partial_fill():
+    ring = RingBuffer(4)
+    for v in (1, 2, 3):
+        ring.append(v)
+    assert len(ring) == 3
+    assert list(ring.values()) == [1, 2, 3]
+    assert list(ring.values(2)) == [2, 3]
+    assert list(ring.values(10)) == [1, 2, 3]
+    assert ring.last() == 3
+    assert ring.mean() == 2.0
+
+
+@pytest.mark.parametrize('appended', [5, 7, 8, 11])
+def test_wraps_oldest_first(appended):
+    ring = RingBuffer(4)
+    for v in range(appended):
+        ring.append(v)
+    expected = list(range(appended))[-4:]
+    assert len(ring) == 4
+    assert list(ring.values()) == expected
+    for n in range(1, 5):
+        assert list(ring.values(n)) == expected[-n:]
+    assert ring.last() == expected[-1]
+    assert ring.max(2) == expected[-1]
+    assert ring.mean(3) == pytest.approx(sum(expected[-3:]) / 3.0)
@@ -0,0 +1,163 @@
+import signal
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('grpc')
+pytest.importorskip('p4runtime_lib')
+
+import p4ctl.runtime as runtime_module
+from p4ctl.runtime import ControllerRuntime, Plugin, TaskStats
+
+
+class FakeSwitch(object):
+    def __init__(self, name, address, device_id):
+        self.name = name
+        self.address = address
+        self.device_id = device_id
+
+
+class FakeHelper(object):
+    p4info = None
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    calls = []
+    monkeypatch.setattr(runtime_module, 'connectSwitch',
+                        lambda name, address, device_id, *args: FakeSwitch(name, address, device_id))
+    monkeypatch.setattr(runtime_module, 'arbitrate',
+                        lambda sw, election_id: calls.append(('arbitrate', sw.name)))
+    monkeypatch.setattr(runtime_module, 'setPipelineConfig',
+                        lambda sw, p4info, path: calls.append(('pipeline', sw.name)))
+    rt = ControllerRuntime(FakeHelper(), 'basic.json', switch_names=['s1', 's2'], log_dir=None)
+    rt.calls = calls
+    return rt
+
+
+def test_addresses_follow_topology_order(runtime):
+    assert runtime.switch('s2').address == '127.0.0.1:50052'
+    assert runtime.switch('s2').device_id == 1
+    assert runtime.switch('s2') is runtime.switch('s2')
+    with pytest.raises(KeyError):
+        runtime.switch('s9')
+
+
+def test_add_switch_before_start(runtime):
+    sw = runtime.addSwitch('s3')
+    assert (sw.address, sw.device_id) == ('127.0.0.1:50053', 2)
+    assert runtime.calls == []
+    runtime.start()
+    assert ('pipeline', 's3') in runtime.calls
+
+
+def test_add_switch_after_start(runtime):
+    runtime.start()
+    del runtime.calls[:]
+    sw = runtime.addSwitch('s3')
+    assert runtime.switch_names == ['s1', 's2', 's3']
+    assert sw.device_id == 2
+    assert runtime.calls == [('arbitrate', 's3'), ('pipeline', 's3')]
+    assert runtime.addSwitch('s3') is sw
+
+
+class PeriodicPlugin(Plugin):
+    """
+    周期任务由参数给出；stop任务第二次运行时(即运行了duration秒后)像Ctrl-C一样
+    发出SIGINT，run()随之抛出KeyboardInterrupt。
+    """
+
+    def __init__(self, tasks, duration):
+        self._tasks = list(tasks)
+        self.duration = duration
+        self.stops = 0
+
+    async def stop(self, runtime):
+        self.stops += 1
+        if self.stops == 2:
+            signal.raise_signal(signal.SIGINT)
+
+    def tasks(self, runtime):
+        return self._tasks + [('stop', self.duration, self.stop)]
+
+
+def runFor(tasks, duration=0.45):
+    rt = ControllerRuntime(FakeHelper(), 'basic.json', switch_names=[], log_dir=None)
+    rt.addPlugin(PeriodicPlugin(tasks, duration))
+    rt.start()
+    with pytest.raises(KeyboardInterrupt):
+        rt.run()
+    return rt
+
+
+def test_sync_task_runs_in_executor_at_fixed_cadence():
+    loop_thread = threading.current_thread()
+    starts, threads = [], []
+
+    def task(runtime):
+        starts.append(time.monotonic())
+        threads.append(threading.current_thread())
+        time.sleep(0.05)
+
+    rt = runFor([('sync', 0.1, task)])
+    stats = rt.task_stats['sync']
+    # 0、0.1、0.2、0.3、0.4秒各一次
+    assert 4 <= stats.count <= 6
+    # 中断可能发生在最后一次调用返回之后、记录之前
+    assert len(starts) - 1 <= stats.count <= len(starts)
+    assert loop_thread not in threads
+    assert stats.errors == 0 and stats.overruns == 0
+    assert 0.05 <= stats.last and stats.max < 0.1
+    assert stats.total == pytest.approx(stats.count * 0.05, rel=0.5)
+    # 节拍从上一次的计划时刻算起，运行时间不会累积成漂移
+    gaps = [b - a for a, b in zip(starts, starts[1:])]
+    assert all(abs(gap - 0.1) < 0.04 for gap in gaps), gaps
+
+
+def test_coroutine_task_runs_on_the_loop():
+    threads = []
+
+    async def task(runtime):
+        threads.append(threading.current_thread())
+
+    rt = runFor([('async', 0.1, task)], duration=0.25)
+    assert set(threads) == {threading.current_thread()}
+    assert rt.task_stats['async'].count == len(threads) >= 2
+
+
+def test_overrun_skips_missed_ticks():
+    def task(runtime):
+        time.sleep(0.15)
+
+    rt = runFor([('slow', 0.1, task)])
+    stats = rt.task_stats['slow']
+    # 每轮0.15秒，超时的节拍不补跑：0、0.15、0.3秒开始
+    assert 2 <= stats.count <= 4
+    assert stats.overruns == stats.count
+    assert stats.max >= 0.15
+
+
+def test_failing_task_is_counted_and_keeps_running(capsys):
+    def task(runtime):
+        raise ValueError('boom')
+
+    rt = runFor([('failing', 0.1, task)], duration=0.25)
+    stats = rt.task_stats['failing']
+    assert stats.count >= 2
+    assert stats.errors == stats.count
+    assert "Task failing failed: ValueError('boom')" in capsys.readouterr().out
+    rt.printTaskSummary()
+    assert 'failing' in capsys.readouterr().out
+
+
+def test_task_stats_record():
+    stats = TaskStats()
+    stats.record(0.02, 0.1)
+    stats.record(0.3, 0.1)
+    stats.record(0.01, 0.1)
+    assert stats.count == 3
+    assert stats.overruns == 1
+    assert stats.max == 0.3
+    assert stats.last == 0.01
+    assert stats.total == pytest.approx(0.33)
@@ -0,0 +1,95 @@
+import queue
+import shutil
+
+import pytest
+
+pytest.importorskip('grpc')
+pytest.importorskip('p4runtime_lib')
+
+from conftest import P4INFO
+from p4ctl.sharding import ShardedController, _worker, partitionSwitches
+
+
+class FakeProcess(object):
+    def __init__(self, alive=True, exitcode=None):
+        self.alive = alive
+        self.exitcode = exitcode
+
+    def is_alive(self):
+        return self.alive
+
+
+def makeController(num_workers=3, timeout=5.0):
+    controller = ShardedController('basic.p4.p4info.txt', 'basic.json',
+                                   ['s1', 's2', 's3'], num_workers, log_dir=None,
+                                   timeout=timeout)
+    controller._result_queue = queue.Queue()
+    controller._cmd_queues = [queue.Queue() for _ in range(num_workers)]
+    controller._procs = [FakeProcess() for _ in range(num_workers)]
+    return controller
+
+
+def test_partition_round_robin():
+    assert partitionSwitches(['s1', 's2', 's3', 's4', 's5'], 2) == [
+        ['s1', 's3', 's5'], ['s2', 's4']]
+
+
+def test_error_drains_every_reply():
+    controller = makeController()
+    for reply in ((0, 1, 'ok', {}), (1, 1, 'error', 'boom'), (2, 1, 'ok', {})):
+        controller._result_queue.put(reply)
+    with pytest.raises(RuntimeError, match='shard 1: boom'):
+        controller.status()
+    # 下一条命令只拿到自己的回复
+    for shard_id in range(3):
+        controller._result_queue.put((shard_id, 2, 'ok', {'shard': shard_id}))
+    assert [s['shard'] for s in controller.status()] == [0, 1, 2]
+
+
+def test_stale_replies_are_dropped():
+    controller = makeController()
+    controller._seq = 4
+    controller._result_queue.put((1, 3, 'ok', {'shard': 'stale'}))
+    for shard_id in range(3):
+        controller._result_queue.put((shard_id, 5, 'ok', {'shard': shard_id}))
+    assert [s['shard'] for s in controller.status()] == [0, 1, 2]
+
+
+def test_dead_worker_does_not_block():
+    controller = makeController()
+    controller._procs[2] = FakeProcess(alive=False, exitcode=1)
+    controller._result_queue.put((0, 1, 'ok', {}))
+    controller._result_queue.put((1, 1, 'ok', {}))
+    with pytest.raises(RuntimeError, match='shard 2: worker exited with code 1'):
+        controller.status()
+
+
+def test_silent_worker_times_out():
+    controller = makeController(timeout=0.2)
+    controller._result_queue.put((0, 1, 'ok', {}))
+    with pytest.raises(RuntimeError, match='shard 1: no reply'):
+        controller.status()
+
+
+def test_worker_reports_startup_failure(tmp_path):
+    results = queue.Queue()
+    _worker(0, str(tmp_path / 'missing.p4info.txt'), 'basic.json', [], None, 256,
+            queue.Queue(), results)
+    shard_id, seq, kind, payload = results.get_nowait()
+    assert (shard_id, seq, kind) == (0, 0, 'error')
+    assert 'FileNotFoundError' in payload
+
+
+def test_worker_reports_command_failure(tmp_path):
+    p4info = str(tmp_path / 'basic.p4.p4info.txt')
+    shutil.copy(P4INFO, p4info)
+    commands, results = queue.Queue(), queue.Queue()
+    commands.put((1, 'install', {'s9': []}))
+    commands.put((2, 'status', None))
+    commands.put(None)
+    _worker(0, p4info, 'basic.json', [], None, 256, commands, results)
+    assert results.get_nowait()[:3] == (0, 0, 'ready')
+    shard_id, seq, kind, payload = results.get_nowait()
+    assert (seq, kind) == (1, 'error') and 'KeyError' in payload
+    shard_id, seq, kind, status = results.get_nowait()
+    assert (seq, kind) == (2, 'ok') and status['errors'] == 1
@@ -0,0 +1,138 @@
+import math
+import socket
+import struct
+from array import array
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('p4runtime_lib')
+from p4.v1 import p4runtime_pb2
+
+from p4ctl import externs, sketch
+
+WIDTH = 16
+
+
+def ip(text):
+    return struct.unpack('!I', socket.inet_aton(text))[0]
+
+
+def emptySketch():
+    rows = tuple(array('Q', bytes(8 * WIDTH)) for _ in sketch.SKETCH_ROWS)
+    candidates = tuple(array('Q', bytes(8 * WIDTH)) for _ in sketch.CANDIDATE_REGISTERS)
+    return rows, candidates
+
+
+def addFlow(rows, candidates, columns, nbytes, src, dst, proto, sport, dport):
+    c0, c1, c2 = columns
+    rows[0][c0] += nbytes
+    rows[1][c1] += nbytes
+    rows[2][c2] += nbytes
+    for register, value in zip(candidates, (ip(src), ip(dst), sport << 16 | dport,
+                                            proto, c1, c2)):
+        register[c0] = value
+
+
+@pytest.fixture(params=['numpy', 'plain'])
+def decode(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(sketch, 'np', None)
+    return sketch.decodeHeavyHitters
+
+
+def test_decode_empty(decode):
+    assert decode(*emptySketch()) == (0, [])
+
+
+def test_decode_orders_by_min_estimate(decode):
+    rows, candidates = emptySketch()
+    addFlow(rows, candidates, (1, 2, 3), 5000, '10.0.1.1', '10.0.2.2', 17, 4000, 53)
+    addFlow(rows, candidates, (4, 5, 6), 8000, '10.0.1.1', '10.0.3.3', 6, 5000, 80)
+    addFlow(rows, candidates, (7, 8, 9), 100, '10.0.1.2', '10.0.3.3', 6, 5001, 80)
+    # 另一条流在row1上与第一条流冲突：row0和row2不受影响，估计值取最小仍是5000
+    rows[1][2] += 3000
+    total, hitters = decode(rows, candidates, k=2)
+    assert total == 13100
+    assert [(h.dst, h.bytes) for h in hitters] == [('10.0.3.3', 8000), ('10.0.2.2', 5000)]
+    h = hitters[1]
+    assert (h.src, h.proto, h.sport, h.dport) == ('10.0.1.1', 17, 4000, 53)
+    assert h.share == pytest.approx(5000 / 13100.0)
+    assert h.lower == int(5000 - math.e / WIDTH * 13100)
+
+
+def test_decode_min_share(decode):
+    rows, candidates = emptySketch()
+    addFlow(rows, candidates, (1, 2, 3), 900, '10.0.1.1', '10.0.2.2', 6, 1, 2)
+    addFlow(rows, candidates, (4, 5, 6), 100, '10.0.1.1', '10.0.3.3', 6, 1, 2)
+    _, hitters = decode(rows, candidates, k=10, min_share=0.2)
+    assert [h.dst for h in hitters] == ['10.0.2.2']
+
+
+REGISTER_IDS = dict((name, 100 + i) for i, name in enumerate(
+    sketch.SKETCH_ROWS + sketch.CANDIDATE_REGISTERS + (sketch.CANDIDATE_COUNT,)))
+
+
+class FakeHelper(object):
+
+    def get(self, kind, name):
+        assert kind == 'registers'
+        return SimpleNamespace(preamble=SimpleNamespace(id=REGISTER_IDS[name]), size=WIDTH,
+                               type_spec=SimpleNamespace(bitstring=SimpleNamespace(
+                                   bit=SimpleNamespace(bitwidth=32))))
+
+
+class FakeSwitch(object):
+
+    def __init__(self, cells):
+        self.device_id = 0
+        self.client_stub = self
+        self.cells = cells
+        self.reads = []
+        self.writes = []
+
+    def Read(self, request):
+        self.reads.append(request)
+        response = p4runtime_pb2.ReadResponse()
+        for wanted in request.entities:
+            register_id = wanted.register_entry.register_id
+            for (rid, index), value in self.cells.items():
+                if rid == register_id:
+                    r = response.entities.add().register_entry
+                    r.register_id = rid
+                    r.index.index = index
+                    r.data.bitstring = value.to_bytes(4, 'big')
+        yield response
+
+    def Write(self, request):
+        self.writes.append(request)
+
+
+def test_read_sketch_uses_one_read():
+    sw = FakeSwitch({(REGISTER_IDS['MyIngress.cms_row1'], 3): 7,
+                     (REGISTER_IDS['MyIngress.hh_idx2'], 0): 9})
+    rows, candidates = sketch.readSketch(sw, FakeHelper())
+    assert len(sw.reads) == 1
+    assert len(sw.reads[0].entities) == len(sketch.SKETCH_ROWS + sketch.CANDIDATE_REGISTERS)
+    assert rows[1][3] == 7 and sum(rows[0]) == sum(rows[2]) == 0
+    assert candidates[5][0] == 9 and len(candidates) == 6
+
+
+def test_reset_sketch_clears_only_cells_read_as_non_zero(monkeypatch):
+    monkeypatch.setattr(externs, 'encode', lambda value, bitwidth: value.to_bytes(4, 'big'))
+    rows, candidates = emptySketch()
+    addFlow(rows, candidates, (1, 2, 3), 500, '10.0.1.1', '10.0.2.2', 6, 1, 2)
+    sw = FakeSwitch({})
+    sketch.resetSketch(sw, FakeHelper(), rows)
+    cleared = sorted((u.entity.register_entry.register_id, u.entity.register_entry.index.index)
+                     for request in sw.writes for u in request.updates)
+    assert cleared == sorted([(REGISTER_IDS['MyIngress.cms_row0'], 1),
+                              (REGISTER_IDS['MyIngress.cms_row1'], 2),
+                              (REGISTER_IDS['MyIngress.cms_row2'], 3),
+                              (REGISTER_IDS[sketch.CANDIDATE_COUNT], 1)])
+
+    sw = FakeSwitch({})
+    sketch.resetSketch(sw, FakeHelper())
+    assert sum(len(request.updates) for request in sw.writes) == 4 * WIDTH
@@ -0,0 +1,92 @@
+import pytest
+
+pytest.importorskip('grpc')
+pytest.importorskip('p4runtime_lib')
+from p4.v1 import p4runtime_pb2
+
+from conftest import StandInSwitch, startStandIn
+from p4ctl.batch import writeUpdates
+from p4ctl.snapshot import captureSnapshot, restoreSnapshot
+
+
+def tableEntry(table_id, dst, port):
+    entity = p4runtime_pb2.Entity()
+    entry = entity.table_entry
+    entry.table_id = table_id
+    m = entry.match.add()
+    m.field_id = 1
+    m.lpm.value = dst
+    m.lpm.prefix_len = 32
+    entry.action.action.action_id = 7
+    param = entry.action.action.params.add()
+    param.param_id = 2
+    param.value = bytes([port])
+    return entity
+
+
+def counterEntry(counter_id, index, packets):
+    entity = p4runtime_pb2.Entity()
+    entity.counter_entry.counter_id = counter_id
+    entity.counter_entry.index.index = index
+    entity.counter_entry.data.packet_count = packets
+    entity.counter_entry.data.byte_count = packets * 100
+    return entity
+
+
+def registerEntry(register_id, index, value):
+    entity = p4runtime_pb2.Entity()
+    entity.register_entry.register_id = register_id
+    entity.register_entry.index.index = index
+    entity.register_entry.data.bitstring = value
+    return entity
+
+
+def readAll(sw):
+    request = p4runtime_pb2.ReadRequest()
+    request.device_id = sw.device_id
+    for kind in ('table_entry', 'counter_entry', 'register_entry'):
+        getattr(request.entities.add(), kind).SetInParent()
+    return sorted(e.SerializeToString(deterministic=True)
+                  for response in sw.client_stub.Read(request) for e in response.entities)
+
+
+@pytest.fixture
+def standin():
+    server, standin, address = startStandIn()
+    sw = StandInSwitch(address)
+    yield standin, sw
+    sw.close()
+    server.stop(0)
+
+
+def test_snapshot_round_trip(standin, tmp_path):
+    standin, sw = standin
+    entities = [tableEntry(0x02000001, bytes([10, 0, i >> 8, i & 0xff]), i % 8) for i in range(300)]
+    entities += [counterEntry(0x12000001, i, i * 3) for i in range(8)]
+    entities += [registerEntry(0x13000001, i, bytes([i])) for i in range(8)]
+    updates = []
+    for entity in entities:
+        update = p4runtime_pb2.Update()
+        update.type = p4runtime_pb2.Update.INSERT
+        update.entity.CopyFrom(entity)
+        updates.append(update)
+    writeUpdates(sw, updates)
+    before = readAll(sw)
+    assert len(before) == len(entities)
+
+    path = str(tmp_path / 's1.snap')
+    assert captureSnapshot(sw, path) == len(entities)
+    standin.entities.clear()
+    assert readAll(sw) == []
+
+    # batch_size小于表项数，覆盖多批写入
+    assert restoreSnapshot(sw, path, batch_size=64) == len(entities)
+    assert readAll(sw) == before
+
+
+def test_restore_rejects_other_files(standin, tmp_path):
+    _, sw = standin
+    path = tmp_path / 'not.snap'
+    path.write_bytes(b'x' * 64)
+    with pytest.raises(ValueError):
+        restoreSnapshot(sw, str(path))
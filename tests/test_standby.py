@@ -0,0 +1,114 @@
+import queue
+import socket
+import time
+
+import pytest
+
+pytest.importorskip('grpc')
+pytest.importorskip('p4runtime_lib')
+from google.rpc import code_pb2
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.standby import RECORD_HEADER, StandbyController, StatePublisher
+
+
+def writeRequest(table_id):
+    request = p4runtime_pb2.WriteRequest()
+    update = request.updates.add()
+    update.type = p4runtime_pb2.Update.INSERT
+    update.entity.table_entry.table_id = table_id
+    return request.SerializeToString()
+
+
+def waitFor(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def publisher():
+    publisher = StatePublisher(('127.0.0.1', 0), heartbeat_interval=0.01)
+    yield publisher
+    publisher.close()
+
+
+def test_publisher_skips_undecodable_writes(publisher):
+    publisher.publishWrite('s1', b'\xff\xff\xff')
+    publisher.publishWrite('s1', writeRequest(1))
+    waitFor(lambda: publisher.state.count() == 1)
+    assert publisher._publisher.is_alive()
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_heartbeat_stops_with_publisher(publisher):
+    conn = socket.create_connection(publisher.sock.getsockname())
+    conn.settimeout(0.5)
+    try:
+        assert RECORD_HEADER.unpack(conn.recv(RECORD_HEADER.size))[0] == 0
+        # 不是(kind, switch_name, payload)的记录让转发线程本身退出
+        publisher._queue.put(0)
+        waitFor(lambda: not publisher._publisher.is_alive())
+        conn.settimeout(0.1)
+        with pytest.raises(socket.timeout):
+            while True:
+                conn.recv(4096)
+    finally:
+        conn.close()
+
+
+class FakeSwitch(object):
+
+    def __init__(self, name, read_error=None):
+        self.name = name
+        self.device_id = 0
+        self.requests_stream = queue.Queue()
+        self.read_error = read_error
+        self.client_stub = self
+
+    def Read(self, request):
+        raise self.read_error
+
+
+def standby(*switches):
+    controller = StandbyController([sw.name for sw in switches], ('127.0.0.1', 1), 10)
+    for sw in switches:
+        controller.switches[sw.name] = sw
+        controller._arbitration[sw.name] = queue.Queue()
+    return controller
+
+
+def grant(controller, name, election_id):
+    update = p4runtime_pb2.MasterArbitrationUpdate()
+    update.election_id.low = election_id
+    update.status.code = code_pb2.OK
+    controller._arbitration[name].put(update)
+
+
+def test_unanswered_claim_is_a_failed_takeover():
+    controller = standby(FakeSwitch('s1'), FakeSwitch('s2', RuntimeError('unused')))
+    grant(controller, 's2', 9)          # 仍是旧的主控制器，不算取得primary身份
+    report = controller.takeover(timeout=0.05)
+    assert report['failed'] == ['s1', 's2']
+    assert report['switches'] == {}
+    assert controller.wait(0) is report
+
+
+def test_wait_raises_when_takeover_fails():
+    controller = standby(FakeSwitch('s1', RuntimeError('read failed')))
+    grant(controller, 's1', 11)
+    with pytest.raises(RuntimeError):
+        controller.takeover(timeout=1.0)
+    with pytest.raises(RuntimeError, match='read failed'):
+        controller.wait(0)
+
+
+def test_wait_times_out_before_takeover():
+    assert standby(FakeSwitch('s1')).wait(0.01) is None
+
+
+def test_takeover_without_switches():
+    report = standby().takeover(timeout=0.05)
+    assert report['switches'] == {}
+    assert report['failed'] == []
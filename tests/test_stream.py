@@ -0,0 +1,261 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('grpc')
+pytest.importorskip('p4runtime_lib')
+from p4.config.v1 import p4info_pb2
+from p4.v1 import p4runtime_pb2
+
+from conftest import StandInSwitch, startStandIn
+from p4ctl import stream
+from p4ctl.stream import StreamHandler
+
+
+class RecordingQueue(object):
+    """
+    代替sw.requests_stream：记下控制器经StreamChannel发出的消息，再转给替身。
+    """
+
+    def __init__(self, requests):
+        self.requests = requests
+        self.sent = []
+
+    def put(self, request):
+        self.sent.append(request)
+        self.requests.put(request)
+
+
+def helper():
+    p4info = p4info_pb2.P4Info()
+    packet_in = p4info.controller_packet_metadata.add()
+    packet_in.preamble.name = 'packet_in'
+    for md_id, name, bitwidth in ((1, 'ingress_port', 9), (2, '_pad', 7)):
+        m = packet_in.metadata.add()
+        m.id, m.name, m.bitwidth = md_id, name, bitwidth
+    packet_out = p4info.controller_packet_metadata.add()
+    packet_out.preamble.name = 'packet_out'
+    for md_id, name, bitwidth in ((1, 'egress_port', 9), (2, '_pad', 7)):
+        m = packet_out.metadata.add()
+        m.id, m.name, m.bitwidth = md_id, name, bitwidth
+    return SimpleNamespace(p4info=p4info)
+
+
+@pytest.fixture
+def switch(monkeypatch):
+    monkeypatch.setattr(stream, 'encode',
+                        lambda value, bitwidth: value.to_bytes((bitwidth + 7) // 8, 'big'))
+    server, standin, address = startStandIn()
+    sw = StandInSwitch(address)
+    sw.requests_stream = RecordingQueue(sw.requests)
+    yield sw, standin
+    sw.close()
+    server.stop(0)
+
+
+def packetIn(seq, port=1):
+    msg = p4runtime_pb2.StreamMessageResponse()
+    msg.packet.payload = b'packet %d' % seq
+    md = msg.packet.metadata.add()
+    md.metadata_id = 1
+    md.value = port.to_bytes(2, 'big')
+    return msg
+
+
+def digestList(seq):
+    msg = p4runtime_pb2.StreamMessageResponse()
+    msg.digest.digest_id = 7
+    msg.digest.list_id = seq
+    return msg
+
+
+def inject(standin, msgs):
+    # 替身只有一条流，即sw的StreamChannel
+    for msg in msgs:
+        standin.streams[0].out.put(msg)
+
+
+async def until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        await asyncio.sleep(0.01)
+
+
+async def finish(handler, tasks):
+    handler.stop()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_backpressure_blocks_reader_until_queue_drains(switch):
+    sw, standin = switch
+    handler = StreamHandler(helper(), queue_size=2, batch_size=1)
+    handler.addSwitch(sw)
+    seen = []
+
+    async def body():
+        release = asyncio.Event()
+
+        @handler.onPacketIn
+        async def onPacketIn(sw, packet):
+            seen.append(packet.payload)
+            await release.wait()
+
+        tasks = handler.start()
+        inject(standin, [packetIn(i) for i in range(10)])
+        await until(lambda: seen and handler._queues[sw.name].full())
+        await asyncio.sleep(0.2)
+        # 一个在处理中，两个在队列里，读线程阻塞在put上，什么都没丢
+        assert len(seen) == 1
+        assert handler._putting
+        assert handler.stats[sw.name]['dropped'] == 0
+        release.set()
+        await until(lambda: len(seen) == 10)
+        assert seen == [b'packet %d' % i for i in range(10)]
+        assert handler.stats[sw.name]['max_depth'] == 2
+        await finish(handler, tasks)
+
+    asyncio.run(body())
+
+
+def test_stop_wakes_reader_blocked_on_full_queue(switch):
+    sw, standin = switch
+    handler = StreamHandler(helper(), queue_size=1, batch_size=1, poll_interval=0.05)
+    handler.addSwitch(sw)
+
+    async def body():
+        handler.onPacketIn(lambda sw, packet: asyncio.Event().wait())
+        tasks = handler.start()
+        inject(standin, [packetIn(i) for i in range(5)])
+        await until(lambda: handler._putting)
+        reader = next(iter(handler._putting))
+        start = time.monotonic()
+        handler.stop()
+        assert not reader.is_alive()
+        assert time.monotonic() - start < 1.0
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(body())
+
+
+def test_drop_when_full_counts_dropped_events(switch):
+    sw, standin = switch
+    handler = StreamHandler(helper(), queue_size=2, batch_size=1, drop_when_full=True)
+    handler.addSwitch(sw)
+    seen = []
+
+    async def body():
+        release = asyncio.Event()
+
+        @handler.onPacketIn
+        async def onPacketIn(sw, packet):
+            seen.append(int(packet.payload.split()[1]))
+            await release.wait()
+
+        tasks = handler.start()
+        inject(standin, [packetIn(i) for i in range(10)])
+        stats = handler.stats[sw.name]
+        await until(lambda: len(seen) + stats['dropped'] + handler._queues[sw.name].qsize() == 10)
+        release.set()
+        await until(lambda: len(seen) + stats['dropped'] == 10)
+        # 最多一个在处理中、两个在队列里
+        assert stats['dropped'] >= 7
+        assert seen == sorted(seen) and seen[0] == 0
+        assert not handler._putting
+        await finish(handler, tasks)
+
+    asyncio.run(body())
+
+
+def test_batched_dispatch_acks_digests_at_batch_end(switch):
+    sw, standin = switch
+    handler = StreamHandler(helper(), batch_size=4)
+    handler.addSwitch(sw)
+    pending = []
+
+    async def body():
+        release = asyncio.Event()
+
+        @handler.onDigest
+        async def onDigest(sw, digest):
+            # 本批中已处理的digest还没有确认
+            pending.append(len(handler._pending_acks[sw.name]))
+            if digest.list_id == 0:
+                await release.wait()
+
+        tasks = handler.start()
+        inject(standin, [digestList(i) for i in range(10)])
+        await until(lambda: handler._queues[sw.name].qsize() == 9)
+        release.set()
+        await until(lambda: handler.stats[sw.name][stream.DIGEST] == 10
+                    and not handler._pending_acks[sw.name])
+        assert pending == [0, 0, 1, 2, 3, 0, 1, 2, 3, 0]
+        acks = [r.digest_ack for r in sw.requests_stream.sent]
+        assert [(a.digest_id, a.list_id) for a in acks] == [(7, i) for i in range(10)]
+        await finish(handler, tasks)
+
+    asyncio.run(body())
+
+
+def test_handler_errors_are_counted(switch):
+    sw, standin = switch
+    handler = StreamHandler(helper())
+    handler.addSwitch(sw)
+
+    async def body():
+        handler.onPacketIn(lambda sw, packet: 1 / 0)
+        tasks = handler.start()
+        inject(standin, [packetIn(0), packetIn(1)])
+        await until(lambda: handler.stats[sw.name][stream.PACKET_IN] == 2)
+        assert handler.stats[sw.name]['errors'] == 2
+        await finish(handler, tasks)
+
+    asyncio.run(body())
+
+
+def test_decode_packet_in_metadata(switch):
+    sw, standin = switch
+    handler = StreamHandler(helper())
+    handler.addSwitch(sw)
+    seen = []
+
+    async def body():
+        handler.onPacketIn(lambda sw, packet: seen.append(packet))
+        tasks = handler.start()
+        inject(standin, [packetIn(0, port=3)])
+        await until(lambda: seen)
+        await finish(handler, tasks)
+
+    asyncio.run(body())
+    assert seen[0].payload == b'packet 0'
+    assert seen[0].metadata == {'ingress_port': 3}
+    unknown = p4runtime_pb2.PacketIn(payload=b'x')
+    unknown.metadata.add(metadata_id=9, value=b'\x01\x00')
+    assert handler.decodePacketIn(unknown).metadata == {9: 256}
+
+
+def test_send_packet_out_encodes_metadata(switch):
+    sw, _ = switch
+    handler = StreamHandler(helper())
+    handler.sendPacketOut(sw, b'probe', egress_port=2, _pad=0)
+    packet = sw.requests_stream.sent[-1].packet
+    assert packet.payload == b'probe'
+    assert [(m.metadata_id, m.value) for m in packet.metadata] == [(1, b'\x00\x02'), (2, b'\x00')]
+    with pytest.raises(KeyError):
+        handler.sendPacketOut(sw, b'probe', ingress_port=2)
+
+
+def test_flush_digest_acks_sends_pending_in_order(switch):
+    sw, _ = switch
+    handler = StreamHandler(helper())
+    handler.addSwitch(sw)
+    for list_id in (3, 1, 2):
+        handler.ackDigest(sw, SimpleNamespace(digest_id=5, list_id=list_id))
+    assert sw.requests_stream.sent == []
+    handler.flushDigestAcks(sw)
+    assert [(r.digest_ack.digest_id, r.digest_ack.list_id)
+            for r in sw.requests_stream.sent] == [(5, 3), (5, 1), (5, 2)]
+    handler.flushDigestAcks(sw)
+    assert len(sw.requests_stream.sent) == 3
@@ -0,0 +1,117 @@
+import copy
+import ipaddress
+import json
+import os
+
+import pytest
+
+from conftest import ROOT
+from p4ctl import topogen
+from p4ctl.topo import Topology
+
+MRC = os.path.join(ROOT, '大作业', 'mrc')
+
+
+def test_fat_tree_shape():
+    topo = topogen.fatTree(4)
+    assert len(topo['switches']) == 20
+    assert len(topo['hosts']) == 16
+    # 每台主机一条接入链路，外加 接入-汇聚 和 汇聚-核心 各16条
+    assert len(topo['links']) == 16 + 16 + 16
+    assert topo['hosts']['h1']['ip'] == '10.0.1.1/24'
+    assert topo['hosts']['h1']['mac'] == '08:00:00:00:01:01'
+    with pytest.raises(ValueError):
+        topogen.fatTree(3)
+
+
+@pytest.mark.parametrize('topo', [topogen.fatTree(4), topogen.leafSpine(4, 3, 2)])
+@pytest.mark.parametrize('classes', [1, 3])
+def test_generated_runtimes_verify(topo, classes):
+    runtimes = topogen.buildRuntime(topo, classes)
+    for table in topogen.LPM_TABLES[:classes]:
+        pairs, failures = topogen.verifyRuntime(topo, runtimes, table)
+        assert pairs == len(topo['hosts']) * (len(topo['hosts']) - 1)
+        assert failures == []
+
+
+def link(a, b):
+    return frozenset((a, b))
+
+
+def test_isolate_links_keeps_edges_connected():
+    topology = Topology(topogen.leafSpine(2, 2, 1))
+    # s1、s2是leaf，s3、s4是spine：每个备用配置隔离一台spine
+    assert topogen.isolateLinks(topology, 3) == [
+        set(), {link('s1', 's3'), link('s2', 's3')}, {link('s1', 's4'), link('s2', 's4')}]
+    with open(os.path.join(MRC, 'triangle-topo', 'topology.json')) as f:
+        triangle = Topology(json.load(f))
+    # 三角形中任意两条链路都不能同时隔离，第三条链路没有备用配置
+    assert topogen.isolateLinks(triangle, 3) == [set(), {link('s1', 's2')}, {link('s1', 's3')}]
+
+
+def test_backup_classes_avoid_isolated_links():
+    topo = topogen.leafSpine(2, 2, 1)
+    rules = dict((sw, r['table_entries']) for sw, r in topogen.buildRuntime(topo, 3).items())
+    dst = int(ipaddress.IPv4Address('10.0.2.1'))
+    ports = [topogen.lookupRoute(topogen.buildFib(rules, table), 's1', dst)[1]
+             for table in topogen.LPM_TABLES]
+    # 上行端口2接s3、3接s4
+    assert ports[1:] == [3, 2]
+
+
+def test_add_backup_routes_keeps_other_tables():
+    topo = topogen.leafSpine(2, 1, 1)
+    runtimes = topogen.buildRuntime(topo, 1)
+    primary = copy.deepcopy(runtimes)
+    runtimes['s1']['table_entries'].append(
+        topogen._entry('MyIngress.ipv4_lpm3', ('10.9.9.9', 32), 'aa', 9))
+    topogen.addBackupRoutes(topo, runtimes, 2)
+    for sw, runtime in runtimes.items():
+        tables = [e['table'] for e in runtime['table_entries']]
+        assert 'MyIngress.ipv4_lpm3' not in tables
+        assert [e for e in runtime['table_entries'] if e['table'] != 'MyIngress.ipv4_lpm2'] == \
+            primary[sw]['table_entries']
+    assert topogen.verifyRuntime(topo, runtimes, 'MyIngress.ipv4_lpm2')[1] == []
+
+
+def test_lookup_route_longest_prefix():
+    rules = {'s1': [topogen._entry('MyIngress.ipv4_lpm', ('10.0.0.0', 8), 'aa', 1),
+                    topogen._entry('MyIngress.ipv4_lpm', ('10.0.1.0', 24), 'bb', 2),
+                    topogen._entry('MyIngress.ipv4_lpm2', ('10.0.1.1', 32), 'cc', 3)]}
+    fib = topogen.buildFib(rules)
+    assert topogen.lookupRoute(fib, 's1', int(ipaddress.IPv4Address('10.0.1.9'))) == ('bb', 2)
+    assert topogen.lookupRoute(fib, 's1', int(ipaddress.IPv4Address('10.9.0.1'))) == ('aa', 1)
+    assert topogen.lookupRoute(fib, 's1', int(ipaddress.IPv4Address('11.0.0.1'))) is None
+    assert topogen.lookupRoute(fib, 's2', 0) is None
+
+
+def test_verify_reports_broken_routes():
+    topo = topogen.leafSpine(2, 1, 1)
+    runtimes = topogen.buildRuntime(topo)
+    broken = copy.deepcopy(runtimes)
+    # s3是spine：删掉它到h2子网的路由，h1->h2出现黑洞
+    broken['s3']['table_entries'] = [
+        e for e in broken['s3']['table_entries']
+        if e.get('match', {}).get('hdr.ipv4.dstAddr') != ['10.0.2.0', 24]]
+    assert topogen.verifyRuntime(topo, broken) == (2, [('h1', 'h2', 'no route on s3')])
+
+    looped = copy.deepcopy(runtimes)
+    for e in looped['s3']['table_entries']:
+        if e.get('match', {}).get('hdr.ipv4.dstAddr') == ['10.0.2.0', 24]:
+            e['action_params']['port'] = 1
+    pairs, failures = topogen.verifyRuntime(topo, looped)
+    assert failures == [('h1', 'h2', 'loop at s1')]
+
+
+@pytest.mark.parametrize('name', ['triangle-topo'])
+def test_shipped_runtimes_verify(name):
+    with open(os.path.join(MRC, name, 'topology.json')) as f:
+        topo = json.load(f)
+    runtimes = {}
+    for sw in topo['switches']:
+        with open(os.path.join(MRC, name, '%s-runtime.json' % sw)) as f:
+            runtimes[sw] = json.load(f)
+    # 默认配置和附带的备用配置都要能送达所有主机
+    for table in topogen.LPM_TABLES:
+        pairs, failures = topogen.verifyRuntime(topo, runtimes, table)
+        assert pairs and failures == []
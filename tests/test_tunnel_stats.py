@@ -0,0 +1,199 @@
+import threading
+from array import array
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('p4runtime_lib')
+
+from p4ctl import tunnel_stats
+from p4ctl.tunnel_stats import (EGRESS_COUNTER, INGRESS_COUNTER, TunnelAccounting,
+                                TunnelSnapshot, WindowStats)
+
+
+def tunnel(tunnel_id, src, dst, host='h2'):
+    return SimpleNamespace(tunnel_id=tunnel_id, src=src, dst=dst, host=host)
+
+
+class FakeCounters(object):
+    """
+    counters[(switch, counter name)][tunnel id] = [packets, bytes]
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.reads = []
+
+    def send(self, tunnel_id, src, dst, packets, size=100, lost=0):
+        ingress = self.counters.setdefault((src, INGRESS_COUNTER), {}).setdefault(tunnel_id, [0, 0])
+        egress = self.counters.setdefault((dst, EGRESS_COUNTER), {}).setdefault(tunnel_id, [0, 0])
+        ingress[0] += packets
+        ingress[1] += packets * size
+        egress[0] += packets - lost
+        egress[1] += (packets - lost) * size
+
+    def read(self, sw, p4info_helper, counter_name, indices):
+        indices = list(indices)
+        self.reads.append((sw, counter_name, indices))
+        cells = self.counters.get((sw, counter_name), {})
+        return (array('Q', (cells.get(i, [0, 0])[0] for i in indices)),
+                array('Q', (cells.get(i, [0, 0])[1] for i in indices)))
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    fake = FakeCounters()
+    monkeypatch.setattr(tunnel_stats, 'readCounterCells', fake.read)
+    return fake
+
+
+def accounting(tunnels, alerts=None, **kwargs):
+    manager = SimpleNamespace(tunnels=dict((t.tunnel_id, t) for t in tunnels))
+    on_alert = (lambda t, loss, cleared: alerts.append((t.tunnel_id, cleared))) \
+        if alerts is not None else None
+    return TunnelAccounting(manager, lambda name: name, None, on_alert=on_alert, **kwargs)
+
+
+def snapshot(t, in_packets, in_bytes, out_packets, out_bytes):
+    return TunnelSnapshot(t, 0.0, *(tunnel_stats._vector(array('Q', v)) for v in
+                                    (in_packets, in_bytes, out_packets, out_bytes)))
+
+
+def test_window_stats():
+    first = snapshot(1.0, [10, 0], [1000, 0], [10, 0], [1000, 0])
+    last = snapshot(3.0, [110, 5], [11000, 500], [100, 5], [10000, 500])
+    stats = WindowStats(first, last)
+    assert stats.seconds == 2.0
+    assert list(stats.sent) == [100, 5]
+    assert list(stats.received) == [90, 5]
+    assert list(stats.offered) == [5000, 250]
+    assert list(stats.throughput) == [4500, 250]
+    assert list(stats.loss) == pytest.approx([0.1, 0.0])
+
+
+def test_loss_of_idle_tunnel_is_zero():
+    first = snapshot(0.0, [7], [700], [7], [700])
+    stats = WindowStats(first, snapshot(1.0, [7], [700], [7], [700]))
+    assert list(stats.loss) == [0.0]
+
+
+def test_snapshot_reads_each_counter_once(counters):
+    tunnels = [tunnel(101, 's1', 's2'), tunnel(102, 's1', 's3'), tunnel(201, 's2', 's1')]
+    acc = accounting(tunnels)
+    counters.send(101, 's1', 's2', 10)
+    counters.send(102, 's1', 's3', 20, lost=2)
+    counters.send(201, 's2', 's1', 30)
+    acc.poll()
+    assert sorted((sw, name) for sw, name, _ in counters.reads) == sorted([
+        ('s1', INGRESS_COUNTER), ('s2', EGRESS_COUNTER), ('s3', EGRESS_COUNTER),
+        ('s2', INGRESS_COUNTER), ('s1', EGRESS_COUNTER)])
+    assert dict(((sw, name), ids) for sw, name, ids in counters.reads)[('s1', INGRESS_COUNTER)] \
+        == [101, 102]
+    last = acc.history[-1]
+    assert list(last.in_packets) == [10, 20, 30]
+    assert list(last.out_packets) == [10, 18, 30]
+    assert acc.window() is None
+    acc.close()
+
+
+def test_loss_alert_and_clear(counters):
+    alerts = []
+    acc = accounting([tunnel(101, 's1', 's2')], alerts, window=1, loss_threshold=0.05,
+                     min_packets=20)
+    acc.poll()
+    counters.send(101, 's1', 's2', 10, lost=5)
+    acc.poll()
+    # 报文太少，不告警
+    assert alerts == []
+    counters.send(101, 's1', 's2', 100, lost=10)
+    acc.poll()
+    assert alerts == [(101, False)]
+    assert acc.alarms == {101}
+    counters.send(101, 's1', 's2', 100, lost=4)
+    acc.poll()
+    # 4%仍高于阈值的一半，不解除
+    assert alerts == [(101, False)]
+    counters.send(101, 's1', 's2', 100, lost=1)
+    acc.poll()
+    assert alerts == [(101, False), (101, True)]
+    assert acc.alarms == set()
+    acc.close()
+
+
+def test_tunnel_change_restarts_window(counters):
+    tunnels = [tunnel(101, 's1', 's2')]
+    acc = accounting(tunnels)
+    acc.poll()
+    acc.poll()
+    assert len(acc.history) == 2
+    acc.manager.tunnels[102] = tunnel(102, 's2', 's1')
+    acc.poll()
+    assert len(acc.history) == 1
+    assert [t.tunnel_id for t in acc.tunnels] == [101, 102]
+    assert len(acc.history[0].in_packets) == 2
+    acc.close()
+
+
+def test_report_concurrent_with_poll(counters, capsys):
+    acc = accounting([tunnel(101, 's1', 's2')], alerts=[], window=2)
+    acc.poll()
+    acc.poll()
+    stop = threading.Event()
+    errors = []
+
+    def report():
+        try:
+            while not stop.is_set():
+                acc.printReport()
+        except Exception as e:
+            errors.append(e)
+
+    reporter = threading.Thread(target=report)
+    reporter.start()
+    try:
+        # 隧道集合来回变化，每次poll都会清空窗口并换掉tunnels
+        for i in range(200):
+            if i % 2:
+                acc.manager.tunnels[102] = tunnel(102, 's2', 's1')
+            else:
+                acc.manager.tunnels.pop(102, None)
+            counters.send(101, 's1', 's2', 10)
+            acc.poll()
+            acc.poll()
+    finally:
+        stop.set()
+        reporter.join()
+        acc.close()
+    assert errors == []
+    assert 'Tunnels over the last' in capsys.readouterr().out
+
+
+def test_removed_tunnel_alarm_is_not_inherited(counters):
+    alerts = []
+    acc = accounting([tunnel(101, 's1', 's2')], alerts, window=1, min_packets=20)
+    acc.poll()
+    counters.send(101, 's1', 's2', 100, lost=50)
+    acc.poll()
+    assert acc.alarms == {101}
+    # 两次采样之间隧道被删除，新隧道复用了ID 101
+    acc.manager.tunnels = {101: tunnel(101, 's1', 's3')}
+    acc.poll()
+    assert acc.alarms == set()
+    counters.send(101, 's1', 's3', 100, lost=30)
+    acc.poll()
+    assert alerts == [(101, False), (101, False)]
+    acc.close()
+
+
+def test_removed_tunnel_alarm_is_dropped(counters):
+    acc = accounting([tunnel(101, 's1', 's2'), tunnel(102, 's1', 's3')], [], window=1)
+    acc.poll()
+    counters.send(101, 's1', 's2', 100, lost=50)
+    counters.send(102, 's1', 's3', 100, lost=50)
+    acc.poll()
+    assert acc.alarms == {101, 102}
+    del acc.manager.tunnels[102]
+    acc.poll()
+    # 仍存在的隧道保留告警
+    assert acc.alarms == {101}
+    acc.close()
@@ -0,0 +1,102 @@
+import pytest
+
+pytest.importorskip('p4.v1.p4runtime_pb2')
+
+import p4ctl.tunnels as tunnels
+from p4ctl.topo import Topology
+from p4ctl.tunnels import IdAllocator, TunnelManager
+
+# 三台交换机成环，每台一台主机(与basic练习的triangle-topo相同)
+TRIANGLE = {
+    'hosts': {
+        'h1': {'ip': '10.0.1.1/24', 'mac': '08:00:00:00:01:11'},
+        'h2': {'ip': '10.0.2.2/24', 'mac': '08:00:00:00:02:22'},
+        'h3': {'ip': '10.0.3.3/24', 'mac': '08:00:00:00:03:33'},
+    },
+    'switches': {'s1': {}, 's2': {}, 's3': {}},
+    'links': [['h1', 's1-p1'], ['h2', 's2-p1'], ['h3', 's3-p1'],
+              ['s1-p2', 's2-p2'], ['s1-p3', 's3-p2'], ['s2-p3', 's3-p3']],
+}
+
+
+class FakeHelper(object):
+    def buildTableEntry(self, **kwargs):
+        return kwargs
+
+
+class FakeWriter(object):
+    """
+    代替writeTableEntries，记录每次写入；fail_on中的交换机写入时抛出异常。
+    """
+
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.writes = []
+
+    def __call__(self, sw, entries, batch_size=None, update_type=None):
+        if sw in self.fail_on and update_type is None:
+            raise RuntimeError("write to %s failed" % sw)
+        self.writes.append((sw, update_type, list(entries)))
+        return len(entries)
+
+
+def makeManager(monkeypatch, writer):
+    monkeypatch.setattr(tunnels, 'writeTableEntries', writer)
+    return TunnelManager(FakeHelper(), Topology(TRIANGLE), lambda name: name)
+
+
+def test_allocator_is_compact():
+    ids = IdAllocator(first=1, last=4)
+    assert [ids.allocate() for _ in range(3)] == [1, 2, 3]
+    ids.release(2)
+    ids.release(1)
+    assert len(ids) == 1
+    assert [ids.allocate() for _ in range(3)] == [1, 2, 4]
+    with pytest.raises(RuntimeError):
+        ids.allocate()
+
+
+def test_provision_full_mesh(monkeypatch):
+    writer = FakeWriter()
+    manager = makeManager(monkeypatch, writer)
+    new = manager.provision()
+    # 3台边缘交换机到另外两台交换机上的主机
+    assert len(new) == 6
+    assert sorted(t.tunnel_id for t in new) == list(range(1, 7))
+    assert len(manager._local) == 3
+    assert manager.tunnels[('s1', 'h2')].path == [('s1', 2), ('s2', None)]
+    # 入口规则在转发/出口规则之后写入
+    stages = [entries[0]['action_name'] for _, _, entries in writer.writes]
+    assert stages.index('MyIngress.myTunnel_ingress') > stages.index('MyIngress.myTunnel_egress')
+    assert manager.provision() == []
+
+
+def test_failed_write_rolls_back(monkeypatch):
+    writer = FakeWriter(fail_on=['s3'])
+    manager = makeManager(monkeypatch, writer)
+    with pytest.raises(RuntimeError):
+        manager.provision()
+    assert manager.tunnels == {} and manager._local == set()
+    assert len(manager.allocator) == 0
+    # 已写入的规则(连同写到一半的s3)按相反顺序删除
+    written = [sw for sw, t, _ in writer.writes if t is None]
+    deleted = [sw for sw, t, _ in writer.writes if t is not None]
+    assert written and deleted == list(reversed(written + ['s3']))
+
+    writer.fail_on.clear()
+    new = manager.provision()
+    assert sorted(t.tunnel_id for t in new) == list(range(1, 7))
+
+
+def test_add_edge_switch_only_adds_its_tunnels(monkeypatch):
+    manager = makeManager(monkeypatch, FakeWriter())
+    manager.provision()
+    topology = manager.topology
+    topology.addSwitch('s4')
+    topology.addHost('h4', {'ip': '10.0.4.4/24', 'mac': '08:00:00:00:04:44'})
+    topology.addLink('h4', 's4-p1')
+    topology.addLink('s4-p2', 's1-p4')
+    new = manager.addEdgeSwitch('s4')
+    assert sorted((t.src, t.host) for t in new) == [
+        ('s1', 'h4'), ('s2', 'h4'), ('s3', 'h4'), ('s4', 'h1'), ('s4', 'h2'), ('s4', 'h3')]
+    assert sorted(t.tunnel_id for t in new) == list(range(7, 13))
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+常驻的主机侧收发包代理。每个Mininet主机上起一个：
+
+    mininet> h1 python3 agent.py --name h1 &
+
+它在eth0上保持一个AF_PACKET原始套接字，用struct直接拼以太网/IPv4/TCP/UDP报文，
+并在后台线程里统计收到的IPv4报文；测试脚本通过Unix套接字
+(/tmp/p4agent-h1.sock)按行发送JSON命令，每条命令回一行JSON。所有主机共用/tmp，
+而且P4Host把每台主机的接口都改名为eth0，所以套接字路径由--name给出的主机名决定：
+
+    {"cmd": "send", "dst": "10.0.2.2", "count": 1000, "dport": 1234, "tos": 4}
+    {"cmd": "batch", "packets": [{"dst": "10.0.2.2"}, {"dst": "10.0.3.3", "proto": "udp"}]}
+    {"cmd": "recv", "max": 100, "timeout": 1.0, "dport": 1234}
+    {"cmd": "stats"}
+    {"cmd": "reset"}
+
+AgentClient是对应的Python客户端。
+"""
+import argparse
+import collections
+import fcntl
+import json
+import os
+import random
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from array import array
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+SIOCGIFADDR = 0x8915
+PROTOCOLS = {'tcp': 6, 'udp': 17}
+
+ETH_HEADER = struct.Struct('!6s6sH')
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+TCP_HEADER = struct.Struct('!HHIIBBHHH')
+UDP_HEADER = struct.Struct('!HHHH')
+
+
+def get_if():
+    ifaces = [i for i in os.listdir('/sys/class/net/') if 'eth0' in i]
+    if not ifaces:
+        print("Cannot find eth0 interface")
+        exit(1)
+    return ifaces[0]
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    s = sum(array('H', data))
+    s = (s >> 16) + (s & 0xffff)
+    s += s >> 16
+    # 按本机字节序求和，结果也按本机字节序写回，与网络字节序无关
+    return struct.pack('=H', ~s & 0xffff)
+
+
+def _parseIpv4(frame):
+    """
+    :return: the IPv4 fields of an Ethernet frame as a dict, None if it is not IPv4
+    """
+    if len(frame) < 34 or ETH_HEADER.unpack_from(frame)[2] != ETH_P_IP:
+        return None
+    (ver_ihl, tos, length, ip_id, _, ttl, proto, _, src, dst) = IPV4_HEADER.unpack_from(frame, 14)
+    # 带IP选项时L4头在IHL*4字节之后
+    l4 = 14 + (ver_ihl & 0x0f) * 4
+    sport = dport = None
+    if proto in (6, 17) and len(frame) >= l4 + 4:
+        sport, dport = struct.unpack_from('!HH', frame, l4)
+    return {'src': socket.inet_ntoa(src), 'dst': socket.inet_ntoa(dst), 'proto': proto,
+            'tos': tos, 'ttl': ttl, 'id': ip_id, 'len': length,
+            'sport': sport, 'dport': dport}
+
+
+def _mac(addr):
+    return bytes(int(b, 16) for b in addr.split(':'))
+
+
+class PacketAgent(object):
+
+    def __init__(self, iface):
+        self.iface = iface
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.sock.bind((iface, 0))
+        self.src_mac = self.sock.getsockname()[4]
+        self.src_ip = fcntl.ioctl(self.sock.fileno(), SIOCGIFADDR,
+                                  struct.pack('256s', iface.encode()[:15]))[20:24]
+        # stats、received和ip_id都由同一把锁保护；cond用于等待新报文
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.ip_id = random.randint(0, 0xffff)
+        self.received = collections.deque(maxlen=65536)
+        self.resetStats()
+        t = threading.Thread(target=self._sniff, daemon=True)
+        t.start()
+
+    def resetStats(self):
+        self.stats = {'sent': 0, 'send_errors': 0, 'received': 0, 'ipv4': 0,
+                      'dropped': 0, 'started': time.time()}
+        self.received.clear()
+
+    def buildPacket(self, spec):
+        """
+        spec字段：dst(必填), proto(tcp/udp), sport, dport, tos, ttl, payload,
+        dst_mac(默认广播，与send.py一致)。返回 (不含IP头的以太网头, IP头参数, L4数据)。
+        """
+        dst_ip = socket.inet_aton(spec['dst'])
+        proto = PROTOCOLS[spec.get('proto', 'tcp')]
+        sport = spec.get('sport') or random.randint(49152, 65535)
+        dport = spec.get('dport', 1234)
+        payload = spec.get('payload', '').encode('utf-8')
+        if proto == 6:
+            l4 = TCP_HEADER.pack(sport, dport, 0, 0, 5 << 4, 0x02, 8192, 0, 0) + payload
+        else:
+            l4 = UDP_HEADER.pack(sport, dport, UDP_HEADER.size + len(payload), 0) + payload
+        pseudo = self.src_ip + dst_ip + struct.pack('!BBH', 0, proto, len(l4))
+        csum = _checksum(pseudo + l4)
+        offset = 16 if proto == 6 else 6
+        l4 = l4[:offset] + csum + l4[offset + 2:]
+        eth = ETH_HEADER.pack(_mac(spec.get('dst_mac', 'ff:ff:ff:ff:ff:ff')),
+                              self.src_mac, ETH_P_IP)
+        return eth, (spec.get('tos', 0), spec.get('ttl', 64), proto, dst_ip), l4
+
+    def _ipHeader(self, ip_args, length):
+        tos, ttl, proto, dst_ip = ip_args
+        with self.lock:
+            self.ip_id = (self.ip_id + 1) & 0xffff
+            ip_id = self.ip_id
+        header = IPV4_HEADER.pack(0x45, tos, 20 + length, ip_id, 0, ttl, proto, 0,
+                                  self.src_ip, dst_ip)
+        return header[:10] + _checksum(header) + header[12:]
+
+    def send(self, spec):
+        """
+        同一个spec发送count个报文，只有IP头(标识字段和校验和)每次重新生成。
+        """
+        eth, ip_args, l4 = self.buildPacket(spec)
+        count = spec.get('count', 1)
+        interval = spec.get('interval', 0)
+        sent = errors = 0
+        for _ in range(count):
+            try:
+                self.sock.send(eth + self._ipHeader(ip_args, len(l4)) + l4)
+                sent += 1
+            except OSError:
+                errors += 1
+            if interval:
+                time.sleep(interval)
+        with self.lock:
+            self.stats['sent'] += sent
+            self.stats['send_errors'] += errors
+        return sent, errors
+
+    def _sniff(self):
+        while True:
+            frame, addr = self.sock.recvfrom(65535)
+            if addr[2] == socket.PACKET_OUTGOING:
+                continue
+            packet = _parseIpv4(frame)
+            if packet is None:
+                with self.lock:
+                    self.stats['received'] += 1
+                continue
+            packet['time'] = time.time()
+            with self.cond:
+                self.stats['received'] += 1
+                if len(self.received) == self.received.maxlen:
+                    self.stats['dropped'] += 1
+                self.stats['ipv4'] += 1
+                self.received.append(packet)
+                self.cond.notify_all()
+
+    def recv(self, max_packets=100, timeout=1.0, dport=None, src=None):
+        """
+        取出(并移除)已收到的匹配报文，最多等待timeout秒凑够max_packets个。
+        """
+        def match(p):
+            return (dport is None or p['dport'] == dport) and (src is None or p['src'] == src)
+
+        deadline = time.time() + timeout
+        out = []
+        with self.cond:
+            while True:
+                keep = collections.deque(maxlen=self.received.maxlen)
+                for p in self.received:
+                    if len(out) < max_packets and match(p):
+                        out.append(p)
+                    else:
+                        keep.append(p)
+                self.received = keep
+                remaining = deadline - time.time()
+                if len(out) >= max_packets or remaining <= 0:
+                    return out
+                self.cond.wait(remaining)
+
+    def handle(self, request):
+        cmd = request.get('cmd')
+        if cmd == 'send':
+            start = time.perf_counter()
+            sent, errors = self.send(request)
+            return {'ok': True, 'sent': sent, 'errors': errors,
+                    'elapsed': time.perf_counter() - start}
+        if cmd == 'batch':
+            start = time.perf_counter()
+            results = [self.send(spec) for spec in request['packets']]
+            return {'ok': True, 'sent': sum(r[0] for r in results),
+                    'errors': sum(r[1] for r in results),
+                    'elapsed': time.perf_counter() - start}
+        if cmd == 'recv':
+            packets = self.recv(request.get('max', 100), request.get('timeout', 1.0),
+                                request.get('dport'), request.get('src'))
+            return {'ok': True, 'packets': packets}
+        if cmd == 'stats':
+            with self.lock:
+                return {'ok': True, 'iface': self.iface, 'stats': dict(self.stats)}
+        if cmd == 'reset':
+            with self.cond:
+                self.resetStats()
+            return {'ok': True}
+        return {'ok': False, 'error': 'unknown command %r' % cmd}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.agent.handle(json.loads(line))
+            except Exception as e:
+                # 格式错误的命令只回复错误，不断开连接
+                reply = {'ok': False, 'error': repr(e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+def socketPath(host_name):
+    return '/tmp/p4agent-%s.sock' % host_name
+
+
+class AgentClient(object):
+    """
+    测试脚本一侧的客户端，一条Unix套接字连接上可以连续发多条命令。
+    """
+
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.f = self.sock.makefile('rwb')
+
+    def call(self, cmd, **kwargs):
+        kwargs['cmd'] = cmd
+        self.f.write(json.dumps(kwargs).encode('utf-8') + b'\n')
+        self.f.flush()
+        reply = json.loads(self.f.readline())
+        if not reply.get('ok'):
+            raise RuntimeError(reply.get('error'))
+        return reply
+
+    def send(self, dst, count=1, **kwargs):
+        return self.call('send', dst=dst, count=count, **kwargs)
+
+    def batch(self, packets):
+        return self.call('batch', packets=packets)
+
+    def recv(self, max_packets=100, timeout=1.0, **kwargs):
+        return self.call('recv', max=max_packets, timeout=timeout, **kwargs)['packets']
+
+    def stats(self):
+        return self.call('stats')['stats']
+
+    def close(self):
+        self.f.close()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Persistent host packet agent')
+    parser.add_argument('--name', help='the Mininet host name, e.g. h1',
+                        type=str, action="store", required=True)
+    parser.add_argument('--iface', help='interface to use (default: the *eth0 one)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--socket', help='control socket path (default: /tmp/p4agent-<name>.sock)',
+                        type=str, action="store", required=False, default=None)
+    args = parser.parse_args()
+
+    iface = args.iface or get_if()
+    path = args.socket or socketPath(args.name)
+    if os.path.exists(path):
+        os.unlink(path)
+    agent = PacketAgent(iface)
+    server = socketserver.ThreadingUnixStreamServer(path, _Handler)
+    server.daemon_threads = True
+    server.agent = agent
+    print("agent on %s listening at %s" % (iface, path))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# 引入了需要用到的库和p4runtime_lib
+import argparse
+import json
+import os
+import sys
+
+import grpc
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../../utils/'))
+from p4runtime_lib.error_utils import printGrpcError
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../..'))
+from p4ctl.arp import ARP_TABLE, ArpResponder
+from p4ctl.batch import buildTableEntryFromSpec, writeTableEntries
+from p4ctl.failover import FailureDetector
+from p4ctl.p4info_cache import loadP4InfoHelper
+from p4ctl.runtime import ControllerRuntime, Plugin
+from p4ctl.sketch import HeavyHitterMonitor, aclEntries, destinationLoad, printReport
+from p4ctl.standby import StatePublisher
+from p4ctl.topo import Topology, loadRuntimeEntries, loadTopology
+
+
+class RuntimeEntries(Plugin):
+    """
+    把拓扑中各交换机runtime_json里的table_entries批量写入(代替run_exercise.py
+    启动时的simple_controller，因为重新下发P4程序会清空表项)。
+    """
+    name = 'runtime-entries'
+
+    def __init__(self, rules, skip_tables=()):
+        """
+        :param rules: {switch name: table_entries}, see loadRuntimeEntries
+        :param skip_tables: tables owned by another plugin
+        """
+        self.rules = rules
+        self.skip_tables = set(skip_tables)
+
+    def install(self, runtime):
+        for name in runtime.switch_names:
+            flows = [f for f in self.rules.get(name, []) if f['table'] not in self.skip_tables]
+            count = writeTableEntries(runtime.switch(name), (
+                buildTableEntryFromSpec(runtime.p4info_helper, flow) for flow in flows))
+            print("Installed %d entries on %s" % (count, name))
+
+
+class HeavyHitterExport(object):
+    """
+    每个周期把各交换机的大流写到report_file_path(含按目的地址汇总的负载)，
+    并把它们转换成ACL练习的丢弃表项写到acl_file_path。
+    """
+
+    def __init__(self, report_file_path=None, acl_file_path=None, verbose=True):
+        self.report_file_path = report_file_path
+        self.acl_file_path = acl_file_path
+        self.verbose = verbose
+        self.reports = {}
+
+    def __call__(self, switch_name, total, hitters):
+        if self.verbose:
+            printReport(switch_name, total, hitters)
+        self.reports[switch_name] = (total, hitters)
+        if self.report_file_path:
+            self._dump(self.report_file_path, dict(
+                (name, {'bytes': t, 'hitters': [h.toDict() for h in hs],
+                        'dst_load': destinationLoad(hs)})
+                for name, (t, hs) in self.reports.items()))
+        if self.acl_file_path:
+            hitters = [h for _, hs in self.reports.values() for h in hs]
+            self._dump(self.acl_file_path, {'table_entries': aclEntries(hitters)})
+
+    @staticmethod
+    def _dump(file_path, obj):
+        # 先写临时文件再改名，读者不会读到写了一半的文件
+        tmp = file_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(obj, f, indent=2)
+        os.replace(tmp, file_path)
+
+
+def main(p4info_file_path, bmv2_file_path, topo_file_path, epoch=1.0, top_k=10,
+         report_file_path=None, acl_file_path=None, probe_interval=0.05, dead_interval=0.2,
+         election_id=1, mirror_address=None):
+    # 初始化 p4info_helper(解析结果缓存在p4info旁边的.cache文件中)
+    p4info_helper = loadP4InfoHelper(p4info_file_path)
+
+    # 给出mirror_address时作为主控制器，把每个成功的写请求转发给
+    # python -m p4ctl.standby --primary host:port启动的备控制器
+    mirror = None
+    if mirror_address is not None:
+        host, _, port = mirror_address.rpartition(':')
+        mirror = StatePublisher((host, int(port)))
+
+    # runtime_json路径相对于运行make的练习目录，即当前目录
+    topo = loadTopology(topo_file_path)
+    runtime = ControllerRuntime(p4info_helper, bmv2_file_path, topo=topo,
+                                election_id=election_id, mirror=mirror)
+    # arp_exact由ArpResponder根据主机表生成，topology.json增加主机后自动补写
+    rules = loadRuntimeEntries(topo, '.')
+    runtime.addPlugin(RuntimeEntries(rules, skip_tables=[ARP_TABLE]))
+    runtime.addPlugin(ArpResponder(Topology(topo), topo_file_path))
+    # 链路故障时把受影响的目的地址切换到ipv4_lpm2/ipv4_lpm3中能绕开它的配置
+    failover = runtime.addPlugin(FailureDetector(Topology(topo), rules,
+                                                 probe_interval, dead_interval))
+    runtime.addPlugin(HeavyHitterMonitor(epoch=epoch, k=top_k, on_report=HeavyHitterExport(
+        report_file_path, acl_file_path)))
+
+    try:
+        # 仲裁、在交换机上安装 P4 程序、写入插件的表项，然后运行事件循环
+        runtime.start()
+        runtime.run()
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    except grpc.RpcError as e:
+        printGrpcError(e)
+
+    runtime.shutdown()
+    if mirror is not None:
+        mirror.close()
+    failover.printReport()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='P4Runtime Controller')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/basic.p4.p4info.txt')
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/basic.json')
+    parser.add_argument('--topo', help='topology.json listing the switches and their runtime_json',
+                        type=str, action="store", required=False,
+                        default='./pod-topo/topology.json')
+    parser.add_argument('--epoch', help='seconds between heavy hitter sketch reads',
+                        type=float, action="store", required=False, default=1.0)
+    parser.add_argument('--top-k', help='number of heavy hitters to report per switch',
+                        type=int, action="store", required=False, default=10)
+    parser.add_argument('--report', help='JSON file to write the heavy hitters to',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--acl-out', help='file to write ACL drop entries for the heavy hitters to',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--probe-interval', help='seconds between link probes',
+                        type=float, action="store", required=False, default=0.05)
+    parser.add_argument('--dead-interval', help='seconds without probes before a link is down',
+                        type=float, action="store", required=False, default=0.2)
+    parser.add_argument('--election-id', help='election ID to arbitrate with',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--mirror', help='host:port to publish writes to a hot standby on',
+                        type=str, action="store", required=False, default=None)
+    args = parser.parse_args()
+
+    if args.mirror is not None and args.election_id < 2:
+        parser.error('--mirror needs --election-id >= 2 so the standby can sit below it')
+
+    if not os.path.exists(args.p4info):
+        parser.print_help()
+        print("\np4info file not found: %s\nHave you run 'make'?" % args.p4info)
+        parser.exit(1)
+    if not os.path.exists(args.bmv2_json):
+        parser.print_help()
+        print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args.topo, args.epoch, args.top_k,
+         args.report, args.acl_out, args.probe_interval, args.dead_interval,
+         args.election_id, args.mirror)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+分析`make run`时BMv2按接口写出的pcap(pcaps/sX-ethY_in.pcap、sX-ethY_out.pcap)。
+
+所有文件都用mmap打开，报文头直接在映射上用struct.unpack_from解析，不复制报文；
+各文件按时间戳归并成一条流，同一个报文在不同交换机端口上的记录按
+(源IP, 目的IP, 协议, 源端口, 目的端口, IP标识) 关联。一个报文在window秒内没有
+新记录就认为它已走完，立即统计并释放，所以内存只与窗口内的报文数有关。
+
+统计内容：每台交换机的转发时延和丢包、链路时延、TTL变化，以及按diffserv
+(对应basic.p4中的ipv4_lpm/ipv4_lpm2/ipv4_lpm3)统计的路径使用情况。
+
+    python3 pcap_analyzer.py pcaps/
+"""
+import argparse
+import collections
+import heapq
+import mmap
+import os
+import re
+import struct
+import sys
+
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+ETH_P_IP = 0x0800
+PCAP_NAME = re.compile(r'^(?P<switch>\w+?)-eth(?P<port>\d+)_(?P<dir>in|out)\.pcap$')
+
+ETHERTYPE = struct.Struct('!H')
+IPV4 = struct.Struct('!BBHHHBB2x4s4s')
+PORTS = struct.Struct('!HH')
+
+
+def diffservTable(tos):
+    """
+    与basic.p4中MyIngress的apply块一致。
+    """
+    if tos == 0:
+        return 'ipv4_lpm'
+    if tos == 4:
+        return 'ipv4_lpm2'
+    return 'ipv4_lpm3'
+
+
+def readPcap(path, switch, port, direction):
+    """
+    返回逐个yield (时间戳, 交换机, 端口, 方向, 关联键, ttl, tos)的迭代器，只处理IPv4报文。
+    文件头在调用时检查，不是pcap格式时抛出ValueError。
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= 24:
+            return iter(())
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic = bytes(mm[0:4])
+    if magic not in PCAP_MAGIC:
+        mm.close()
+        raise ValueError("%s: not a pcap file (magic %s)" % (path, magic.hex()))
+    return _records(mm, PCAP_MAGIC[magic], switch, port, direction)
+
+
+def _records(mm, fmt, switch, port, direction):
+    endian, unit = fmt
+    try:
+        record = struct.Struct(endian + 'IIII')
+        off = 24
+        end = len(mm)
+        while off + 16 <= end:
+            sec, frac, caplen, _ = record.unpack_from(mm, off)
+            pkt = off + 16
+            off = pkt + caplen
+            if off > end:
+                break
+            if caplen < 34 or ETHERTYPE.unpack_from(mm, pkt + 12)[0] != ETH_P_IP:
+                continue
+            ver_ihl, tos, _, ip_id, _, ttl, proto, src, dst = IPV4.unpack_from(mm, pkt + 14)
+            l4 = pkt + 14 + (ver_ihl & 0x0f) * 4
+            sport = dport = 0
+            if proto in (6, 17) and l4 + 4 <= pkt + caplen:
+                sport, dport = PORTS.unpack_from(mm, l4)
+            yield (sec + frac * unit, switch, port, direction,
+                   (src, dst, proto, sport, dport, ip_id), ttl, tos)
+    finally:
+        mm.close()
+
+
+class Stat(object):
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, v):
+        self.count += 1
+        self.total += v
+        if v > self.max:
+            self.max = v
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class Analyzer(object):
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.pending = collections.OrderedDict()
+        self.packets = 0
+        self.records = 0
+        self.switch_latency = collections.defaultdict(Stat)
+        self.link_latency = collections.defaultdict(Stat)
+        self.drops = collections.Counter()
+        self.ttl_changes = collections.Counter()
+        self.paths = collections.Counter()
+
+    def feed(self, records):
+        for ts, switch, port, direction, key, ttl, tos in records:
+            self.records += 1
+            obs = self.pending.pop(key, None)
+            if obs is None:
+                obs = []
+            obs.append((ts, switch, port, direction, ttl, tos))
+            # 重新插入到末尾，pending按最后一次出现的时间有序
+            self.pending[key] = obs
+            while self.pending:
+                first = next(iter(self.pending.values()))
+                if ts - first[-1][0] <= self.window:
+                    break
+                self._finish(self.pending.popitem(last=False)[1])
+        while self.pending:
+            self._finish(self.pending.popitem(last=False)[1])
+
+    def _finish(self, obs):
+        self.packets += 1
+        obs.sort()
+        path = []
+        last_out = None
+        for i, (ts, switch, port, direction, ttl, tos) in enumerate(obs):
+            if direction == 'in':
+                if last_out is not None and last_out[1] != switch:
+                    self.link_latency[(last_out[1], last_out[2], switch, port)].add(ts - last_out[0])
+                path.append(switch)
+                out = next((o for o in obs[i + 1:] if o[1] == switch and o[3] == 'out'), None)
+                if out is None:
+                    self.drops[switch] += 1
+                else:
+                    self.switch_latency[switch].add(out[0] - ts)
+                    self.ttl_changes[(switch, ttl - out[4])] += 1
+            else:
+                last_out = (ts, switch, port)
+        if path:
+            self.paths[(diffservTable(obs[0][5]), obs[0][5], tuple(path))] += 1
+
+    def report(self, out):
+        out.write("%d records, %d packets\n" % (self.records, self.packets))
+        out.write("\n----- Per-switch forwarding latency -----\n")
+        for sw, s in sorted(self.switch_latency.items()):
+            out.write("%-6s packets=%-8d mean=%.3fms max=%.3fms dropped=%d\n" % (
+                sw, s.count, s.mean() * 1e3, s.max * 1e3, self.drops[sw]))
+        for sw in sorted(set(self.drops) - set(self.switch_latency)):
+            out.write("%-6s packets=0 dropped=%d\n" % (sw, self.drops[sw]))
+        out.write("\n----- Link latency -----\n")
+        for (a, pa, b, pb), s in sorted(self.link_latency.items()):
+            out.write("%s-p%d -> %s-p%d  packets=%-8d mean=%.3fms max=%.3fms\n" % (
+                a, pa, b, pb, s.count, s.mean() * 1e3, s.max * 1e3))
+        out.write("\n----- TTL change per switch -----\n")
+        for (sw, delta), n in sorted(self.ttl_changes.items()):
+            out.write("%-6s ttl -%d: %d\n" % (sw, delta, n))
+        out.write("\n----- Path usage by diffserv -----\n")
+        for (table, tos, path), n in sorted(self.paths.items(), key=lambda x: (x[0][1], -x[1])):
+            out.write("diffserv=%-3d %-9s %-24s %d\n" % (tos, table, ' -> '.join(path), n))
+
+
+def findPcaps(paths):
+    found = []
+    for p in paths:
+        names = [os.path.join(p, n) for n in sorted(os.listdir(p))] if os.path.isdir(p) else [p]
+        for path in names:
+            m = PCAP_NAME.match(os.path.basename(path))
+            if m:
+                found.append((path, m.group('switch'), int(m.group('port')), m.group('dir')))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Correlate BMv2 per-port pcaps')
+    parser.add_argument('pcaps', nargs='+', help='pcap files or directories (e.g. pcaps/)')
+    parser.add_argument('--window', help='seconds after which a packet is considered done',
+                        type=float, action="store", required=False, default=1.0)
+    args = parser.parse_args()
+
+    pcaps = findPcaps(args.pcaps)
+    if not pcaps:
+        print("No sX-ethY_{in,out}.pcap files found")
+        exit(1)
+    readers = []
+    for p in pcaps:
+        try:
+            readers.append(readPcap(*p))
+        except ValueError as e:
+            print("Skipping %s" % e)
+    analyzer = Analyzer(args.window)
+    analyzer.feed(heapq.merge(*readers, key=lambda r: r[0]))
+    analyzer.report(sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
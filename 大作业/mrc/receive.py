@@ -3,11 +3,11 @@ import sys
 import struct
 import os
 
-from scapy.all import sniff, sendp, hexdump, get_if_list, get_if_hwaddr
-from scapy.all import Packet, IPOption
-from scapy.all import ShortField, IntField, LongField, BitField, FieldListField, FieldLenField
-from scapy.all import IP, TCP, UDP, Raw
-from scapy.layers.inet import _IPOption_HDR
+# 只导入用到的scapy模块；scapy.all会加载全部协议层，启动要多花一秒左右
+from scapy.arch import get_if_list
+from scapy.fields import ShortField, IntField, FieldListField, FieldLenField
+from scapy.layers.inet import IPOption, TCP, _IPOption_HDR
+from scapy.sendrecv import sniff
 
 def get_if():
     ifs=get_if_list()
@@ -5,9 +5,11 @@ import socket
 import random
 import struct
 
-from scapy.all import sendp, send, get_if_list, get_if_hwaddr
-from scapy.all import Packet
-from scapy.all import Ether, IP, UDP, TCP
+# 只导入用到的scapy模块；scapy.all会加载全部协议层，启动要多花一秒左右
+from scapy.arch import get_if_list, get_if_hwaddr
+from scapy.layers.inet import IP, TCP
+from scapy.layers.l2 import Ether
+from scapy.sendrecv import sendp
 
 def get_if():
     ifs=get_if_list()
@@ -0,0 +1,6 @@
+#!/bin/sh
+# 启动simple_switch_grpc并加上basic.p4需要的--cpu-port 255(packet-in/packet-out)。
+# utils/Makefile和run_exercise.py只能替换交换机程序，不能追加目标参数；
+# run_exercise.py传入的参数以"-- --grpc-server-addr ..."结尾，追加在后面即为目标参数。
+# 文件名须含grpc，run_exercise.py据此选用P4RuntimeSwitch。
+exec simple_switch_grpc "$@" --cpu-port 255
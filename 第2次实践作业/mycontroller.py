@@ -1,7 +1,6 @@
 import argparse
 import os
 import sys
-from time import sleep
 
 import grpc
 
@@ -10,87 +9,18 @@ import grpc
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
-import p4runtime_lib.helper
 from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
 
-SWITCH_TO_HOST_PORT = 1
-
-# 定义写隧道规则
-def writeTunnelRules(p4info_helper, ingress_sw, egress_sw, tunnel_id,
-                     dst_eth_addr, dst_ip_addr, switch_port):
-    """
-    安装三个规则:
-    1) Tunnel Ingress Rule(交换机入口ipv4_lpm表中隧道入口规则)：用特定的ID将流封装到隧道中;
-    2) Tunnel Transit Rule(交换机入口的转发规则)：基于特定ID的转发，实现所有主机互通;
-    3) Tunnel Egress Rule(交换机出口的隧道出口规则)：用特定ID将流解封装,并转发到相应主机。
-
-    :param p4info_helper: the P4Info helper
-    :param ingress_sw: the ingress switch connection
-    :param egress_sw: the egress switch connection
-    :param tunnel_id: the specified tunnel ID
-    :param dst_eth_addr: the destination IP to match in the ingress rule
-    :param dst_ip_addr: the destination Ethernet address to write in the
-                        egress rule
-    """
-    # 1) Tunnel Ingress Rule
-//ipv4_lpm表的入接口开关上的隧道入接口规则，该规则用指定的ID将流量封装到一个隧道中
-    table_entry = p4info_helper.buildTableEntry(   //使用p4info_helper解析器将规则转化为P4Runtime能够识别的形式
-        table_name="MyIngress.ipv4_lpm",            // 定义表名
-        match_fields={                              //设置匹配域
-            "hdr.ipv4.dstAddr": (dst_ip_addr, 32)  
-        },//设置匹配域
-        action_name="MyIngress.myTunnel_ingress",   //设置匹配成功对应的动作名
-        action_params={                            
-            "dst_id": tunnel_id,                    
-        })
-    ingress_sw.WriteTableEntry(table_entry)        //ingress_sw调用WriteTableEntry，将生成的匹配动作表项加入交换机
-    print("Installed ingress tunnel rule on %s" % ingress_sw.name)
-
-    # 2) Tunnel Transit Rule
-//入口交换机上的一种传输规则，根据指定的ID转发流量
-    # 将规则添加到myTunnel_exact表中并匹配隧道ID（hdr.myTunnel.dst_id）。
-    # 转发流量在连接到下一个交换机的端口上使用myTunnel_forward操作。
-    # s1和s2使用连接到两个交换机上的端口2的链接。
-    # 在文件的开头定义了，SWITCH_TO_SWITCH_PORT，可以用作输出此操作的端口。
-    # 我们只需要入换机上的传输规则，因为我们是使用简单拓扑。
-    # 通常，需要使用传输规则路径中的每个交换机（最后一个交换机除外，它有出口规则），为每个交换机动态选择端口基于拓扑。
-
-    # TODO build the transit rule
-    # TODO install the transit rule on the ingress switch
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.myTunnel_exact",     
-        match_fields={                            
-            "hdr.myTunnel.dst_id": tunnel_id       //匹配隧道ID（hdr.myTunnel.dst_id）
-        },
-        action_name="MyIngress.myTunnel_forward",  
-        action_params={                            
-            "port": switch_port                  // 端口选择switch_port
-
-        })
-    ingress_sw.WriteTableEntry(table_entry)        // 调用WriteTableEntry，将生成的匹配动作表项加入交换机
-    print("Installed transit tunnel rule on %s" % ingress_sw.name)
-
-    # 3) Tunnel Egress Rule
-    # For our simple topology, the host will always be located on the
-    # SWITCH_TO_HOST_PORT (port 1).
-    # In general, you will need to keep track of which port the host is
-    # connected to.
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.myTunnel_exact",     
-        match_fields={                             
-            "hdr.myTunnel.dst_id": tunnel_id
-        },
-        action_name="MyIngress.myTunnel_egress",   
-        action_params={                            
-            "dstAddr": dst_eth_addr,
-            "port": SWITCH_TO_HOST_PORT
-        })
-    egress_sw.WriteTableEntry(table_entry)
-    print("Installed egress tunnel rule on %s" % egress_sw.name)
-
-//将交换机中所有流表所有条目全部读出来，打印出来。
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '..'))
+from p4ctl.p4info_cache import loadP4InfoHelper
+from p4ctl.runtime import ControllerRuntime, Plugin
+from p4ctl.topo import Topology
+from p4ctl.tunnel_stats import TunnelAccounting
+from p4ctl.tunnels import TunnelManager
+
+# 将交换机中所有流表所有条目全部读出来，打印出来。
 def readTableRules(p4info_helper, sw):
     """
     Reads the table entries from all tables on the switch.
@@ -118,127 +48,67 @@ def readTableRules(p4info_helper, sw):
             print()
 
 
-//从交换机中读具体的索引（即隧道ID号）对应的计数器
-def printCounter(p4info_helper, sw, counter_name, index):
+class TunnelPlugin(Plugin):
     """
-    Reads the specified counter at the specified index from the switch. In our
-    program, the index is the tunnel ID. If the index is 0, it will return all
-    values from the counter.
-
-    :param p4info_helper: the P4Info helper
-    :param sw:  the switch connection
-    :param counter_name: the name of the counter from the P4 program
-    :param index: the counter index (in our case, the tunnel ID)
+    根据拓扑在所有边缘交换机之间建立全互联隧道，每poll_interval秒配对读取各隧道
+    两端的计数器，每2秒打印滑动窗口内的吞吐量和网内丢包率。
     """
-    for response in sw.ReadCounters(p4info_helper.get_counters_id(counter_name), index):
-        for entity in response.entities:
-            counter = entity.counter_entry
-            print("%s %s %d: %d packets (%d bytes)" % (
-                sw.name, counter_name, index,
-                counter.data.packet_count, counter.data.byte_count
-            ))
-
-
-def main(p4info_file_path, bmv2_file_path):
-    # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+    name = 'tunnels'
+
+    def __init__(self, topology, poll_interval=0.5, window=4, loss_threshold=0.05):
+        self.topology = topology
+        self.poll_interval = poll_interval
+        self.window = window
+        self.loss_threshold = loss_threshold
+        self.manager = None
+        self.accounting = None
+
+    def install(self, runtime):
+        p4info_helper = runtime.p4info_helper
+        self.manager = TunnelManager(p4info_helper, self.topology, runtime.switch)
+        self.manager.provision()
+        self.accounting = TunnelAccounting(self.manager, runtime.switch, p4info_helper,
+                                           self.window, self.loss_threshold)
+
+        for name in runtime.switch_names:
+            readTableRules(p4info_helper, runtime.switch(name))
+
+    def addEdgeSwitch(self, runtime, switch_name):
+        """
+        topology中已加入switch_name及其主机和链路后调用：连接新交换机并安装进出它的隧道。
+        """
+        runtime.addSwitch(switch_name)
+        return self.manager.addEdgeSwitch(switch_name)
+
+    def tasks(self, runtime):
+        return [('tunnel-accounting', self.poll_interval, self.accounting.poll),
+                ('tunnel-report', 2, self.accounting.printReport)]
+
+
+def main(p4info_file_path, bmv2_file_path, topo_file_path, loss_threshold=0.05):
+    # Instantiate a P4Runtime helper from the p4info file (cached in binary form)
+    p4info_helper = loadP4InfoHelper(p4info_file_path)
+
+    # 交换机连接、隧道路径和隧道ID都由topology.json推导，不再手写
+    # Also, dump all P4Runtime messages sent to switch to logs/sX-p4runtime-requests.bin
+    topology = Topology.fromFile(topo_file_path)
+    runtime = ControllerRuntime(p4info_helper, bmv2_file_path,
+                                switch_names=topology.switches)
+    tunnels = runtime.addPlugin(TunnelPlugin(topology, loss_threshold=loss_threshold))
 
     try:
-        # Create a switch connection object for s1 and s2;
-        # this is backed by a P4Runtime gRPC connection.
-        # Also, dump all P4Runtime messages sent to switch to given txt files.
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
-
-        # Send master arbitration update message to establish this controller as
-        # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
-
-        # Install the P4 program on the switches
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-        
-        # Write the rules that tunnel traffic from h1 to h2
-        writeTunnelRules(p4info_helper, ingress_sw=s1, egress_sw=s2, tunnel_id=100,
-                         dst_eth_addr="08:00:00:00:02:22", dst_ip_addr="10.0.2.2", switch_port=2)
-
-        # Write the rules that tunnel traffic from h2 to h1
-        writeTunnelRules(p4info_helper, ingress_sw=s2, egress_sw=s1, tunnel_id=101,
-                         dst_eth_addr="08:00:00:00:01:11", dst_ip_addr="10.0.1.1", switch_port=2)
-
-        # Write the rules that tunnel traffic from h1 to h3
-        writeTunnelRules(p4info_helper, ingress_sw=s1, egress_sw=s3, tunnel_id=200,
-                         dst_eth_addr="08:00:00:00:03:33", dst_ip_addr="10.0.3.3", switch_port=3)
-
-        # Write the rules that tunnel traffic from h3 to h1
-        writeTunnelRules(p4info_helper, ingress_sw=s3, egress_sw=s1, tunnel_id=201,
-                         dst_eth_addr="08:00:00:00:01:11", dst_ip_addr="10.0.1.1", switch_port=2)
-
-        # Write the rules that tunnel traffic from h2 to h3
-        writeTunnelRules(p4info_helper, ingress_sw=s2, egress_sw=s3, tunnel_id=300,
-                         dst_eth_addr="08:00:00:00:03:33", dst_ip_addr="10.0.3.3", switch_port=3)
-
-        # Write the rules that tunnel traffic from h3 to h2
-        writeTunnelRules(p4info_helper, ingress_sw=s3, egress_sw=s2, tunnel_id=301,
-                         dst_eth_addr="08:00:00:00:02:22", dst_ip_addr="10.0.2.2", switch_port=3)
-
-        # TODO Uncomment the following two lines to read table entries from s1 and s2
-        readTableRules(p4info_helper, s1)
-        readTableRules(p4info_helper, s2)
-        readTableRules(p4info_helper, s3)
-
-        # Print the tunnel counters every 2 seconds
-        while True:
-            sleep(2)
-            print('\n----- Reading tunnel counters -----')
-            print('\n----- s1 ->  s2 -----')
-            printCounter(p4info_helper, s1, "MyIngress.ingressTunnelCounter", 100)
-            printCounter(p4info_helper, s2, "MyIngress.egressTunnelCounter", 100)
-            print('\n----- s2 ->  s1 -----')
-            printCounter(p4info_helper, s2, "MyIngress.ingressTunnelCounter", 101)
-            printCounter(p4info_helper, s1, "MyIngress.egressTunnelCounter", 101)
-            print('\n----- s1 ->  s3 -----')
-            printCounter(p4info_helper, s1, "MyIngress.ingressTunnelCounter", 200)
-            printCounter(p4info_helper, s3, "MyIngress.egressTunnelCounter", 200)
-            print('\n----- s3 ->  s1 -----')
-            printCounter(p4info_helper, s3, "MyIngress.ingressTunnelCounter", 201)
-            printCounter(p4info_helper, s1, "MyIngress.egressTunnelCounter", 201)
-            print('\n----- s2 ->  s3 -----')
-            printCounter(p4info_helper, s2, "MyIngress.ingressTunnelCounter", 300)
-            printCounter(p4info_helper, s3, "MyIngress.egressTunnelCounter", 300)
-            print('\n----- s3 ->  s2 -----')
-            printCounter(p4info_helper, s3, "MyIngress.ingressTunnelCounter", 301)
-            printCounter(p4info_helper, s2, "MyIngress.egressTunnelCounter", 301)
-            print('\n----- Finished -----')
-
+        # Master arbitration, install the P4 program, write the tunnel rules
+        # and then account the tunnel counters (throughput and loss) periodically
+        runtime.start()
+        runtime.run()
     except KeyboardInterrupt:
         print(" Shutting down.")
     except grpc.RpcError as e:
         printGrpcError(e)
 
-    ShutdownAllSwitchConnections()
+    runtime.shutdown()
+    if tunnels.accounting is not None:
+        tunnels.accounting.close()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='P4Runtime Controller')
@@ -248,6 +118,11 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/advanced_tunnel.json')
+    parser.add_argument('--topo', help='topology.json describing hosts, switches and links',
+                        type=str, action="store", required=False,
+                        default='./topology.json')
+    parser.add_argument('--loss-threshold', help='in-fabric loss rate that raises a tunnel alert',
+                        type=float, action="store", required=False, default=0.05)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -258,4 +133,8 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    if not os.path.exists(args.topo):
+        parser.print_help()
+        print("\nTopology file not found: %s" % args.topo)
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args.topo, args.loss_threshold)
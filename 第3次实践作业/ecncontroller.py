@@ -3,17 +3,37 @@
 import argparse
 import os
 import sys
-from time import sleep
+import time
 
 import grpc
 
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
-import p4runtime_lib.helper
 from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '..'))
+from p4ctl.batch import buildTableEntryFromSpec, writeTableEntries
+from p4ctl.externs import readCounter, readRegister, registerInfo, writeRegister
+from p4ctl.p4info_cache import loadP4InfoHelper
+from p4ctl.ring import RingBuffer
+from p4ctl.runtime import ControllerRuntime, Plugin
+from p4ctl.topo import loadRuntimeEntries, loadTopology
+
+# 阈值调节需要ecn.p4把常量ECN_THRESHOLD换成按出端口下标的寄存器，并导出队列统计：
+#   register<bit<19>>(NUM_PORTS) ecn_threshold;
+#   register<bit<32>>(NUM_PORTS) qdepth_sum;     // 累加standard_metadata.enq_qdepth
+#   counter(NUM_PORTS, CounterType.packets_and_bytes) egress_port_counter;
+#   counter(NUM_PORTS, CounterType.packets) ecn_marked;
+# MyEgress中：
+#   ecn_threshold.read(threshold, (bit<32>)standard_metadata.egress_port);
+#   if (standard_metadata.enq_qdepth >= threshold) { mark_ecn(); ecn_marked.count(...); }
+THRESHOLD_REGISTER = 'MyEgress.ecn_threshold'
+QDEPTH_REGISTER = 'MyEgress.qdepth_sum'
+PORT_COUNTER = 'MyEgress.egress_port_counter'
+MARKED_COUNTER = 'MyEgress.ecn_marked'
 
 # 定义写规则
 def writeRule(p4info_helper, ingress_sw,
@@ -28,85 +48,222 @@ def writeRule(p4info_helper, ingress_sw,
             "dstAddr": dst_eth_addr,
             "port": switch_port
         })
-    ingress_sw.WriteTableEntry(table_entry)         # 调用WriteTableEntry，将生成的匹配动作表项加入交换机
+    writeTableEntries(ingress_sw, [table_entry])     # 经由writeTableEntries写入，使用仲裁时的sw.election_id
     print("Installed rule on %s" % ingress_sw.name)
 
 
-def main(p4info_file_path, bmv2_file_path):
-    # 初始化 p4info_helper
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+# 练习拓扑(s1、s2、s3)的静态路由：{交换机: [(目的MAC, (目的地址, 前缀长度), 出端口)]}
+ROUTES = {
+    's1': [
+        ("08:00:00:00:01:01", ("10.0.1.1", 32), 2),
+        ("08:00:00:00:01:11", ("10.0.1.11", 32), 1),
+        ("08:00:00:00:02:00", ("10.0.2.0", 24), 3),
+        ("08:00:00:00:03:00", ("10.0.3.0", 24), 4),
+    ],
+    's2': [
+        ("08:00:00:00:02:02", ("10.0.2.2", 32), 2),
+        ("08:00:00:00:02:22", ("10.0.2.22", 32), 1),
+        ("08:00:00:00:01:00", ("10.0.1.0", 24), 3),
+        ("08:00:00:00:03:00", ("10.0.3.0", 24), 4),
+    ],
+    's3': [
+        ("08:00:00:00:03:03", ("10.0.3.3", 32), 1),
+        ("08:00:00:00:01:00", ("10.0.1.0", 24), 2),
+        ("08:00:00:00:02:00", ("10.0.2.0", 24), 3),
+    ],
+}
+
+
+class EcnRoutes(Plugin):
+    """
+    ECN练习的ipv4_lpm路由。给出topology.json时按各交换机的runtime_json写入，
+    没有runtime_json的交换机使用ROUTES中的静态路由。
+    """
+    name = 'ecn'
+
+    def __init__(self, rules=None):
+        """
+        :param rules: {switch name: table_entries}, see loadRuntimeEntries
+        """
+        self.rules = rules or {}
+
+    def install(self, runtime):
+        for name in runtime.switch_names:
+            sw = runtime.switch(name)
+            if name in self.rules:
+                count = writeTableEntries(sw, (
+                    buildTableEntryFromSpec(runtime.p4info_helper, flow) for flow in self.rules[name]))
+                print("Installed %d entries on %s" % (count, name))
+            elif name in ROUTES:
+                for dst_eth_addr, dst_ip_addr, switch_port in ROUTES[name]:
+                    writeRule(runtime.p4info_helper, ingress_sw=sw, dst_eth_addr=dst_eth_addr,
+                              dst_ip_addr=dst_ip_addr, switch_port=switch_port)
+            else:
+                print("No routes for %s: it has no runtime_json in the topology" % name)
+
+
+class PortStats(object):
+    """
+    一个出端口最近history个周期的平均队列深度、ECN标记率和吞吐量(字节/秒)。
+    """
+    __slots__ = ('qdepth', 'mark_rate', 'throughput', 'threshold', 'changes')
+
+    def __init__(self, history, threshold):
+        self.qdepth = RingBuffer(history)
+        self.mark_rate = RingBuffer(history)
+        self.throughput = RingBuffer(history)
+        self.threshold = threshold
+        self.changes = 0
+
+
+class EcnThresholdTuner(Plugin):
+    """
+    按出端口闭环调节ECN标记阈值：队列持续高于target_qdepth时按比例降低阈值，
+    让发送方更早减速；队列已经很短却仍在大量标记时线性提高阈值，避免压低吞吐。
+    """
+    name = 'ecn-tuner'
+
+    def __init__(self, num_ports=4, initial=10, min_threshold=2, max_threshold=200,
+                 target_qdepth=10, max_mark_rate=0.05, interval=0.5, window=4,
+                 history=120):
+        self.ports = list(range(1, num_ports + 1))
+        self.initial = initial
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.target_qdepth = target_qdepth
+        self.max_mark_rate = max_mark_rate
+        self.interval = interval
+        self.window = window
+        self.history = history
+        self.enabled = False
+        self.qdepth_width = 32
+        self.stats = {}
+        self._prev = {}
+        self._configured = set()
+
+    def install(self, runtime):
+        try:
+            registerInfo(runtime.p4info_helper, THRESHOLD_REGISTER)
+            _, self.qdepth_width, _ = registerInfo(runtime.p4info_helper, QDEPTH_REGISTER)
+            for name in (PORT_COUNTER, MARKED_COUNTER):
+                runtime.p4info_helper.get('counters', name=name)
+        except AttributeError as e:
+            print("ECN threshold tuning disabled: %s" % e)
+            return
+        self.enabled = True
+        for name in runtime.switch_names:
+            self._configure(runtime, name)
+        print("ECN thresholds set to %d on ports %s" % (self.initial, self.ports))
+
+    def _configure(self, runtime, name):
+        """
+        写入交换机name各端口的初始阈值并建立统计。install之后经runtime.addSwitch
+        加入的交换机在下一次step时配置。
+        """
+        writeRegister(runtime.switch(name), runtime.p4info_helper, THRESHOLD_REGISTER,
+                      dict((port, self.initial) for port in self.ports))
+        for port in self.ports:
+            self.stats[(name, port)] = PortStats(self.history, self.initial)
+        self._configured.add(name)
+
+    def tasks(self, runtime):
+        if not self.enabled:
+            return []
+        return [('ecn-tuner', self.interval, self.step)]
+
+    def _sample(self, runtime, name):
+        sw = runtime.switch(name)
+        helper = runtime.p4info_helper
+        now = time.perf_counter()
+        qdepth = readRegister(sw, helper, QDEPTH_REGISTER)
+        packets, byte_counts = readCounter(sw, helper, PORT_COUNTER)
+        marked, _ = readCounter(sw, helper, MARKED_COUNTER)
+        prev = self._prev.get(name)
+        self._prev[name] = (now, qdepth, packets, byte_counts, marked)
+        if prev is None:
+            return
+        elapsed = now - prev[0]
+        wrap = 1 << self.qdepth_width
+        for port in self.ports:
+            d_packets = packets[port] - prev[2][port]
+            stats = self.stats[(name, port)]
+            if d_packets <= 0:
+                stats.qdepth.append(0.0)
+                stats.mark_rate.append(0.0)
+                stats.throughput.append(0.0)
+                continue
+            # qdepth_sum是会回绕的定宽寄存器
+            stats.qdepth.append(((qdepth[port] - prev[1][port]) % wrap) / float(d_packets))
+            stats.mark_rate.append((marked[port] - prev[4][port]) / float(d_packets))
+            stats.throughput.append((byte_counts[port] - prev[3][port]) / elapsed)
+
+    def _decide(self, stats):
+        qdepth = stats.qdepth.mean(self.window)
+        mark_rate = stats.mark_rate.mean(self.window)
+        threshold = stats.threshold
+        if qdepth > self.target_qdepth:
+            threshold = max(self.min_threshold, int(threshold * 0.8))
+        elif qdepth < self.target_qdepth / 2.0 and mark_rate > self.max_mark_rate:
+            threshold = min(self.max_threshold, threshold + 2)
+        return threshold
+
+    def step(self, runtime):
+        for name in runtime.switch_names:
+            if name not in self._configured:
+                self._configure(runtime, name)
+            self._sample(runtime, name)
+            changed = {}
+            for port in self.ports:
+                stats = self.stats[(name, port)]
+                if len(stats.qdepth) < self.window:
+                    continue
+                threshold = self._decide(stats)
+                if threshold != stats.threshold:
+                    stats.threshold = threshold
+                    stats.changes += 1
+                    changed[port] = threshold
+            if changed:
+                # 一个周期内同一台交换机的所有改动合并为一次写入
+                writeRegister(runtime.switch(name), runtime.p4info_helper,
+                              THRESHOLD_REGISTER, changed)
+
+    def printSummary(self):
+        if not self.enabled:
+            return
+        print('\n----- ECN thresholds -----')
+        for (name, port), s in sorted(self.stats.items()):
+            print("%-4s port %d: threshold=%-4d changes=%-4d qdepth=%.1f mark=%.1f%% %.0fB/s" % (
+                name, port, s.threshold, s.changes, s.qdepth.mean(self.window),
+                s.mark_rate.mean(self.window) * 100, s.throughput.mean(self.window)))
+
+
+def main(p4info_file_path, bmv2_file_path, topo_file_path=None,
+         target_qdepth=10, tune_interval=0.5):
+    # 初始化 p4info_helper(解析结果缓存在p4info旁边的.cache文件中)
+    p4info_helper = loadP4InfoHelper(p4info_file_path)
+
+    # 交换机连接由运行时统一建立：有topology.json时按拓扑，否则沿用s1、s2、s3
+    # 此外，由后台线程把发送给交换机的所有 P4Runtime 消息以二进制形式转存到
+    # logs/sX-p4runtime-requests.bin(用 python -m p4ctl.msglog 转换为文本)
+    topo = loadTopology(topo_file_path) if topo_file_path else None
+    runtime = ControllerRuntime(p4info_helper, bmv2_file_path, topo=topo,
+                                switch_names=['s1', 's2', 's3'])
+    # runtime_json路径相对于运行make的练习目录，即当前目录
+    runtime.addPlugin(EcnRoutes(loadRuntimeEntries(topo, '.') if topo else None))
+    tuner = runtime.addPlugin(EcnThresholdTuner(target_qdepth=target_qdepth,
+                                                interval=tune_interval))
 
     try:
-        # 为s1、s2、s3创建交换机连接对象
-        # 这是由一个运行时gRPC连接支持的
-        # 此外，将发送给交换机的所有 P4Runtime 消息转存到给定的 txt 文件
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
-
-        # Send master arbitration update message to establish this controller as
-        # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
-
-        # 在交换机上安装 P4 程序
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-
-        writeRule(p4info_helper, ingress_sw=s1,
-                   dst_eth_addr="08:00:00:00:01:01", dst_ip_addr=("10.0.1.1", 32), switch_port=2)
-        writeRule(p4info_helper, ingress_sw=s1,
-                   dst_eth_addr="08:00:00:00:01:11", dst_ip_addr=("10.0.1.11", 32), switch_port=1)
-        writeRule(p4info_helper, ingress_sw=s1,
-                   dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=("10.0.2.0", 24), switch_port=3)
-        writeRule(p4info_helper, ingress_sw=s1,
-                   dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=("10.0.3.0", 24), switch_port=4)
-
-        writeRule(p4info_helper, ingress_sw=s2,
-                   dst_eth_addr="08:00:00:00:02:02", dst_ip_addr=("10.0.2.2", 32), switch_port=2)
-        writeRule(p4info_helper, ingress_sw=s2,
-                   dst_eth_addr="08:00:00:00:02:22", dst_ip_addr=("10.0.2.22", 32), switch_port=1)
-        writeRule(p4info_helper, ingress_sw=s2,
-                   dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=("10.0.1.0", 24), switch_port=3)
-        writeRule(p4info_helper, ingress_sw=s2,
-                   dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=("10.0.3.0", 24), switch_port=4)
-
-        writeRule(p4info_helper, ingress_sw=s3,
-                   dst_eth_addr="08:00:00:00:03:03", dst_ip_addr=("10.0.3.3", 32), switch_port=1)
-        writeRule(p4info_helper, ingress_sw=s3,
-                   dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=("10.0.1.0", 24), switch_port=2)
-        writeRule(p4info_helper, ingress_sw=s3,
-                   dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=("10.0.2.0", 24), switch_port=3)
-
-        while True:
-            sleep(2)
-        
+        # 仲裁、在交换机上安装 P4 程序、写入插件的表项，然后运行事件循环
+        runtime.start()
+        runtime.run()
     except KeyboardInterrupt:
         print(" Shutting down.")
     except grpc.RpcError as e:
         printGrpcError(e)
 
-    ShutdownAllSwitchConnections()
+    runtime.shutdown()
+    tuner.printSummary()
 
 
 if __name__ == '__main__':
@@ -117,6 +274,12 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/ecn.json')
+    parser.add_argument('--topo', help='topology.json used to discover the switches',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--target-qdepth', help='queue depth (packets) the ECN tuner aims for',
+                        type=int, action="store", required=False, default=10)
+    parser.add_argument('--tune-interval', help='seconds between ECN threshold updates',
+                        type=float, action="store", required=False, default=0.5)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -127,4 +290,4 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    main(args.p4info, args.bmv2_json, args.topo, args.target_qdepth, args.tune_interval)
@@ -3,17 +3,21 @@
 import argparse
 import os
 import sys
-from time import sleep
 
 import grpc
 
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
-import p4runtime_lib.helper
 from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '..'))
+from p4ctl.batch import buildTableEntryFromSpec, writeTableEntries
+from p4ctl.p4info_cache import loadP4InfoHelper
+from p4ctl.runtime import ControllerRuntime, Plugin
+from p4ctl.topo import loadRuntimeEntries, loadTopology
 
 
 def getHashValue(p4info_helper, ingress_sw, dst_ip_addr, ecmp_base, ecmp_count):
@@ -27,7 +31,7 @@ def getHashValue(p4info_helper, ingress_sw, dst_ip_addr, ecmp_base, ecmp_count):
             "ecmp_base": ecmp_base,
             "ecmp_count": ecmp_count
         })
-    ingress_sw.WriteTableEntry(table_entry)         # 调用WriteTableEntry，将生成的匹配动作表项加入交换机
+    writeTableEntries(ingress_sw, [table_entry])     # 经由writeTableEntries写入，使用仲裁时的sw.election_id
     print("Installed rule on %s" % ingress_sw.name)
 
 
@@ -43,7 +47,7 @@ def matchHashValue(p4info_helper, ingress_sw, ecmp_select, nhop_dmac, nhop_ipv4,
             "nhop_ipv4": nhop_ipv4,
             "port":port
         })
-    ingress_sw.WriteTableEntry(table_entry)         # 调用WriteTableEntry，将生成的匹配动作表项加入交换机
+    writeTableEntries(ingress_sw, [table_entry])     # 经由writeTableEntries写入，使用仲裁时的sw.election_id
     print("Installed rule on %s" % ingress_sw.name)
 
 
@@ -57,77 +61,85 @@ def sendFrame(p4info_helper, egress_sw, egress_port, smac):
         action_params={                             # 动作参数
             "smac": smac
         })
-    egress_sw.WriteTableEntry(table_entry)         # 调用WriteTableEntry，将生成的匹配动作表项加入交换机
+    writeTableEntries(egress_sw, [table_entry])     # 经由writeTableEntries写入，使用仲裁时的sw.election_id
     print("Installed rule on %s" % egress_sw.name)
 
 
-def main(p4info_file_path, bmv2_file_path):
-    # 初始化 p4info_helper
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+# 练习拓扑(s1、s2、s3)的静态表项：{交换机: (ecmp_group, ecmp_nhop, send_frame)}，
+# 分别为 [(目的地址, ecmp_base, ecmp_count)]、[(ecmp_select, 下一跳MAC, 下一跳地址, 出端口)]
+# 和 [(出端口, 源MAC)]
+RULES = {
+    's1': ([(["10.0.0.1", 32], 0, 2)],
+           [(0, "00:00:00:00:01:02", "10.0.2.2", 2),
+            (1, "00:00:00:00:01:03", "10.0.3.3", 3)],
+           [(2, "00:00:00:01:02:00"), (3, "00:00:00:01:03:00")]),
+    's2': ([(["10.0.2.2", 32], 0, 1)],
+           [(0, "00:00:00:00:02:02", "10.0.2.2", 1)],
+           [(1, "00:00:00:02:01:00")]),
+    's3': ([(["10.0.3.3", 32], 0, 1)],
+           [(0, "00:00:00:00:03:03", "10.0.3.3", 1)],
+           [(1, "00:00:00:03:01:00")]),
+}
+
+
+class LoadBalanceRules(Plugin):
+    """
+    负载均衡练习的ECMP分组、下一跳和出端口MAC改写表项。给出topology.json时按
+    各交换机的runtime_json写入，没有runtime_json的交换机使用RULES中的静态表项。
+    """
+    name = 'load_balance'
+
+    def __init__(self, rules=None):
+        """
+        :param rules: {switch name: table_entries}, see loadRuntimeEntries
+        """
+        self.rules = rules or {}
+
+    def install(self, runtime):
+        helper = runtime.p4info_helper
+        for name in runtime.switch_names:
+            sw = runtime.switch(name)
+            if name in self.rules:
+                count = writeTableEntries(sw, (
+                    buildTableEntryFromSpec(helper, flow) for flow in self.rules[name]))
+                print("Installed %d entries on %s" % (count, name))
+            elif name in RULES:
+                groups, nhops, frames = RULES[name]
+                for dst_ip_addr, ecmp_base, ecmp_count in groups:
+                    getHashValue(helper, ingress_sw=sw, dst_ip_addr=dst_ip_addr,
+                                 ecmp_base=ecmp_base, ecmp_count=ecmp_count)
+                for ecmp_select, nhop_dmac, nhop_ipv4, port in nhops:
+                    matchHashValue(helper, ingress_sw=sw, ecmp_select=ecmp_select,
+                                   nhop_dmac=nhop_dmac, nhop_ipv4=nhop_ipv4, port=port)
+                for egress_port, smac in frames:
+                    sendFrame(helper, egress_sw=sw, egress_port=egress_port, smac=smac)
+            else:
+                print("No rules for %s: it has no runtime_json in the topology" % name)
+
+
+def main(p4info_file_path, bmv2_file_path, topo_file_path=None):
+    # 初始化 p4info_helper(解析结果缓存在p4info旁边的.cache文件中)
+    p4info_helper = loadP4InfoHelper(p4info_file_path)
+
+    # 交换机连接由运行时统一建立：有topology.json时按拓扑，否则沿用s1、s2、s3
+    # 此外，由后台线程把发送给交换机的所有 P4Runtime 消息以二进制形式转存到
+    # logs/sX-p4runtime-requests.bin(用 python -m p4ctl.msglog 转换为文本)
+    topo = loadTopology(topo_file_path) if topo_file_path else None
+    runtime = ControllerRuntime(p4info_helper, bmv2_file_path, topo=topo,
+                                switch_names=['s1', 's2', 's3'])
+    # runtime_json路径相对于运行make的练习目录，即当前目录
+    runtime.addPlugin(LoadBalanceRules(loadRuntimeEntries(topo, '.') if topo else None))
 
     try:
-        # 为s1、s2、s3创建交换机连接对象
-        # 这是由一个运行时gRPC连接支持的
-        # 此外，将发送给交换机的所有 P4Runtime 消息转存到给定的 txt 文件
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
-
-        # Send master arbitration update message to establish this controller as
-        # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
-
-        # 在交换机上安装 P4 程序
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-
-        #   s1
-        getHashValue(p4info_helper, ingress_sw=s1, dst_ip_addr=["10.0.0.1", 32], ecmp_base=0, ecmp_count=2)
-        matchHashValue(p4info_helper, ingress_sw=s1, ecmp_select=0, nhop_dmac="00:00:00:00:01:02", nhop_ipv4="10.0.2.2", port=2)
-        matchHashValue(p4info_helper, ingress_sw=s1, ecmp_select=1, nhop_dmac="00:00:00:00:01:03", nhop_ipv4="10.0.3.3", port=3)
-        sendFrame(p4info_helper, egress_sw=s1, egress_port=2, smac="00:00:00:01:02:00")
-        sendFrame(p4info_helper, egress_sw=s1, egress_port=3, smac="00:00:00:01:03:00")
-
-        #   s2
-        getHashValue(p4info_helper, ingress_sw=s2, dst_ip_addr=["10.0.2.2", 32], ecmp_base=0, ecmp_count=1)
-        matchHashValue(p4info_helper, ingress_sw=s2, ecmp_select=0, nhop_dmac="00:00:00:00:02:02", nhop_ipv4="10.0.2.2", port=1)
-        sendFrame(p4info_helper, egress_sw=s2, egress_port=1, smac="00:00:00:02:01:00")
-
-        #   s3
-        getHashValue(p4info_helper, ingress_sw=s3, dst_ip_addr=["10.0.3.3", 32], ecmp_base=0, ecmp_count=1)
-        matchHashValue(p4info_helper, ingress_sw=s3, ecmp_select=0, nhop_dmac="00:00:00:00:03:03", nhop_ipv4="10.0.3.3", port=1)
-        sendFrame(p4info_helper, egress_sw=s3, egress_port=1, smac="00:00:00:03:01:00")
-
-        while True:
-            sleep(2)
-        
+        # 仲裁、在交换机上安装 P4 程序、写入插件的表项，然后运行事件循环
+        runtime.start()
+        runtime.run()
     except KeyboardInterrupt:
         print(" Shutting down.")
     except grpc.RpcError as e:
         printGrpcError(e)
 
-    ShutdownAllSwitchConnections()
+    runtime.shutdown()
 
 
 if __name__ == '__main__':
@@ -138,6 +150,8 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/load_balance.json')
+    parser.add_argument('--topo', help='topology.json used to discover the switches',
+                        type=str, action="store", required=False, default=None)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -148,4 +162,4 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    main(args.p4info, args.bmv2_json, args.topo)
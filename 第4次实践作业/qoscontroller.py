@@ -3,17 +3,39 @@
 import argparse
 import os
 import sys
-from time import sleep
+import time
 
 import grpc
 
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
-import p4runtime_lib.helper
 from p4runtime_lib.error_utils import printGrpcError
-from p4runtime_lib.switch import ShutdownAllSwitchConnections
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '..'))
+from p4ctl.batch import buildTableEntryFromSpec, writeTableEntries
+from p4ctl.externs import readCounter, writeMeterConfig
+from p4ctl.p4info_cache import loadP4InfoHelper
+from p4ctl.ring import RingBuffer
+from p4ctl.runtime import ControllerRuntime, Plugin
+from p4ctl.topo import loadRuntimeEntries, loadTopology
+
+# 按类别限速需要qos.p4在ipv4_forward确定出端口之后按(出端口, 类别)做计量：
+#   meter((NUM_PORTS + 1) * NUM_CLASSES, MeterType.bytes) class_meter;
+#   counter((NUM_PORTS + 1) * NUM_CLASSES * 3, CounterType.packets_and_bytes) colour_counter;
+# MyIngress中(class_id由diffserv得出，顺序与QOS_CLASSES相同)：
+#   bit<32> idx = (bit<32>)standard_metadata.egress_spec * NUM_CLASSES + class_id;
+#   class_meter.execute_meter(idx, meta.colour);       // 0 GREEN, 1 YELLOW, 2 RED
+#   colour_counter.count(idx * 3 + (bit<32>)meta.colour);
+#   if (meta.colour == 2) { drop(); }
+#   if (class_id == 0) { standard_metadata.priority = 7; }   // simple_switch --priority-queues
+CLASS_METER = 'MyIngress.class_meter'
+COLOUR_COUNTER = 'MyIngress.colour_counter'
+# 下标即data plane中的class_id；第0类为优先类别
+QOS_CLASSES = ('ef', 'af', 'be')
+COLOURS = ('green', 'yellow', 'red')
 
 
 def writeRule(p4info_helper, ingress_sw,
@@ -28,85 +50,272 @@ def writeRule(p4info_helper, ingress_sw,
             "dstAddr": dst_eth_addr,
             "port": switch_port
         })
-    ingress_sw.WriteTableEntry(table_entry)         # 调用WriteTableEntry，将生成的匹配动作表项加入交换机
+    writeTableEntries(ingress_sw, [table_entry])     # 经由writeTableEntries写入，使用仲裁时的sw.election_id
     print("Installed rule on %s" % ingress_sw.name)
 
 
-def main(p4info_file_path, bmv2_file_path):
-    # 初始化 p4info_helper
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+# 练习拓扑(s1、s2、s3)的静态路由：{交换机: [(目的MAC, (目的地址, 前缀长度), 出端口)]}
+ROUTES = {
+    's1': [
+        ("08:00:00:00:01:01", ("10.0.1.1", 32), 2),
+        ("08:00:00:00:01:11", ("10.0.1.11", 32), 1),
+        ("08:00:00:00:02:00", ("10.0.2.0", 24), 3),
+        ("08:00:00:00:03:00", ("10.0.3.0", 24), 4),
+    ],
+    's2': [
+        ("08:00:00:00:02:02", ("10.0.2.2", 32), 2),
+        ("08:00:00:00:02:22", ("10.0.2.22", 32), 1),
+        ("08:00:00:00:01:00", ("10.0.1.0", 24), 3),
+        ("08:00:00:00:03:00", ("10.0.3.0", 24), 4),
+    ],
+    's3': [
+        ("08:00:00:00:03:03", ("10.0.3.3", 32), 1),
+        ("08:00:00:00:01:00", ("10.0.1.0", 24), 2),
+        ("08:00:00:00:02:00", ("10.0.2.0", 24), 3),
+    ],
+}
+
+
+class QosRoutes(Plugin):
+    """
+    QoS练习的ipv4_lpm路由。给出topology.json时按各交换机的runtime_json写入，
+    没有runtime_json的交换机使用ROUTES中的静态路由。
+    """
+    name = 'qos'
+
+    def __init__(self, rules=None):
+        """
+        :param rules: {switch name: table_entries}, see loadRuntimeEntries
+        """
+        self.rules = rules or {}
+
+    def install(self, runtime):
+        for name in runtime.switch_names:
+            sw = runtime.switch(name)
+            if name in self.rules:
+                count = writeTableEntries(sw, (
+                    buildTableEntryFromSpec(runtime.p4info_helper, flow) for flow in self.rules[name]))
+                print("Installed %d entries on %s" % (count, name))
+            elif name in ROUTES:
+                for dst_eth_addr, dst_ip_addr, switch_port in ROUTES[name]:
+                    writeRule(runtime.p4info_helper, ingress_sw=sw, dst_eth_addr=dst_eth_addr,
+                              dst_ip_addr=dst_ip_addr, switch_port=switch_port)
+            else:
+                print("No routes for %s: it has no runtime_json in the topology" % name)
+
+
+def allocateRates(capacity, demands, guarantees, priority=0):
+    """
+    在一条链路上为各类别分配速率。优先类别始终承诺其保证份额，峰值速率等于
+    承诺速率，突发到来时不用等下一次重新分配；它用不完的部分只作为其他类别
+    的峰值余量(黄色报文可借用，在严格优先队列后面发送)。其他类别先得到
+    min(需求, 保证份额)，剩余带宽按保证份额的比例以注水方式分给需求未满足的
+    类别，仍有剩余时同样作为峰值余量。
+
+    :param capacity: link rate in bytes/s
+    :param demands: offered rate of each class in bytes/s
+    :param guarantees: guaranteed fraction of the link for each class
+    :param priority: index of the priority class
+    :return: list of (cir, pir) per class in bytes/s
+    """
+    alloc = [min(d, g * capacity) for d, g in zip(demands, guarantees)]
+    alloc[priority] = guarantees[priority] * capacity
+    idle = max(0.0, alloc[priority] - demands[priority])
+    spare = capacity - sum(alloc)
+    hungry = set(i for i, d in enumerate(demands) if i != priority and d > alloc[i])
+    while spare > 1e-6 and hungry:
+        weight = sum(guarantees[i] for i in hungry)
+        given = 0.0
+        for i in list(hungry):
+            share = spare * guarantees[i] / weight if weight else spare / len(hungry)
+            grant = min(share, demands[i] - alloc[i])
+            alloc[i] += grant
+            given += grant
+            if demands[i] - alloc[i] <= 1e-6:
+                hungry.discard(i)
+        spare -= given
+        if given <= 1e-6:
+            break
+    return [(a, a if i == priority else a + spare + idle) for i, a in enumerate(alloc)]
+
+
+class ClassStats(object):
+    """
+    一个(出端口, 类别)最近history个周期各颜色的速率(字节/秒)，以及当前写入的meter参数。
+    """
+    __slots__ = ('green', 'yellow', 'red', 'cir', 'pir', 'changes')
+
+    def __init__(self, history):
+        self.green = RingBuffer(history)
+        self.yellow = RingBuffer(history)
+        self.red = RingBuffer(history)
+        self.cir = 0.0
+        self.pir = 0.0
+        self.changes = 0
+
+    def offered(self, n):
+        return self.green.mean(n) + self.yellow.mean(n) + self.red.mean(n)
+
+
+class QosMeters(Plugin):
+    """
+    按(出端口, DSCP类别)配置双速率三色meter，周期性地读取各颜色的字节计数，
+    把空闲类别用不完的带宽重新分给有积压的类别(见allocateRates)。
+    """
+    name = 'qos-meters'
+
+    def __init__(self, ports=(1, 2, 3, 4), link_rate=1250000, guarantees=(0.2, 0.5, 0.3),
+                 interval=1.0, window=3, headroom=1.2, min_share=0.05, burst_time=0.005,
+                 history=60, tolerance=0.05):
+        """
+        :param link_rate: egress link rate in bytes/s
+        :param guarantees: guaranteed fraction of the link for each of QOS_CLASSES
+        :param headroom: demand is the measured offered rate times headroom, so a
+                         class can grow before the next reallocation
+        :param min_share: every other class keeps at least this fraction of
+                          its guarantee, so that a class becoming active is not
+                          starved until the next interval
+        :param burst_time: committed/peak burst sizes in seconds of traffic
+        :param tolerance: relative rate change below which a meter is not rewritten
+        """
+        self.ports = list(ports)
+        self.link_rate = link_rate
+        self.guarantees = list(guarantees)
+        self.interval = interval
+        self.window = window
+        self.headroom = headroom
+        self.min_share = min_share
+        self.burst_time = burst_time
+        self.history = history
+        self.tolerance = tolerance
+        self.enabled = False
+        self.stats = {}
+        self._prev = {}
+        self._configured = set()
+
+    def _index(self, port, cls):
+        return port * len(QOS_CLASSES) + cls
+
+    def _config(self, cir, pir):
+        # 突发量至少容纳一个MTU大小的报文
+        return (cir, max(1500, cir * self.burst_time), pir, max(1500, pir * self.burst_time))
+
+    def install(self, runtime):
+        try:
+            runtime.p4info_helper.get('meters', name=CLASS_METER)
+            runtime.p4info_helper.get('counters', name=COLOUR_COUNTER)
+        except AttributeError as e:
+            print("QoS meters disabled: %s" % e)
+            return
+        self.enabled = True
+        for name in runtime.switch_names:
+            self._configure(runtime, name)
+        print("QoS meters configured on ports %s: %s" % (self.ports, ', '.join(
+            "%s=%d%%" % (c, g * 100) for c, g in zip(QOS_CLASSES, self.guarantees))))
+
+    def _configure(self, runtime, name):
+        """
+        建立交换机name各(端口, 类别)的统计并写入初始meter配置。install之后经
+        runtime.addSwitch加入的交换机在下一次step时配置。
+        """
+        # 初始时每个类别按保证份额承诺，峰值可以用满链路
+        rates = [(g * self.link_rate, self.link_rate) for g in self.guarantees]
+        rates[0] = (rates[0][0], rates[0][0])
+        configs = {}
+        for port in self.ports:
+            for cls, (cir, pir) in enumerate(rates):
+                stats = ClassStats(self.history)
+                stats.cir, stats.pir = cir, pir
+                self.stats[(name, port, cls)] = stats
+                configs[self._index(port, cls)] = self._config(cir, pir)
+        writeMeterConfig(runtime.switch(name), runtime.p4info_helper, CLASS_METER, configs)
+        self._configured.add(name)
+
+    def tasks(self, runtime):
+        if not self.enabled:
+            return []
+        return [('qos-meters', self.interval, self.step)]
+
+    def _sample(self, runtime, name):
+        now = time.perf_counter()
+        _, byte_counts = readCounter(runtime.switch(name), runtime.p4info_helper, COLOUR_COUNTER)
+        prev = self._prev.get(name)
+        self._prev[name] = (now, byte_counts)
+        if prev is None:
+            return False
+        elapsed = now - prev[0]
+        for port in self.ports:
+            for cls in range(len(QOS_CLASSES)):
+                base = self._index(port, cls) * 3
+                stats = self.stats[(name, port, cls)]
+                for colour, ring in enumerate((stats.green, stats.yellow, stats.red)):
+                    ring.append((byte_counts[base + colour] - prev[1][base + colour]) / elapsed)
+        return True
+
+    def _changed(self, old, new):
+        return abs(new - old) > self.tolerance * max(old, 1.0)
+
+    def step(self, runtime):
+        for name in runtime.switch_names:
+            if name not in self._configured:
+                self._configure(runtime, name)
+            if not self._sample(runtime, name):
+                continue
+            configs = {}
+            for port in self.ports:
+                classes = [self.stats[(name, port, cls)] for cls in range(len(QOS_CLASSES))]
+                demands = [max(s.offered(self.window) * self.headroom,
+                               g * self.min_share * self.link_rate)
+                           for s, g in zip(classes, self.guarantees)]
+                rates = allocateRates(self.link_rate, demands, self.guarantees)
+                for cls, (stats, (cir, pir)) in enumerate(zip(classes, rates)):
+                    if self._changed(stats.cir, cir) or self._changed(stats.pir, pir):
+                        stats.cir, stats.pir = cir, pir
+                        stats.changes += 1
+                        configs[self._index(port, cls)] = self._config(cir, pir)
+            if configs:
+                # 一个周期内同一台交换机的所有meter改动合并为一次写入
+                writeMeterConfig(runtime.switch(name), runtime.p4info_helper,
+                                 CLASS_METER, configs)
+
+    def printSummary(self):
+        if not self.enabled:
+            return
+        print('\n----- QoS meters (bytes/s) -----')
+        for (name, port, cls), s in sorted(self.stats.items()):
+            print("%-4s port %d %-3s: cir=%-9.0f pir=%-9.0f changes=%-4d "
+                  "green=%.0f yellow=%.0f red=%.0f" % (
+                      name, port, QOS_CLASSES[cls], s.cir, s.pir, s.changes,
+                      s.green.mean(self.window), s.yellow.mean(self.window),
+                      s.red.mean(self.window)))
+
+
+def main(p4info_file_path, bmv2_file_path, topo_file_path=None,
+         link_rate=1250000, meter_interval=1.0):
+    # 初始化 p4info_helper(解析结果缓存在p4info旁边的.cache文件中)
+    p4info_helper = loadP4InfoHelper(p4info_file_path)
+
+    # 交换机连接由运行时统一建立：有topology.json时按拓扑，否则沿用s1、s2、s3
+    # 此外，由后台线程把发送给交换机的所有 P4Runtime 消息以二进制形式转存到
+    # logs/sX-p4runtime-requests.bin(用 python -m p4ctl.msglog 转换为文本)
+    topo = loadTopology(topo_file_path) if topo_file_path else None
+    runtime = ControllerRuntime(p4info_helper, bmv2_file_path, topo=topo,
+                                switch_names=['s1', 's2', 's3'])
+    # runtime_json路径相对于运行make的练习目录，即当前目录
+    runtime.addPlugin(QosRoutes(loadRuntimeEntries(topo, '.') if topo else None))
+    meters = runtime.addPlugin(QosMeters(link_rate=link_rate, interval=meter_interval))
 
     try:
-        # 为s1、s2、s3创建交换机连接对象
-        # 这是由一个运行时gRPC连接支持的
-        # 此外，将发送给交换机的所有 P4Runtime 消息转存到给定的 txt 文件
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
-
-        # Send master arbitration update message to establish this controller as
-        # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
-
-        # 在交换机上安装 P4 程序
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-
-        writeRule(p4info_helper, ingress_sw=s1,
-                   dst_eth_addr="08:00:00:00:01:01", dst_ip_addr=("10.0.1.1", 32), switch_port=2)
-        writeRule(p4info_helper, ingress_sw=s1,
-                   dst_eth_addr="08:00:00:00:01:11", dst_ip_addr=("10.0.1.11", 32), switch_port=1)
-        writeRule(p4info_helper, ingress_sw=s1,
-                   dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=("10.0.2.0", 24), switch_port=3)
-        writeRule(p4info_helper, ingress_sw=s1,
-                   dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=("10.0.3.0", 24), switch_port=4)
-
-        writeRule(p4info_helper, ingress_sw=s2,
-                   dst_eth_addr="08:00:00:00:02:02", dst_ip_addr=("10.0.2.2", 32), switch_port=2)
-        writeRule(p4info_helper, ingress_sw=s2,
-                   dst_eth_addr="08:00:00:00:02:22", dst_ip_addr=("10.0.2.22", 32), switch_port=1)
-        writeRule(p4info_helper, ingress_sw=s2,
-                   dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=("10.0.1.0", 24), switch_port=3)
-        writeRule(p4info_helper, ingress_sw=s2,
-                   dst_eth_addr="08:00:00:00:03:00", dst_ip_addr=("10.0.3.0", 24), switch_port=4)
-
-        writeRule(p4info_helper, ingress_sw=s3,
-                   dst_eth_addr="08:00:00:00:03:03", dst_ip_addr=("10.0.3.3", 32), switch_port=1)
-        writeRule(p4info_helper, ingress_sw=s3,
-                   dst_eth_addr="08:00:00:00:01:00", dst_ip_addr=("10.0.1.0", 24), switch_port=2)
-        writeRule(p4info_helper, ingress_sw=s3,
-                   dst_eth_addr="08:00:00:00:02:00", dst_ip_addr=("10.0.2.0", 24), switch_port=3)
-
-        while True:
-            sleep(2)
-        
+        # 仲裁、在交换机上安装 P4 程序、写入插件的表项，然后运行事件循环
+        runtime.start()
+        runtime.run()
     except KeyboardInterrupt:
         print(" Shutting down.")
     except grpc.RpcError as e:
         printGrpcError(e)
 
-    ShutdownAllSwitchConnections()
+    runtime.shutdown()
+    meters.printSummary()
 
 
 if __name__ == '__main__':
@@ -117,6 +326,12 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/qos.json')
+    parser.add_argument('--topo', help='topology.json used to discover the switches',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--link-rate', help='egress link rate in Mbit/s shared by the QoS classes',
+                        type=float, action="store", required=False, default=10.0)
+    parser.add_argument('--meter-interval', help='seconds between meter reallocations',
+                        type=float, action="store", required=False, default=1.0)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -127,4 +342,5 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    main(args.p4info, args.bmv2_json, args.topo,
+         args.link_rate * 1e6 / 8, args.meter_interval)